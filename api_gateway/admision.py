@@ -0,0 +1,124 @@
+"""
+Control de admisión del API Gateway
+
+- LimitadorPorCliente: token bucket por cliente (API key o IP), O(1) por
+  petición y con memoria acotada (los clientes menos recientes se descartan).
+- ControlAdmision: límite de peticiones concurrentes por microservicio con
+  una cola de espera acotada y descarte adaptativo cuando la espera en cola
+  supera el objetivo, para responder rápido en lugar de acumular latencia.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+class Rechazado(Exception):
+    """La petición no se admite; incluye el código HTTP y el Retry-After sugerido"""
+
+    def __init__(self, status_code: int, retry_after: float, detalle: str):
+        super().__init__(detalle)
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.detalle = detalle
+
+class LimitadorPorCliente:
+    """Token bucket por cliente con un número máximo de clientes recordados"""
+
+    def __init__(self, tasa: float, rafaga: float, max_clientes: int = 10000):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.max_clientes = max_clientes
+        # clave -> [tokens disponibles, instante de la última recarga]
+        self._cubetas = OrderedDict()
+
+    @property
+    def activo(self) -> bool:
+        return self.tasa > 0
+
+    def consumir(self, clave: str, ahora: float = None) -> float:
+        """
+        Consumir un token del cliente. Devuelve 0 si la petición se admite o,
+        si no, los segundos que faltan para disponer de un token.
+        """
+        ahora = time.monotonic() if ahora is None else ahora
+        cubeta = self._cubetas.get(clave)
+        if cubeta is None:
+            cubeta = [self.rafaga, ahora]
+            self._cubetas[clave] = cubeta
+            if len(self._cubetas) > self.max_clientes:
+                self._cubetas.popitem(last=False)
+        else:
+            self._cubetas.move_to_end(clave)
+            cubeta[0] = min(self.rafaga, cubeta[0] + (ahora - cubeta[1]) * self.tasa)
+            cubeta[1] = ahora
+
+        if cubeta[0] >= 1:
+            cubeta[0] -= 1
+            return 0.0
+        return (1 - cubeta[0]) / self.tasa
+
+class ControlAdmision:
+    """Límite de concurrencia hacia un microservicio con cola acotada y descarte adaptativo"""
+
+    def __init__(self, max_concurrencia: int, max_cola: int, objetivo_espera: float):
+        self.max_concurrencia = max_concurrencia
+        self.max_cola = max_cola
+        self.objetivo_espera = objetivo_espera
+        # Tiempo máximo que una petición puede esperar en la cola
+        self.espera_maxima = objetivo_espera * 4
+        self.en_curso = 0
+        self.esperando = 0
+        self.espera_media = 0.0
+        self._cola = deque()
+
+    def _registrar_espera(self, segundos: float):
+        # Media móvil exponencial de la espera en cola
+        self.espera_media = 0.8 * self.espera_media + 0.2 * segundos
+
+    async def adquirir(self):
+        """Obtener una ranura o lanzar Rechazado si hay que descartar la petición"""
+        if self.en_curso < self.max_concurrencia and self.esperando == 0:
+            self.en_curso += 1
+            self._registrar_espera(0.0)
+            return
+
+        if self.esperando >= self.max_cola:
+            raise Rechazado(503, self.espera_maxima, "Servicio saturado, cola de espera llena")
+        if self.espera_media > self.objetivo_espera:
+            raise Rechazado(503, self.espera_media, "Servicio saturado, reintente más tarde")
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._cola.append(futuro)
+        self.esperando += 1
+        inicio = time.monotonic()
+        try:
+            await asyncio.wait_for(futuro, self.espera_maxima)
+        except asyncio.TimeoutError:
+            self._registrar_espera(time.monotonic() - inicio)
+            raise Rechazado(503, self.espera_maxima, "Tiempo máximo de espera en cola superado")
+        except asyncio.CancelledError:
+            # Si la ranura ya se había cedido a esta petición, devolverla
+            if futuro.done() and not futuro.cancelled():
+                self.liberar()
+            raise
+        finally:
+            self.esperando -= 1
+        self._registrar_espera(time.monotonic() - inicio)
+
+    def liberar(self):
+        """Liberar una ranura, cediéndola a la primera petición en espera si la hay"""
+        while self._cola:
+            futuro = self._cola.popleft()
+            if not futuro.done():
+                futuro.set_result(None)
+                return
+        self.en_curso -= 1
+
+    @asynccontextmanager
+    async def ranura(self):
+        await self.adquirir()
+        try:
+            yield
+        finally:
+            self.liberar()
@@ -2,16 +2,190 @@
 API Gateway
 Enruta las peticiones a los microservicios correspondientes
 """
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, HTTPException, Depends
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 import httpx
+import asyncio
+import json
+import sys
 import os
+import time
+from typing import Optional
+from urllib.parse import urlencode
+
+# Agregar el directorio padre al path para importar los módulos del proyecto
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api_gateway.admision import LimitadorPorCliente, ControlAdmision, Rechazado
+from api_gateway.balanceo import GrupoUpstream, parsear_urls
+from api_gateway.compresion import CompresionMiddleware
+from api_gateway.eventos import DifusorEventos
+from api_gateway.multiplexado import PeticionLote, LoteInvalido, validar_lote, ejecutar_lote
+from comun.diagnostico import crear_router_diagnostico
+from comun.cache import cache_desde_entorno
 
 app = FastAPI(title="API Gateway - Recetario Familiar", version="1.0.0")
 
-# URLs de los microservicios
-RECETAS_SERVICE_URL = os.getenv("RECETAS_SERVICE_URL", "http://localhost:8001")
-INGREDIENTES_SERVICE_URL = os.getenv("INGREDIENTES_SERVICE_URL", "http://localhost:8002")
+# Perfilado y memoria en caliente (/debug/*), solo con DEBUG_TOKEN definido
+app.include_router(crear_router_diagnostico())
+
+# Compresión negociada (gzip, y br/zstd si están instalados) de las
+# respuestas de al menos COMPRESION_UMBRAL_BYTES
+app.add_middleware(
+    CompresionMiddleware,
+    umbral=int(os.getenv("COMPRESION_UMBRAL_BYTES", "1024")),
+    cache_bytes=int(float(os.getenv("COMPRESION_CACHE_MB", "0")) * 1024 * 1024)
+)
+
+# URLs de los microservicios. Cada variable admite varias instancias
+# separadas por comas; las rutas se arman con la primera y el balanceador
+# cambia la base por la instancia elegida en cada petición.
+RECETAS_INSTANCIAS = parsear_urls(os.getenv("RECETAS_SERVICE_URL", "http://localhost:8001"))
+INGREDIENTES_INSTANCIAS = parsear_urls(os.getenv("INGREDIENTES_SERVICE_URL", "http://localhost:8002"))
+RECETAS_SERVICE_URL = RECETAS_INSTANCIAS[0]
+INGREDIENTES_SERVICE_URL = INGREDIENTES_INSTANCIAS[0]
+
+# Balanceo entre instancias (ver api_gateway/balanceo.py)
+grupos_upstream = {
+    instancias[0]: GrupoUpstream(
+        instancias,
+        politica=os.getenv("BALANCEO_POLITICA", "p2c"),
+        max_fallos=int(os.getenv("BALANCEO_MAX_FALLOS", "5")),
+        latencia_max=float(os.getenv("BALANCEO_LATENCIA_MAX_MS", "0")) / 1000,
+        expulsion=float(os.getenv("BALANCEO_EXPULSION_SEGUNDOS", "30")),
+        lento_inicio=float(os.getenv("BALANCEO_LENTO_INICIO_SEGUNDOS", "30"))
+    )
+    for instancias in (RECETAS_INSTANCIAS, INGREDIENTES_INSTANCIAS)
+}
+# Segundos entre verificaciones activas (0 las desactiva; con una sola instancia no se hacen)
+BALANCEO_INTERVALO_SALUD = float(os.getenv("BALANCEO_INTERVALO_SALUD", "10"))
+
+# Modo de despliegue: "proxy" (servicios en procesos separados, vía HTTP) o
+# "monolito" (las apps de los servicios se cargan en este mismo proceso y se
+# les despacha directamente por ASGI, sin sockets)
+GATEWAY_MODO = os.getenv("GATEWAY_MODO", "proxy")
+
+_transportes_locales = {}
+if GATEWAY_MODO == "monolito":
+    from servicio_recetas.app import app as recetas_app
+    from servicio_ingredientes.app import app as ingredientes_app
+
+    _transportes_locales = {
+        **{url: httpx.ASGITransport(app=recetas_app) for url in RECETAS_INSTANCIAS},
+        **{url: httpx.ASGITransport(app=ingredientes_app) for url in INGREDIENTES_INSTANCIAS},
+    }
+
+    # Los eventos de startup y shutdown de las apps montadas no se ejecutan
+    # solos (el ejecutor de trabajos, el snapshot...): se disparan desde aquí
+    @app.on_event("startup")
+    async def startup_servicios():
+        for servicio in (recetas_app, ingredientes_app):
+            await servicio.router.startup()
+
+    @app.on_event("shutdown")
+    async def shutdown_servicios():
+        for servicio in (recetas_app, ingredientes_app):
+            await servicio.router.shutdown()
+
+# El estado del control de admisión vive en la memoria de cada worker: los
+# límites configurados son del gateway completo y se reparten entre los
+# GUNICORN_WORKERS procesos (gunicorn.conf.py lo define para sus workers)
+GATEWAY_WORKERS = max(1, int(os.getenv("GUNICORN_WORKERS", "1")))
+
+def por_worker(valor: float, minimo: float = 1) -> float:
+    """Parte de un límite del gateway que le toca a cada worker (0 sigue significando desactivado)"""
+    return max(minimo, valor / GATEWAY_WORKERS) if valor > 0 else valor
+
+# Control de admisión: límite de tasa por cliente (LIMITE_TASA=0 lo desactiva)
+# y concurrencia máxima por microservicio con cola de espera acotada
+limitador = LimitadorPorCliente(
+    tasa=por_worker(float(os.getenv("LIMITE_TASA", "50")), minimo=0.001),
+    rafaga=por_worker(float(os.getenv("LIMITE_RAFAGA", "100"))),
+    max_clientes=int(os.getenv("LIMITE_MAX_CLIENTES", "10000"))
+)
+# (MAX_CONCURRENCIA_UPSTREAM es por instancia)
+controles_admision = {
+    base_url: ControlAdmision(
+        max_concurrencia=int(por_worker(int(os.getenv("MAX_CONCURRENCIA_UPSTREAM", "64")) * len(grupo.instancias))),
+        max_cola=int(por_worker(int(os.getenv("MAX_COLA_UPSTREAM", "256")))),
+        objetivo_espera=float(os.getenv("OBJETIVO_ESPERA_MS", "100")) / 1000
+    )
+    for base_url, grupo in grupos_upstream.items()
+}
+# API keys reconocidas (API_KEYS, separadas por comas). Sólo una key de esta
+# lista identifica al cliente: cualquier otra se ignora y cuenta su IP, así
+# rotar el header no da cubetas nuevas ni desplaza a otros clientes del LRU
+API_KEYS_VALIDAS = frozenset(key.strip() for key in os.getenv("API_KEYS", "").split(",") if key.strip())
+
+# Peticiones multiplexadas (POST /api/batch)
+BATCH_MAX_PETICIONES = int(os.getenv("BATCH_MAX_PETICIONES", "50"))
+BATCH_MAX_CONCURRENCIA = int(os.getenv("BATCH_MAX_CONCURRENCIA", "8"))
+# Headers del cliente que se propagan a cada subpetición
+HEADERS_PROPAGADOS = ("x-api-key", "authorization", "x-forwarded-for")
+
+# Caché compartida de respuestas GET (ver comun/cache.py), desactivada sin
+# CACHE_URL. Con la misma CACHE_URL que los servicios comparte con ellos las
+# versiones de los grupos: una escritura en cualquier servicio invalida
+# también lo cacheado aquí, en todas las instancias del gateway
+cache_gateway = cache_desde_entorno()
+GRUPOS_CACHE = ("recetas", "ingredientes")
+
+def clave_cliente(request: Request) -> str:
+    """Identificar al cliente por su API key si es una de API_KEYS o, si no, por su IP"""
+    api_key = request.headers.get("x-api-key")
+    if api_key and api_key in API_KEYS_VALIDAS:
+        return f"key:{api_key}"
+    return f"ip:{request.client.host if request.client else 'desconocido'}"
+
+def verificar_limite_cliente(request: Request):
+    """Dependencia que aplica el límite de tasa por cliente"""
+    if not limitador.activo:
+        return
+    espera = limitador.consumir(clave_cliente(request))
+    if espera > 0:
+        rechazo = Rechazado(429, espera, "Demasiadas peticiones, reintente más tarde")
+        raise HTTPException(
+            status_code=rechazo.status_code,
+            detail=rechazo.detalle,
+            headers={"Retry-After": str(rechazo.retry_after)}
+        )
+
+def control_para(url: str) -> ControlAdmision:
+    """Control de admisión del microservicio al que apunta la URL"""
+    for base_url, control in controles_admision.items():
+        if url.startswith(base_url):
+            return control
+    return None
+
+async def adquirir_ranura(url: str) -> ControlAdmision:
+    """Reservar una ranura en el microservicio o responder 503 con Retry-After"""
+    control = control_para(url)
+    if control is None:
+        return None
+    try:
+        await control.adquirir()
+    except Rechazado as rechazo:
+        raise HTTPException(
+            status_code=rechazo.status_code,
+            detail=rechazo.detalle,
+            headers={"Retry-After": str(rechazo.retry_after)}
+        )
+    return control
+
+def grupo_para(url: str) -> GrupoUpstream:
+    """Grupo de instancias del microservicio al que apunta la URL"""
+    for base_url, grupo in grupos_upstream.items():
+        if url.startswith(base_url):
+            return grupo
+    return None
+
+def crear_cliente(url: str) -> httpx.AsyncClient:
+    """Crear el cliente HTTP adecuado para llegar a la URL de un microservicio"""
+    for base_url, transporte in _transportes_locales.items():
+        if url.startswith(base_url):
+            return httpx.AsyncClient(transport=transporte)
+    return httpx.AsyncClient()
 
 @app.get("/")
 def root():
@@ -19,82 +193,393 @@ def root():
     return {
         "mensaje": "API Gateway - Recetario de Cocina Familiar",
         "version": "1.0.0",
+        "modo": GATEWAY_MODO,
         "servicios": {
-            "recetas": f"{RECETAS_SERVICE_URL}",
-            "ingredientes": f"{INGREDIENTES_SERVICE_URL}"
+            "recetas": ",".join(RECETAS_INSTANCIAS),
+            "ingredientes": ",".join(INGREDIENTES_INSTANCIAS)
         },
         "endpoints": {
             "recetas": "/api/recetas",
-            "ingredientes": "/api/ingredientes"
+            "ingredientes": "/api/ingredientes",
+            "cambios": "/api/cambios",
+            "batch": "/api/batch",
+            "jobs": "/api/jobs",
+            "eventos": "/api/eventos",
+            "estadisticas": "/api/estadisticas"
         }
     }
 
-@app.get("/health")
-async def health_check():
-    """Verificar el estado de todos los servicios"""
-    services_status = {}
-    
-    # Verificar servicio de recetas
+async def consultar_instancia(url: str, ruta: str, timeout: float) -> str:
+    """Consultar `ruta` en una instancia: "ok" o el motivo del fallo"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{RECETAS_SERVICE_URL}/health", timeout=5.0)
-            services_status["recetas"] = "healthy" if response.status_code == 200 else "unhealthy"
+        async with crear_cliente(url) as client:
+            response = await client.get(f"{url}{ruta}", timeout=timeout)
+            return "ok" if response.status_code == 200 else f"status {response.status_code}"
     except Exception as e:
-        services_status["recetas"] = f"unhealthy: {str(e)}"
-    
-    # Verificar servicio de ingredientes
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{INGREDIENTES_SERVICE_URL}/health", timeout=5.0)
-            services_status["ingredientes"] = "healthy" if response.status_code == 200 else "unhealthy"
-    except Exception as e:
-        services_status["ingredientes"] = f"unhealthy: {str(e)}"
+        return str(e) or type(e).__name__
+
+async def consultar_grupo(grupo: GrupoUpstream, ruta: str, timeout: float) -> list:
+    """Resultado de consultar `ruta` en todas las instancias del grupo, en paralelo"""
+    return await asyncio.gather(*(
+        consultar_instancia(instancia.url, ruta, timeout) for instancia in grupo.instancias
+    ))
+
+async def verificar_instancias():
+    """Verificación activa periódica de las instancias de los grupos con más de una"""
+    async def lista(url: str) -> bool:
+        return await consultar_instancia(url, "/ready", 2.0) == "ok"
+
+    grupos = [grupo for grupo in grupos_upstream.values() if len(grupo.instancias) > 1]
+    while grupos:
+        await asyncio.gather(*(grupo.verificar(lista) for grupo in grupos))
+        await asyncio.sleep(BALANCEO_INTERVALO_SALUD)
+
+@app.on_event("startup")
+async def iniciar_verificacion_instancias():
+    if BALANCEO_INTERVALO_SALUD > 0 and any(len(grupo.instancias) > 1 for grupo in grupos_upstream.values()):
+        app.state.verificacion_instancias = asyncio.create_task(verificar_instancias())
+
+@app.get("/health")
+async def health_check():
+    """Verificar el estado de todos los servicios (sano si responde alguna de sus instancias)"""
+    servicios = {"recetas": RECETAS_SERVICE_URL, "ingredientes": INGREDIENTES_SERVICE_URL}
+    resultados = await asyncio.gather(*(
+        consultar_grupo(grupos_upstream[url], "/health", 5.0) for url in servicios.values()
+    ))
+    services_status = {
+        nombre: "healthy" if "ok" in resultado else f"unhealthy: {resultado[0]}"
+        for nombre, resultado in zip(servicios, resultados)
+    }
     
     all_healthy = all(status == "healthy" for status in services_status.values())
     
     return {
         "status": "healthy" if all_healthy else "degraded",
-        "services": services_status
+        "services": services_status,
+        "instancias": {nombre: grupos_upstream[url].estado() for nombre, url in servicios.items()}
     }
 
-@app.api_route("/api/recetas/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
+@app.get("/ready")
+async def readiness_check():
+    """Verificar que los microservicios están listos para recibir tráfico (alguna instancia de cada uno)"""
+    recetas, ingredientes = await asyncio.gather(
+        consultar_grupo(grupos_upstream[RECETAS_SERVICE_URL], "/ready", 2.0),
+        consultar_grupo(grupos_upstream[INGREDIENTES_SERVICE_URL], "/ready", 2.0)
+    )
+    recetas_listo, ingredientes_listo = "ok" in recetas, "ok" in ingredientes
+    services_status = {
+        "recetas": "ready" if recetas_listo else "not_ready",
+        "ingredientes": "ready" if ingredientes_listo else "not_ready"
+    }
+
+    if not (recetas_listo and ingredientes_listo):
+        return JSONResponse(
+            status_code=503,
+            content={"status": "not_ready", "services": services_status}
+        )
+    return {"status": "ready", "services": services_status}
+
+@app.get("/api/recetas/export", dependencies=[Depends(verificar_limite_cliente)])
+async def exportar_recetas(request: Request):
+    """Exportación NDJSON de recetas, reenviada en streaming"""
+    return await forward_stream(f"{RECETAS_SERVICE_URL}/recetas/export", request)
+
+@app.get("/api/ingredientes/export", dependencies=[Depends(verificar_limite_cliente)])
+async def exportar_ingredientes(request: Request):
+    """Exportación NDJSON de ingredientes, reenviada en streaming"""
+    return await forward_stream(f"{INGREDIENTES_SERVICE_URL}/ingredientes/export", request)
+
+async def consultar_cambios(desde: int, limit: int) -> dict:
+    """
+    Cambios de recetas e ingredientes posteriores a `desde`.
+
+    Cada servicio devuelve sus primeros `limit` eventos; al mezclarlos por
+    `seq` y recortar, el resultado son exactamente los primeros `limit`
+    eventos globales.
+    """
+    params = {"desde": desde, "limit": limit}
+    de_recetas, de_ingredientes = await asyncio.gather(
+        consultar_json(f"{RECETAS_SERVICE_URL}/cambios", params),
+        consultar_json(f"{INGREDIENTES_SERVICE_URL}/cambios", params)
+    )
+    cambios = sorted(
+        de_recetas["cambios"] + de_ingredientes["cambios"],
+        key=lambda cambio: cambio["seq"]
+    )[:limit]
+    ultimo_seq = cambios[-1]["seq"] if cambios else desde
+    return {
+        "cambios": cambios,
+        "ultimo_seq": ultimo_seq,
+        "seq_actual": max(
+            respuesta.get("seq_actual", ultimo_seq) for respuesta in (de_recetas, de_ingredientes)
+        )
+    }
+
+@app.get("/api/cambios", dependencies=[Depends(verificar_limite_cliente)])
+async def listar_cambios(desde: int = 0, limit: int = 100):
+    """Feed de cambios de recetas e ingredientes posteriores a `desde`, en orden de `seq`"""
+    return await consultar_cambios(desde, min(max(limit, 1), 1000))
+
+@app.get("/api/estadisticas", dependencies=[Depends(verificar_limite_cliente)])
+async def estadisticas(top: int = 10, ids: Optional[str] = None):
+    """
+    Estadísticas de uso de ambos servicios: total de recetas e ingredientes,
+    ingredientes más usados, ingredientes por categoría y, con `ids`, las
+    recetas que usan cada ingrediente
+    """
+    de_recetas, de_ingredientes = await asyncio.gather(
+        consultar_json(f"{RECETAS_SERVICE_URL}/estadisticas", {"top": top}),
+        consultar_json(f"{INGREDIENTES_SERVICE_URL}/estadisticas", {"ids": ids} if ids else None)
+    )
+    return {**de_recetas, **de_ingredientes}
+
+# Eventos en vivo por SSE (ver api_gateway/eventos.py): una sola consulta
+# periódica de /cambios por proceso, repartida entre todos los clientes
+ENTIDADES_EVENTOS = ("receta", "paso", "ingrediente")
+difusor_eventos = DifusorEventos(
+    consultar_cambios,
+    intervalo=float(os.getenv("EVENTOS_INTERVALO", "1")),
+    tamano_cola=int(os.getenv("EVENTOS_COLA_MAX", "100")),
+    historial=int(os.getenv("EVENTOS_HISTORIAL", "1000")),
+    latido=float(os.getenv("EVENTOS_LATIDO_SEGUNDOS", "15")),
+    duracion_max=float(os.getenv("EVENTOS_DURACION_MAX_SEGUNDOS", "600")),
+    max_clientes=int(os.getenv("EVENTOS_MAX_CLIENTES", "10000"))
+)
+
+@app.get("/api/eventos", dependencies=[Depends(verificar_limite_cliente)])
+async def eventos_en_vivo(request: Request, entidades: Optional[str] = None, desde: Optional[int] = None):
+    """
+    Stream SSE con cada cambio de recetas, pasos e ingredientes. Se reanuda
+    desde el header Last-Event-ID (o `desde`, para la primera conexión);
+    `entidades=receta,ingrediente` filtra por tipo.
+    """
+    seleccion = None
+    if entidades:
+        seleccion = [entidad.strip() for entidad in entidades.split(",") if entidad.strip()]
+        invalidas = set(seleccion) - set(ENTIDADES_EVENTOS)
+        if invalidas:
+            raise HTTPException(status_code=400, detail=f"Entidades no soportadas: {sorted(invalidas)}")
+    ultimo_id = request.headers.get("last-event-id")
+    if ultimo_id is not None:
+        try:
+            desde = int(ultimo_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID inválido")
+    if difusor_eventos.clientes >= difusor_eventos.max_clientes:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Demasiadas conexiones de eventos"},
+            headers={"Retry-After": "5"}
+        )
+    return StreamingResponse(
+        difusor_eventos.flujo(desde, seleccion),
+        media_type="text/event-stream",
+        # Sin caché ni buffering en proxies intermedios (nginx)
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/batch", dependencies=[Depends(verificar_limite_cliente)])
+async def ejecutar_peticiones(lote: PeticionLote, request: Request):
+    """
+    Ejecutar varias peticiones a la API en una sola llamada. Cada una se
+    resuelve como si el cliente la hubiera hecho por separado (mismos límites
+    y control de admisión) y el resultado incluye su propio status.
+    """
+    try:
+        validar_lote(lote.peticiones, BATCH_MAX_PETICIONES)
+    except LoteInvalido as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    
+    headers = {"accept-encoding": "identity"}
+    for nombre in HEADERS_PROPAGADOS:
+        if nombre in request.headers:
+            headers[nombre] = request.headers[nombre]
+    cliente = (request.client.host, request.client.port) if request.client else ("desconocido", 0)
+    resultados = await ejecutar_lote(app, lote.peticiones, headers, cliente, BATCH_MAX_CONCURRENCIA)
+    return {"resultados": resultados}
+
+@app.api_route(
+    "/api/recetas/{path:path}",
+    methods=["GET", "POST", "PUT", "PATCH", "DELETE"],
+    dependencies=[Depends(verificar_limite_cliente)]
+)
 async def proxy_recetas(path: str, request: Request):
     """Proxy para el microservicio de recetas"""
     url = f"{RECETAS_SERVICE_URL}/recetas/{path}" if path else f"{RECETAS_SERVICE_URL}/recetas"
-    return await forward_request(url, request)
+    return await forward_cacheado(url, request, "recetas")
 
-@app.api_route("/api/ingredientes/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
+@app.api_route(
+    "/api/ingredientes/{path:path}",
+    methods=["GET", "POST", "PUT", "PATCH", "DELETE"],
+    dependencies=[Depends(verificar_limite_cliente)]
+)
 async def proxy_ingredientes(path: str, request: Request):
     """Proxy para el microservicio de ingredientes"""
     url = f"{INGREDIENTES_SERVICE_URL}/ingredientes/{path}" if path else f"{INGREDIENTES_SERVICE_URL}/ingredientes"
-    return await forward_request(url, request)
+    return await forward_cacheado(url, request, "ingredientes")
+
+@app.get("/api/jobs/{trabajo_id}/resultado", dependencies=[Depends(verificar_limite_cliente)])
+async def descargar_resultado_trabajo(trabajo_id: int, request: Request):
+    """Descargar el archivo de un trabajo en streaming (puede ser un export completo)"""
+    return await forward_stream(f"{RECETAS_SERVICE_URL}/jobs/{trabajo_id}/resultado", request)
+
+@app.api_route(
+    "/api/jobs/{path:path}",
+    methods=["GET", "POST"],
+    dependencies=[Depends(verificar_limite_cliente)]
+)
+async def proxy_trabajos(path: str, request: Request):
+    """Proxy para la cola de trabajos en segundo plano del microservicio de recetas"""
+    url = f"{RECETAS_SERVICE_URL}/jobs/{path}" if path else f"{RECETAS_SERVICE_URL}/jobs"
+    if request.method != "POST":
+        return await forward_request(url, request)
+    # El cuerpo (un NDJSON de importación puede ser grande) pasa al servicio a
+    # medida que llega; la respuesta se pide sin comprimir para reescribir su URL
+    return enlazar_trabajo(await forward_request(url, request, identidad=True, cuerpo_en_streaming=True))
+
+def enlazar_trabajo(respuesta: Response) -> Response:
+    """Publicar la URL del trabajo creado (/jobs/{id} en el servicio) como la del gateway (/api/jobs/{id})"""
+    if respuesta.status_code != 202:
+        return respuesta
+    try:
+        datos = json.loads(respuesta.body)
+    except ValueError:
+        return respuesta
+    if isinstance(datos, dict) and str(datos.get("url", "")).startswith("/jobs/"):
+        datos["url"] = f"/api{datos['url']}"
+        respuesta.body = json.dumps(datos).encode()
+        respuesta.headers["content-length"] = str(len(respuesta.body))
+    return respuesta
+
+async def consultar_json(url: str, params=None):
+    """Hacer un GET a un microservicio y devolver el JSON de la respuesta"""
+    control = await adquirir_ranura(url)
+    try:
+        async with grupo_para(url).peticion(url) as seleccion, crear_cliente(seleccion.url) as client:
+            response = await client.get(seleccion.url, params=params, timeout=30.0)
+            seleccion.fallo = response.status_code >= 500
+            response.raise_for_status()
+            return response.json()
+    except httpx.ConnectError:
+        raise HTTPException(
+            status_code=503,
+            detail="Servicio no disponible. Verifique que el microservicio esté en ejecución."
+        )
+    except httpx.TimeoutException:
+        raise HTTPException(
+            status_code=504,
+            detail="Tiempo de espera agotado al conectar con el servicio."
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=502,
+            detail=f"Respuesta inválida del servicio: {str(e)}"
+        )
+    finally:
+        if control is not None:
+            control.liberar()
+
+def headers_upstream(request: Request) -> dict:
+    """
+    Headers a reenviar al microservicio. Accept-Encoding se pasa tal cual o
+    como identity para que httpx no pida una compresión que el cliente no
+    entiende (el cuerpo crudo se reenvía sin descomprimir). Se agrega la IP
+    del cliente a X-Forwarded-For.
+    """
+    headers = dict(request.headers)
+    headers.pop("host", None)  # Remover el header host
+    headers.pop("transfer-encoding", None)  # Es de este salto: httpx lo pone si envía el cuerpo en streaming
+    headers["accept-encoding"] = request.headers.get("accept-encoding", "identity")
+    # IP original del cliente (los servicios la usan para leer sus propias escrituras)
+    if request.client:
+        anteriores = request.headers.get("x-forwarded-for")
+        headers["x-forwarded-for"] = f"{anteriores}, {request.client.host}" if anteriores else request.client.host
+    return headers
+
+async def forward_cacheado(url: str, request: Request, grupo: str):
+    """
+    Reenviar con la caché compartida: un GET se responde desde la caché si
+    está (X-Cache: HIT) y si no se guarda la respuesta 200 del servicio
+    (X-Cache: MISS). Tras una escritura se releen las versiones de los
+    grupos, para que el mismo cliente lea enseguida lo que escribió.
+    """
+    if cache_gateway is None:
+        return await forward_request(url, request)
+    if request.method != "GET":
+        respuesta = await forward_request(url, request)
+        if respuesta.status_code < 400:
+            cache_gateway.refrescar(*GRUPOS_CACHE)
+        return respuesta
+    
+    clave = f"{request.url.path}?{urlencode(sorted(request.query_params.multi_items()))}"
+    # El cliente de la caché es bloqueante: se consulta fuera del event loop
+    encontrados, version = await asyncio.to_thread(cache_gateway.leer, grupo, [clave])
+    if clave in encontrados:
+        return Response(content=encontrados[clave], media_type="application/json", headers={"X-Cache": "HIT"})
+    inicio = time.monotonic()
+    # Sin comprimir, para guardar una sola versión; el middleware comprime para cada cliente
+    respuesta = await forward_request(url, request, identidad=True)
+    if respuesta.status_code == 200 and respuesta.media_type == "application/json":
+        await asyncio.to_thread(
+            cache_gateway.guardar, grupo, version, {clave: respuesta.body}, time.monotonic() - inicio
+        )
+    respuesta.headers["X-Cache"] = "MISS"
+    return respuesta
 
-async def forward_request(url: str, request: Request):
-    """Función auxiliar para reenviar peticiones a los microservicios"""
+async def forward_request(url: str, request: Request, identidad: bool = False, cuerpo_en_streaming: bool = False):
+    """
+    Función auxiliar para reenviar peticiones a los microservicios
+    (`identidad`: pedir el cuerpo sin comprimir; `cuerpo_en_streaming`:
+    enviar el cuerpo a medida que llega en lugar de leerlo entero antes)
+    """
+    control = await adquirir_ranura(url)
     try:
-        async with httpx.AsyncClient() as client:
+        # Instancia elegida por el balanceador; el resultado alimenta la expulsión pasiva
+        async with grupo_para(url).peticion(url) as seleccion, crear_cliente(seleccion.url) as client:
             # Obtener el body de la petición si existe
-            body = await request.body()
-            
-            # Preparar headers
-            headers = dict(request.headers)
-            headers.pop("host", None)  # Remover el header host
+            body = request.stream() if cuerpo_en_streaming else await request.body()
+            headers = headers_upstream(request)
+            if identidad:
+                headers["accept-encoding"] = "identity"
             
             # Hacer la petición al microservicio
-            response = await client.request(
-                method=request.method,
-                url=url,
-                content=body,
-                headers=headers,
-                params=request.query_params,
-                timeout=30.0
+            response = await client.send(
+                client.build_request(
+                    method=request.method,
+                    url=seleccion.url,
+                    content=body,
+                    headers=headers,
+                    params=request.query_params,
+                    timeout=30.0
+                ),
+                stream=True
             )
+            # Bytes tal como llegan: si el microservicio ya comprimió (con una
+            # codificación que el cliente acepta) no se descomprime ni recomprime
+            try:
+                contenido = b"".join([fragmento async for fragmento in response.aiter_raw()])
+            finally:
+                await response.aclose()
+            seleccion.fallo = response.status_code >= 500
             
-            # Retornar la respuesta del microservicio
-            return JSONResponse(
-                content=response.json() if response.content else {},
-                status_code=response.status_code
-            )
+            # Retornar la respuesta del microservicio tal cual, sin volver a
+            # decodificar y codificar el JSON
+            if not contenido:
+                respuesta = JSONResponse(content={}, status_code=response.status_code)
+            else:
+                headers_respuesta = {}
+                if "content-encoding" in response.headers:
+                    headers_respuesta["content-encoding"] = response.headers["content-encoding"]
+                respuesta = Response(
+                    content=contenido,
+                    status_code=response.status_code,
+                    media_type=response.headers.get("content-type", "application/json"),
+                    headers=headers_respuesta
+                )
+            # Cookies del microservicio (p. ej. lectura_propia tras una escritura)
+            for cookie in response.headers.get_list("set-cookie"):
+                respuesta.headers.append("set-cookie", cookie)
+            return respuesta
     
     except httpx.ConnectError:
         raise HTTPException(
@@ -111,7 +596,83 @@ async def forward_request(url: str, request: Request):
             status_code=500, 
             detail=f"Error al procesar la solicitud: {str(e)}"
         )
+    finally:
+        if control is not None:
+            control.liberar()
+
+async def forward_stream(url: str, request: Request):
+    """
+    Reenviar una respuesta en streaming: los fragmentos del microservicio se
+    pasan al cliente a medida que llegan, sin acumular el cuerpo en memoria.
+    """
+    control = await adquirir_ranura(url)
+    # La instancia cuenta como ocupada hasta el final del stream; la latencia
+    # registrada es la de la cabecera de la respuesta
+    grupo = grupo_para(url)
+    instancia = grupo.elegir()
+    grupo.iniciar(instancia)
+    destino = grupo.reescribir(url, instancia)
+    client = crear_cliente(destino)
+    headers = headers_upstream(request)
+    inicio = time.monotonic()
+
+    async def cerrar_cliente():
+        await client.aclose()
+        grupo.liberar(instancia)
+        if control is not None:
+            control.liberar()
+
+    try:
+        upstream = await client.send(
+            client.build_request(
+                method=request.method,
+                url=destino,
+                headers=headers,
+                params=request.query_params,
+                timeout=30.0
+            ),
+            stream=True
+        )
+    except httpx.ConnectError:
+        grupo.registrar(instancia, time.monotonic() - inicio, fallo=True)
+        await cerrar_cliente()
+        raise HTTPException(
+            status_code=503,
+            detail="Servicio no disponible. Verifique que el microservicio esté en ejecución."
+        )
+    except httpx.TimeoutException:
+        grupo.registrar(instancia, time.monotonic() - inicio, fallo=True)
+        await cerrar_cliente()
+        raise HTTPException(
+            status_code=504,
+            detail="Tiempo de espera agotado al conectar con el servicio."
+        )
+    except BaseException:
+        await cerrar_cliente()
+        raise
+    grupo.registrar(instancia, time.monotonic() - inicio, fallo=upstream.status_code >= 500)
+
+    async def cerrar():
+        await upstream.aclose()
+        await cerrar_cliente()
+
+    headers_respuesta = {}
+    if "content-encoding" in upstream.headers:
+        headers_respuesta["content-encoding"] = upstream.headers["content-encoding"]
+
+    return StreamingResponse(
+        upstream.aiter_raw(),
+        status_code=upstream.status_code,
+        media_type=upstream.headers.get("content-type"),
+        headers=headers_respuesta,
+        background=BackgroundTask(cerrar)
+    )
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        # Con varios workers uvicorn necesita la app como cadena importable
+        uvicorn.run("api_gateway.app:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
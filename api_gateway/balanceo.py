@@ -0,0 +1,213 @@
+"""
+Balanceo de carga entre instancias de un microservicio
+
+Cada microservicio puede tener varias instancias (RECETAS_SERVICE_URL con
+URLs separadas por comas). GrupoUpstream elige la instancia de cada petición:
+
+- Política "p2c" (power of two choices): se toman dos instancias al azar,
+  con probabilidad proporcional a su peso, y se usa la que tiene menos
+  peticiones en curso en relación con su peso (en empate, la primera
+  sorteada). "menos_pendientes" compara todas, también en orden sorteado.
+  Así el peso de lento inicio reparte la carga aun sin peticiones en curso.
+- Expulsión pasiva: tras `max_fallos` errores seguidos (conexión, timeout o
+  5xx), o si la latencia media supera `latencia_max`, la instancia sale del
+  reparto durante `expulsion` segundos, multiplicados por las expulsiones
+  previas. Nunca se expulsa la última instancia disponible.
+- Verificación activa: `verificar` consulta todas las instancias; las que
+  fallan `UMBRAL_NO_SANA` veces seguidas se retiran hasta que respondan.
+- Lento inicio: una instancia que vuelve (fin de expulsión o verificación
+  correcta) recibe una fracción creciente de la carga durante `lento_inicio`
+  segundos, para no saturarla con conexiones y cachés frías.
+
+Si no queda ninguna instancia disponible se reparte entre todas (modo
+pánico): es preferible intentar que rechazar todo.
+"""
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, List, Optional
+
+POLITICAS = ("p2c", "menos_pendientes")
+
+# Verificaciones activas fallidas seguidas para retirar una instancia
+UMBRAL_NO_SANA = 2
+# Fracción mínima de carga de una instancia recién recuperada
+PESO_MINIMO = 0.1
+# Tope del tiempo de expulsión, por muchas expulsiones que acumule
+EXPULSION_MAXIMA = 300.0
+
+def parsear_urls(valor: str) -> List[str]:
+    """Lista de URLs base a partir de una variable con URLs separadas por comas"""
+    return [url.strip().rstrip("/") for url in valor.split(",") if url.strip()]
+
+class Instancia:
+    """Estado de una instancia: carga, latencia, fallos y expulsiones"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.en_curso = 0
+        self.latencia_media = 0.0
+        self.fallos_seguidos = 0
+        self.expulsiones = 0
+        self.expulsada_hasta = 0.0
+        self.sana = True
+        self.verificaciones_fallidas = 0
+        # Instante desde el que cuenta el lento inicio (None: a plena carga)
+        self.recuperada_en = None
+
+    def disponible(self, ahora: float) -> bool:
+        return self.sana and self.expulsada_hasta <= ahora
+
+    def peso(self, ahora: float, lento_inicio: float) -> float:
+        if self.recuperada_en is None or lento_inicio <= 0:
+            return 1.0
+        return max(PESO_MINIMO, min(1.0, (ahora - self.recuperada_en) / lento_inicio))
+
+    def actualizar(self, ahora: float, lento_inicio: float):
+        """Aplicar las transiciones que dependen del tiempo: fin de la expulsión y del lento inicio"""
+        if self.expulsada_hasta and self.expulsada_hasta <= ahora:
+            # Fin de la expulsión: vuelve con lento inicio
+            self.recuperada_en = self.expulsada_hasta
+            self.expulsada_hasta = 0.0
+            self.fallos_seguidos = 0
+            self.latencia_media = 0.0
+        if self.recuperada_en is not None and self.peso(ahora, lento_inicio) >= 1:
+            self.recuperada_en = None
+
+    def estado(self, ahora: float, lento_inicio: float) -> dict:
+        return {
+            "url": self.url,
+            "disponible": self.disponible(ahora),
+            "sana": self.sana,
+            "en_curso": self.en_curso,
+            "latencia_media_ms": round(self.latencia_media * 1000, 2),
+            "expulsada_segundos": round(max(0.0, self.expulsada_hasta - ahora), 2),
+            "peso": round(self.peso(ahora, lento_inicio), 2),
+        }
+
+class Seleccion:
+    """Instancia elegida para una petición: `url` ya apunta a ella; marcar `fallo=False` si salió bien"""
+
+    def __init__(self, instancia: Instancia, url: str):
+        self.instancia = instancia
+        self.url = url
+        self.fallo = True
+
+class GrupoUpstream:
+    """Instancias de un microservicio y la política para repartir peticiones entre ellas"""
+
+    def __init__(self, urls: List[str], politica: str = "p2c", max_fallos: int = 5,
+                 latencia_max: float = 0.0, expulsion: float = 30.0, lento_inicio: float = 30.0,
+                 semilla: Optional[int] = None):
+        if not urls:
+            raise ValueError("El grupo necesita al menos una instancia")
+        if politica not in POLITICAS:
+            raise ValueError(f"Política de balanceo no soportada: {politica}")
+        self.instancias = [Instancia(url) for url in urls]
+        self.politica = politica
+        self.max_fallos = max_fallos
+        self.latencia_max = latencia_max
+        self.expulsion = expulsion
+        self.lento_inicio = lento_inicio
+        self._azar = random.Random(semilla)
+
+    @property
+    def url_base(self) -> str:
+        """URL con la que el gateway arma las rutas del servicio (la de la primera instancia)"""
+        return self.instancias[0].url
+
+    def _puntaje(self, instancia: Instancia, ahora: float) -> float:
+        return instancia.en_curso / instancia.peso(ahora, self.lento_inicio)
+
+    def _sortear(self, candidatas: List[Instancia], ahora: float) -> List[Instancia]:
+        """Candidatas en orden aleatorio ponderado por peso (Efraimidis-Spirakis: u^(1/peso))"""
+        return sorted(
+            candidatas,
+            key=lambda instancia: self._azar.random() ** (1 / instancia.peso(ahora, self.lento_inicio)),
+            reverse=True
+        )
+
+    def elegir(self, ahora: float = None) -> Instancia:
+        """Elegir la instancia para una petición (luego iniciar, liberar y registrar)"""
+        ahora = time.monotonic() if ahora is None else ahora
+        if len(self.instancias) == 1:
+            return self.instancias[0]
+        for instancia in self.instancias:
+            instancia.actualizar(ahora, self.lento_inicio)
+        candidatas = [instancia for instancia in self.instancias if instancia.disponible(ahora)]
+        if not candidatas:
+            candidatas = self.instancias
+        candidatas = self._sortear(candidatas, ahora)
+        if self.politica == "p2c":
+            candidatas = candidatas[:2]
+        # min se queda con la primera en caso de empate: sin carga, la sorteada por peso
+        return min(candidatas, key=lambda instancia: self._puntaje(instancia, ahora))
+
+    def reescribir(self, url: str, instancia: Instancia) -> str:
+        """Cambiar la URL base del servicio por la de la instancia elegida"""
+        return instancia.url + url[len(self.url_base):] if url.startswith(self.url_base) else url
+
+    def iniciar(self, instancia: Instancia):
+        instancia.en_curso += 1
+
+    def liberar(self, instancia: Instancia):
+        instancia.en_curso -= 1
+
+    @asynccontextmanager
+    async def peticion(self, url: str):
+        """Elegir instancia para `url` y registrar al salir la duración y si falló"""
+        instancia = self.elegir()
+        self.iniciar(instancia)
+        seleccion = Seleccion(instancia, self.reescribir(url, instancia))
+        inicio = time.monotonic()
+        try:
+            yield seleccion
+        finally:
+            self.liberar(instancia)
+            self.registrar(instancia, time.monotonic() - inicio, seleccion.fallo)
+
+    def registrar(self, instancia: Instancia, duracion: float, fallo: bool, ahora: float = None):
+        """Registrar el resultado de una petición (expulsión pasiva por errores o latencia)"""
+        ahora = time.monotonic() if ahora is None else ahora
+        instancia.actualizar(ahora, self.lento_inicio)
+        instancia.latencia_media = (
+            duracion if instancia.latencia_media == 0 else 0.8 * instancia.latencia_media + 0.2 * duracion
+        )
+        if fallo:
+            instancia.fallos_seguidos += 1
+        else:
+            instancia.fallos_seguidos = 0
+            if instancia.recuperada_en is None and not instancia.expulsada_hasta:
+                instancia.expulsiones = 0
+        lenta = self.latencia_max > 0 and instancia.latencia_media > self.latencia_max
+        if instancia.fallos_seguidos >= self.max_fallos or lenta:
+            self._expulsar(instancia, ahora)
+
+    def _expulsar(self, instancia: Instancia, ahora: float):
+        if len(self.instancias) == 1 or not instancia.disponible(ahora):
+            return
+        otras = [otra for otra in self.instancias if otra is not instancia and otra.disponible(ahora)]
+        if not otras:
+            return
+        instancia.expulsiones += 1
+        instancia.expulsada_hasta = ahora + min(EXPULSION_MAXIMA, self.expulsion * instancia.expulsiones)
+
+    async def verificar(self, consultar: Callable[[str], Awaitable[bool]], ahora: float = None):
+        """Verificación activa: `consultar(url)` devuelve si la instancia responde bien"""
+        resultados = await asyncio.gather(*(consultar(instancia.url) for instancia in self.instancias))
+        ahora = time.monotonic() if ahora is None else ahora
+        for instancia, correcta in zip(self.instancias, resultados):
+            if correcta:
+                instancia.verificaciones_fallidas = 0
+                if not instancia.sana:
+                    instancia.sana = True
+                    instancia.recuperada_en = ahora
+            else:
+                instancia.verificaciones_fallidas += 1
+                if instancia.verificaciones_fallidas >= UMBRAL_NO_SANA:
+                    instancia.sana = False
+
+    def estado(self, ahora: float = None) -> List[dict]:
+        ahora = time.monotonic() if ahora is None else ahora
+        return [instancia.estado(ahora, self.lento_inicio) for instancia in self.instancias]
@@ -0,0 +1,275 @@
+"""
+Compresión negociada de respuestas del API Gateway
+
+Middleware ASGI que elige la codificación según Accept-Encoding (con sus
+valores q) entre las disponibles: zstd y br si están instalados los
+paquetes zstandard y brotli, y gzip siempre. Sólo comprime tipos de
+contenido textuales y cuerpos de al menos COMPRESION_UMBRAL_BYTES.
+
+- Las respuestas completas se comprimen de una vez (y, con
+  COMPRESION_CACHE_MB > 0, se guardan en una caché LRU de variantes
+  comprimidas indexada por el hash del cuerpo y la codificación).
+- Las respuestas en streaming se comprimen fragmento a fragmento con un
+  flush por fragmento, así el cliente recibe los datos sin esperar al final.
+- Las respuestas que ya traen Content-Encoding (cuerpos comprimidos por el
+  microservicio) y los eventos SSE (text/event-stream) pasan sin tocar.
+"""
+import gzip
+import hashlib
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dependencia opcional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - dependencia opcional
+    zstandard = None
+
+TIPOS_COMPRIMIBLES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "text/",
+)
+TIPOS_EXCLUIDOS = ("text/event-stream",)
+
+def codificaciones_disponibles() -> List[str]:
+    """Codificaciones soportadas, en orden de preferencia del servidor"""
+    disponibles = []
+    if zstandard is not None:
+        disponibles.append("zstd")
+    if brotli is not None:
+        disponibles.append("br")
+    disponibles.append("gzip")
+    return disponibles
+
+def negociar(accept_encoding: str, disponibles: List[str]) -> Optional[str]:
+    """
+    Elegir la codificación a usar según Accept-Encoding: la de mayor q entre
+    las disponibles y, a igual q, la preferida por el servidor. None si el
+    cliente no acepta ninguna (o sólo identity).
+    """
+    calidades: Dict[str, float] = {}
+    for parte in accept_encoding.split(","):
+        nombre, _, parametros = parte.strip().partition(";")
+        nombre = nombre.strip().lower()
+        if not nombre:
+            continue
+        calidad = 1.0
+        for parametro in parametros.split(";"):
+            clave, _, valor = parametro.strip().partition("=")
+            if clave.strip().lower() == "q":
+                try:
+                    calidad = float(valor)
+                except ValueError:
+                    calidad = 0.0
+        calidades[nombre] = calidad
+
+    comodin = calidades.get("*", 0.0)
+    mejor, mejor_calidad = None, 0.0
+    for codificacion in disponibles:
+        calidad = calidades.get(codificacion, comodin)
+        if calidad > mejor_calidad:
+            mejor, mejor_calidad = codificacion, calidad
+    return mejor
+
+def comprimir(datos: bytes, codificacion: str) -> bytes:
+    if codificacion == "gzip":
+        return gzip.compress(datos, compresslevel=6)
+    if codificacion == "br":
+        return brotli.compress(datos, quality=5)
+    if codificacion == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(datos)
+    raise ValueError(f"Codificación no soportada: {codificacion}")
+
+class CompresorIncremental:
+    """Compresor para streaming: cada fragmento devuelve datos ya decodificables por el cliente"""
+
+    def __init__(self, codificacion: str):
+        self.codificacion = codificacion
+        if codificacion == "gzip":
+            self._compresor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif codificacion == "br":
+            self._compresor = brotli.Compressor(quality=5)
+        elif codificacion == "zstd":
+            self._compresor = zstandard.ZstdCompressor(level=3).compressobj()
+        else:
+            raise ValueError(f"Codificación no soportada: {codificacion}")
+
+    def fragmento(self, datos: bytes) -> bytes:
+        if self.codificacion == "gzip":
+            return self._compresor.compress(datos) + self._compresor.flush(zlib.Z_SYNC_FLUSH)
+        if self.codificacion == "br":
+            return self._compresor.process(datos) + self._compresor.flush()
+        return self._compresor.compress(datos) + self._compresor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def terminar(self) -> bytes:
+        if self.codificacion == "br":
+            return self._compresor.finish()
+        return self._compresor.flush()
+
+class CacheVariantes:
+    """LRU de cuerpos comprimidos, acotada por el total de bytes guardados"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes_usados = 0
+        self.aciertos = 0
+        self._entradas = OrderedDict()
+
+    @staticmethod
+    def clave(datos: bytes, codificacion: str) -> tuple:
+        return codificacion, hashlib.blake2b(datos, digest_size=16).digest()
+
+    def obtener(self, clave) -> Optional[bytes]:
+        comprimido = self._entradas.get(clave)
+        if comprimido is not None:
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+        return comprimido
+
+    def guardar(self, clave, comprimido: bytes):
+        if len(comprimido) > self.max_bytes or clave in self._entradas:
+            return
+        self._entradas[clave] = comprimido
+        self.bytes_usados += len(comprimido)
+        while self.bytes_usados > self.max_bytes:
+            _, descartado = self._entradas.popitem(last=False)
+            self.bytes_usados -= len(descartado)
+
+class CompresionMiddleware:
+    """Middleware ASGI de compresión negociada con umbral de tamaño"""
+
+    def __init__(self, app, umbral: int = 1024, cache_bytes: int = 0, codificaciones: List[str] = None):
+        self.app = app
+        self.umbral = umbral
+        self.codificaciones = codificaciones or codificaciones_disponibles()
+        self.cache = CacheVariantes(cache_bytes) if cache_bytes > 0 else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = ""
+        for nombre, valor in scope.get("headers", ()):
+            if nombre == b"accept-encoding":
+                accept_encoding = valor.decode("latin-1")
+                break
+        codificacion = negociar(accept_encoding, self.codificaciones)
+        await self.app(scope, receive, _Respuesta(self, codificacion, send))
+
+    def comprimir_completo(self, datos: bytes, codificacion: str) -> bytes:
+        if self.cache is None:
+            return comprimir(datos, codificacion)
+        clave = CacheVariantes.clave(datos, codificacion)
+        comprimido = self.cache.obtener(clave)
+        if comprimido is None:
+            comprimido = comprimir(datos, codificacion)
+            self.cache.guardar(clave, comprimido)
+        return comprimido
+
+def _comprimible(headers: List[tuple], status: int) -> bool:
+    if status < 200 or status in (204, 304):
+        return False
+    tipo = ""
+    for nombre, valor in headers:
+        nombre = nombre.lower()
+        if nombre == b"content-encoding":
+            # Ya viene comprimida (por ejemplo desde el microservicio)
+            return False
+        if nombre == b"content-type":
+            tipo = valor.decode("latin-1").lower()
+    if any(tipo.startswith(excluido) for excluido in TIPOS_EXCLUIDOS):
+        return False
+    return any(tipo.startswith(comprimible) for comprimible in TIPOS_COMPRIMIBLES)
+
+def _headers_respuesta(headers: List[tuple], codificacion: str = None, longitud: int = None) -> List[tuple]:
+    """Headers con Vary: Accept-Encoding y, si se comprime, Content-Encoding y la nueva longitud"""
+    resultado, variaciones = [], []
+    for nombre, valor in headers:
+        minuscula = nombre.lower()
+        if minuscula == b"vary":
+            if b"accept-encoding" not in valor.lower():
+                variaciones.append(valor)
+        elif minuscula != b"content-length" or codificacion is None:
+            resultado.append((nombre, valor))
+    resultado.append((b"vary", b", ".join(variaciones + [b"Accept-Encoding"])))
+    if codificacion is not None:
+        resultado.append((b"content-encoding", codificacion.encode()))
+        if longitud is not None:
+            resultado.append((b"content-length", str(longitud).encode()))
+    return resultado
+
+def _longitud_declarada(headers: List[tuple]) -> Optional[int]:
+    for nombre, valor in headers:
+        if nombre.lower() == b"content-length":
+            try:
+                return int(valor)
+            except ValueError:
+                return None
+    return None
+
+class _Respuesta:
+    """Envoltorio de `send` que decide y aplica la compresión de una respuesta"""
+
+    def __init__(self, middleware: CompresionMiddleware, codificacion: Optional[str], send):
+        self.middleware = middleware
+        self.codificacion = codificacion
+        self.send = send
+        self.inicio = None
+        self.compresor = None
+        self.pasar = False
+
+    async def __call__(self, mensaje):
+        if mensaje["type"] == "http.response.start":
+            if not _comprimible(mensaje.get("headers", []), mensaje["status"]):
+                self.pasar = True
+                await self.send(mensaje)
+            else:
+                # Se retiene hasta ver el primer fragmento del cuerpo
+                self.inicio = mensaje
+            return
+
+        if mensaje["type"] != "http.response.body" or self.pasar:
+            await self.send(mensaje)
+            return
+
+        cuerpo = mensaje.get("body", b"")
+        mas = mensaje.get("more_body", False)
+
+        if self.compresor is not None:
+            datos = self.compresor.fragmento(cuerpo) if cuerpo else b""
+            if not mas:
+                datos += self.compresor.terminar()
+            await self.send({"type": "http.response.body", "body": datos, "more_body": mas})
+            return
+
+        inicio, self.inicio = self.inicio, None
+        headers = inicio.get("headers", [])
+        if not mas:
+            # Respuesta completa en un único mensaje
+            if self.codificacion is None or len(cuerpo) < self.middleware.umbral:
+                await self.send({**inicio, "headers": _headers_respuesta(headers)})
+                await self.send(mensaje)
+                return
+            comprimido = self.middleware.comprimir_completo(cuerpo, self.codificacion)
+            await self.send({**inicio, "headers": _headers_respuesta(headers, self.codificacion, len(comprimido))})
+            await self.send({"type": "http.response.body", "body": comprimido, "more_body": False})
+            return
+
+        # Respuesta en streaming: se comprime salvo que declare un tamaño menor al umbral
+        longitud = _longitud_declarada(headers)
+        if self.codificacion is None or (longitud is not None and longitud < self.middleware.umbral):
+            self.pasar = True
+            await self.send({**inicio, "headers": _headers_respuesta(headers)})
+            await self.send(mensaje)
+            return
+        self.compresor = CompresorIncremental(self.codificacion)
+        await self.send({**inicio, "headers": _headers_respuesta(headers, self.codificacion)})
+        await self.send({"type": "http.response.body", "body": self.compresor.fragmento(cuerpo), "more_body": True})
@@ -0,0 +1,190 @@
+"""
+Eventos de cambios en vivo (Server-Sent Events)
+
+En lugar de que cada cliente consulte el listado cada pocos segundos,
+GET /api/eventos mantiene abierta una respuesta text/event-stream y le envía
+cada evento del registro de cambios (crear, actualizar, eliminar de recetas,
+pasos e ingredientes) a medida que ocurre.
+
+DifusorEventos hace una sola suscripción al origen por proceso: un sondeo de
+/cambios que arranca con el primer cliente y se detiene con el último, y
+reparte cada evento a las colas de los clientes conectados. Cada conexión es
+solo una corrutina con una cola acotada (`tamano_cola`), así miles de
+conexiones inactivas cuestan poca memoria:
+
+- Un cliente lento cuya cola se llena no frena a los demás: se vacía su cola
+  y se pone al día desde el historial reciente o, si ya no alcanza, desde el
+  origen, empezando por el último evento que recibió.
+- El id de cada evento es su `seq`; al reconectar, el navegador envía
+  Last-Event-ID y el flujo continúa desde ahí por el mismo camino.
+- Cada `latido` segundos sin eventos se envía un comentario, para que los
+  proxies no corten la conexión por inactividad, y tras `duracion_max`
+  segundos se cierra para que el cliente reconecte (y se reparta entre
+  instancias del gateway) sin perder eventos.
+"""
+import asyncio
+import bisect
+import json
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Optional
+
+# Eventos pedidos al origen en cada consulta
+LOTE_EVENTOS = 500
+# Milisegundos que el navegador espera antes de reconectar
+REINTENTO_MS = 3000
+
+class Suscripcion:
+    """Cola acotada de un cliente conectado"""
+
+    def __init__(self, tamano_cola: int):
+        self.cola = asyncio.Queue(maxsize=tamano_cola)
+        self.desbordada = False
+        # Posición del sondeo al suscribirse: lo posterior llega por la cola
+        self.inicio = None
+
+    def publicar(self, evento: dict):
+        if self.desbordada:
+            return
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            self.desbordada = True
+
+    def vaciar(self):
+        self.desbordada = False
+        while not self.cola.empty():
+            self.cola.get_nowait()
+
+def formatear_evento(evento: dict) -> bytes:
+    """Evento en formato SSE: el id es el seq, para reanudar con Last-Event-ID"""
+    datos = json.dumps(evento, ensure_ascii=False, separators=(",", ":"))
+    return f"id: {evento['seq']}\ndata: {datos}\n\n".encode()
+
+class DifusorEventos:
+    """Una consulta periódica al registro de cambios, repartida entre todos los clientes SSE"""
+
+    def __init__(self, consultar: Callable[[int, int], Awaitable[dict]], intervalo: float = 1.0,
+                 tamano_cola: int = 100, historial: int = 1000, latido: float = 15.0,
+                 duracion_max: float = 0.0, max_clientes: int = 10000):
+        # consultar(desde, limite) -> {"cambios": [...], "ultimo_seq": n, "seq_actual": n}
+        self.consultar = consultar
+        self.intervalo = intervalo
+        self.tamano_cola = tamano_cola
+        self.latido = latido
+        self.duracion_max = duracion_max
+        self.max_clientes = max_clientes
+        self.suscripciones = set()
+        # Posición del sondeo y eventos recientes: el historial cubre todo lo posterior a `_historial_desde`
+        self.ultimo_seq = None
+        self._historial = deque(maxlen=historial)
+        self._historial_desde = 0
+        self._posicionado = asyncio.Event()
+        self._tarea = None
+
+    @property
+    def clientes(self) -> int:
+        return len(self.suscripciones)
+
+    def suscribir(self) -> Suscripcion:
+        suscripcion = Suscripcion(self.tamano_cola)
+        if self._posicionado.is_set():
+            suscripcion.inicio = self.ultimo_seq
+        self.suscripciones.add(suscripcion)
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.create_task(self._sondear())
+        return suscripcion
+
+    def desuscribir(self, suscripcion: Suscripcion):
+        self.suscripciones.discard(suscripcion)
+        if not self.suscripciones and self._tarea is not None:
+            # Sin clientes no se consulta el origen
+            self._tarea.cancel()
+            self._tarea = None
+            # La posición y el historial dejan de avanzar: el próximo cliente espera al nuevo sondeo
+            self._posicionado.clear()
+            self._historial.clear()
+            self.ultimo_seq = None
+            self._historial_desde = 0
+
+    async def _sondear(self):
+        """Consultar el origen mientras haya clientes y publicar cada evento nuevo"""
+        # Al (re)arrancar se parte del final del registro: el historial anterior ya no es continuo
+        self._posicionado.clear()
+        self._historial.clear()
+        while self.suscripciones:
+            try:
+                if not self._posicionado.is_set():
+                    pagina = await self.consultar(0, 1)
+                    self.ultimo_seq = self._historial_desde = pagina.get("seq_actual", pagina["ultimo_seq"])
+                    for suscripcion in self.suscripciones:
+                        suscripcion.inicio = self.ultimo_seq
+                    self._posicionado.set()
+                    continue
+                pagina = await self.consultar(self.ultimo_seq, LOTE_EVENTOS)
+            except Exception:
+                await asyncio.sleep(self.intervalo)
+                continue
+            for evento in pagina["cambios"]:
+                if evento["seq"] <= self.ultimo_seq:
+                    continue
+                if len(self._historial) == self._historial.maxlen:
+                    self._historial_desde = self._historial[0]["seq"]
+                self._historial.append(evento)
+                self.ultimo_seq = evento["seq"]
+                for suscripcion in self.suscripciones:
+                    suscripcion.publicar(evento)
+            # Con una página llena hay más eventos esperando: seguir sin dormir
+            if len(pagina["cambios"]) < LOTE_EVENTOS:
+                await asyncio.sleep(self.intervalo)
+
+    async def pendientes(self, desde: int) -> List[dict]:
+        """Eventos posteriores a `desde`: del historial si lo cubre, si no una página del origen"""
+        if desde >= self._historial_desde:
+            eventos = list(self._historial)
+            inicio = bisect.bisect_right([evento["seq"] for evento in eventos], desde)
+            return eventos[inicio:]
+        pagina = await self.consultar(desde, LOTE_EVENTOS)
+        eventos = [evento for evento in pagina["cambios"] if evento["seq"] <= self._historial_desde]
+        if not eventos:
+            # Los eventos intermedios ya no están en el origen: seguir desde el historial
+            return await self.pendientes(self._historial_desde)
+        return eventos
+
+    async def flujo(self, ultimo_id: Optional[int] = None,
+                    entidades: Optional[Iterable[str]] = None) -> AsyncIterator[bytes]:
+        """Cuerpo SSE de un cliente; `ultimo_id` es el Last-Event-ID con el que reconecta"""
+        entidades = set(entidades) if entidades else None
+        suscripcion = self.suscribir()
+        fin = time.monotonic() + self.duracion_max if self.duracion_max > 0 else None
+        try:
+            yield f"retry: {REINTENTO_MS}\n\n".encode()
+            await self._posicionado.wait()
+            # Un id posterior a la posición actual (registro recreado) se trata como "desde ahora"
+            entregado = suscripcion.inicio if ultimo_id is None or ultimo_id > self.ultimo_seq else ultimo_id
+            while True:
+                restante = None if fin is None else fin - time.monotonic()
+                if restante is not None and restante <= 0:
+                    return
+                if suscripcion.desbordada or entregado < self._historial_desde or (
+                        suscripcion.cola.empty() and entregado < self.ultimo_seq):
+                    # Ponerse al día sin la cola: lo que llegue mientras tanto se descarta por seq
+                    suscripcion.vaciar()
+                    eventos = await self.pendientes(entregado)
+                    if not eventos:
+                        entregado = max(entregado, self._historial_desde)
+                else:
+                    espera = self.latido if restante is None else min(self.latido, restante)
+                    try:
+                        eventos = [await asyncio.wait_for(suscripcion.cola.get(), timeout=espera)]
+                    except asyncio.TimeoutError:
+                        yield b": latido\n\n"
+                        continue
+                for evento in eventos:
+                    if evento["seq"] <= entregado:
+                        continue
+                    entregado = evento["seq"]
+                    if entidades is None or evento["entidad"] in entidades:
+                        yield formatear_evento(evento)
+        finally:
+            self.desuscribir(suscripcion)
@@ -0,0 +1,119 @@
+"""
+Peticiones multiplexadas del API Gateway (POST /api/batch)
+
+Cada subpetición se despacha al propio gateway por ASGI (sin sockets), así
+pasa por las mismas rutas, límites por cliente y control de admisión que
+una petición normal. Se ejecutan concurrentemente con un máximo de
+subpeticiones en curso; las que declaran `depende_de` esperan a que
+terminen sus dependencias y, si alguna falló, se omiten con 424.
+"""
+import asyncio
+import json
+import posixpath
+import re
+from typing import Any, Dict, List, Optional
+from urllib.parse import unquote, urlsplit
+
+import httpx
+from pydantic import BaseModel, Field
+
+METODOS_PERMITIDOS = ("GET", "POST", "PUT", "PATCH", "DELETE")
+
+# Respuestas en streaming (SSE, exportaciones, descargas de trabajos): no
+# terminan en un tiempo acotado y ocuparían una ranura del lote hasta cerrarse
+RUTAS_STREAMING = re.compile(r"^/api/(eventos|(recetas|ingredientes)/export|jobs/[^/]+/resultado)$")
+
+class SubPeticion(BaseModel):
+    id: str
+    metodo: str = "GET"
+    ruta: str
+    cuerpo: Optional[Any] = None
+    depende_de: List[str] = Field(default_factory=list)
+
+class PeticionLote(BaseModel):
+    peticiones: List[SubPeticion]
+
+class LoteInvalido(ValueError):
+    """El lote no se puede ejecutar (ids repetidos, dependencias desconocidas o ciclos)"""
+
+def validar_lote(peticiones: List[SubPeticion], max_peticiones: int):
+    """Comprobar el lote antes de ejecutar nada; lanza LoteInvalido con el motivo"""
+    if len(peticiones) > max_peticiones:
+        raise LoteInvalido(f"El lote admite como máximo {max_peticiones} peticiones")
+    ids = [peticion.id for peticion in peticiones]
+    if len(set(ids)) != len(ids):
+        raise LoteInvalido("Los ids de las peticiones deben ser únicos")
+    for peticion in peticiones:
+        if peticion.metodo.upper() not in METODOS_PERMITIDOS:
+            raise LoteInvalido(f"Método no permitido en '{peticion.id}': {peticion.metodo}")
+        # Misma ruta que verá el router: sin query, decodificada y normalizada
+        ruta = posixpath.normpath(unquote(urlsplit(peticion.ruta).path))
+        if not ruta.startswith("/api/") or ruta.startswith("/api/batch"):
+            raise LoteInvalido(f"Ruta no permitida en '{peticion.id}': {peticion.ruta}")
+        if RUTAS_STREAMING.match(ruta):
+            raise LoteInvalido(f"Ruta en streaming no permitida en '{peticion.id}': {peticion.ruta}")
+        for dependencia in peticion.depende_de:
+            if dependencia not in ids:
+                raise LoteInvalido(f"'{peticion.id}' depende de una petición inexistente: '{dependencia}'")
+
+    # Orden topológico (Kahn): si no se pueden ordenar todas, hay un ciclo
+    pendientes = {peticion.id: set(peticion.depende_de) for peticion in peticiones}
+    listas = [id_ for id_, dependencias in pendientes.items() if not dependencias]
+    ordenadas = 0
+    while listas:
+        actual = listas.pop()
+        ordenadas += 1
+        for id_, dependencias in pendientes.items():
+            if actual in dependencias:
+                dependencias.discard(actual)
+                if not dependencias:
+                    listas.append(id_)
+    if ordenadas != len(peticiones):
+        raise LoteInvalido("Las dependencias del lote forman un ciclo")
+
+def _decodificar(response: httpx.Response):
+    if not response.content:
+        return None
+    if response.headers.get("content-type", "").startswith("application/json"):
+        try:
+            return response.json()
+        except json.JSONDecodeError:
+            pass
+    return response.text
+
+async def ejecutar_lote(app, peticiones: List[SubPeticion], headers: Dict[str, str],
+                        cliente: tuple, max_concurrencia: int) -> List[dict]:
+    """
+    Ejecutar las subpeticiones contra `app` y devolver un resultado por
+    petición, en el orden recibido: {"id", "status", "cuerpo"}.
+    """
+    transporte = httpx.ASGITransport(app=app, client=cliente)
+    semaforo = asyncio.Semaphore(max_concurrencia)
+    terminadas = {peticion.id: asyncio.get_running_loop().create_future() for peticion in peticiones}
+
+    async with httpx.AsyncClient(transport=transporte, base_url="http://gateway") as client:
+        async def ejecutar(peticion: SubPeticion) -> dict:
+            try:
+                estados = [await terminadas[dependencia] for dependencia in peticion.depende_de]
+                if any(status >= 400 for status in estados):
+                    resultado = {
+                        "id": peticion.id,
+                        "status": 424,
+                        "cuerpo": {"detail": "Una petición de la que depende falló"},
+                    }
+                else:
+                    async with semaforo:
+                        response = await client.request(
+                            peticion.metodo.upper(),
+                            peticion.ruta,
+                            json=peticion.cuerpo,
+                            headers=headers,
+                            timeout=30.0
+                        )
+                    resultado = {"id": peticion.id, "status": response.status_code, "cuerpo": _decodificar(response)}
+            except Exception as error:
+                resultado = {"id": peticion.id, "status": 502, "cuerpo": {"detail": f"Error al procesar la petición: {error}"}}
+            terminadas[peticion.id].set_result(resultado["status"])
+            return resultado
+
+        return await asyncio.gather(*(ejecutar(peticion) for peticion in peticiones))
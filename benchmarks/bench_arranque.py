@@ -0,0 +1,77 @@
+"""
+Benchmark de arranque en frío de los servicios
+
+Mide, en un proceso nuevo por servicio, el tiempo de importación de la app y
+el de la primera petición (incluyendo el evento de startup), tanto con una base
+de datos vacía como con el esquema ya creado. Termina con código 1 si algún
+valor supera el presupuesto.
+
+Uso:
+    python benchmarks/bench_arranque.py
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Presupuesto de arranque en segundos
+PRESUPUESTO_IMPORTACION = float(os.getenv("BENCH_PRESUPUESTO_IMPORTACION", "2.0"))
+PRESUPUESTO_PRIMERA_PETICION = float(os.getenv("BENCH_PRESUPUESTO_PRIMERA_PETICION", "0.5"))
+
+APPS = [
+    ("recetas", "servicio_recetas.app", "/ready"),
+    ("ingredientes", "servicio_ingredientes.app", "/ready"),
+    ("gateway", "api_gateway.app", "/"),
+]
+
+SCRIPT_MEDICION = """
+import importlib, json, sys, time
+inicio = time.perf_counter()
+modulo = importlib.import_module(sys.argv[1])
+importacion = time.perf_counter() - inicio
+
+from fastapi.testclient import TestClient
+inicio = time.perf_counter()
+with TestClient(modulo.app) as client:
+    estado = client.get(sys.argv[2]).status_code
+primera_peticion = time.perf_counter() - inicio
+
+print(json.dumps({"importacion": importacion, "primera_peticion": primera_peticion, "estado": estado}))
+"""
+
+def medir(modulo: str, ruta: str, database_url: str) -> dict:
+    """Ejecutar la medición en un intérprete nuevo para que las importaciones sean en frío"""
+    env = dict(os.environ, DATABASE_URL=database_url, PYTHONPATH=RAIZ)
+    salida = subprocess.run(
+        [sys.executable, "-c", SCRIPT_MEDICION, modulo, ruta],
+        cwd=RAIZ, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+def main() -> int:
+    excedidos = []
+    with tempfile.TemporaryDirectory() as directorio:
+        database_url = f"sqlite:///{os.path.join(directorio, 'bench.db')}"
+        print(f"{'app':<14}{'escenario':<16}{'importación (s)':>18}{'1ª petición (s)':>18}")
+        for escenario in ("esquema nuevo", "esquema listo"):
+            for nombre, modulo, ruta in APPS:
+                resultado = medir(modulo, ruta, database_url)
+                print(f"{nombre:<14}{escenario:<16}{resultado['importacion']:>18.3f}{resultado['primera_peticion']:>18.3f}")
+                if resultado["importacion"] > PRESUPUESTO_IMPORTACION:
+                    excedidos.append(f"{nombre} ({escenario}): importación {resultado['importacion']:.3f}s")
+                if escenario == "esquema listo" and resultado["primera_peticion"] > PRESUPUESTO_PRIMERA_PETICION:
+                    excedidos.append(f"{nombre} ({escenario}): primera petición {resultado['primera_peticion']:.3f}s")
+
+    if excedidos:
+        print("\nPresupuesto de arranque excedido:")
+        for linea in excedidos:
+            print(f"  - {linea}")
+        return 1
+    print("\nPresupuesto de arranque cumplido")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
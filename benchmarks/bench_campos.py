@@ -0,0 +1,74 @@
+"""
+Benchmark de campos parciales del listado de recetas (?fields= e ?incluir=)
+
+Genera recetas con descripción larga y 8 pasos, y mide para una página de
+1.000 recetas el tiempo de consulta + armado + serialización y el tamaño
+del cuerpo JSON con la forma completa (todas las columnas y los pasos)
+frente a vistas recortadas como fields=id,nombre&incluir=.
+
+Uso:
+    python benchmarks/bench_campos.py [--recetas 5000] [--pagina 1000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VARIANTES = (
+    ("completa (por defecto)", None, None),
+    ("fields=id,nombre,tiempo_preparacion", "id,nombre,tiempo_preparacion", None),
+    ("fields=id,nombre&incluir=", "id,nombre", ""),
+)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recetas", type=int, default=5_000)
+    parser.add_argument("--pagina", type=int, default=1_000)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directorio, 'bench.db')}"
+        sys.path.insert(0, RAIZ)
+        from sqlalchemy import select
+        from database import init_db, Receta, Paso
+        from database.db_config import SessionLocal
+        from servicio_recetas.app import (
+            CAMPOS_RECETA, RELACIONES_RECETA, columnas_recetas, construir_recetas, parsear_lista, respuesta_json
+        )
+
+        init_db()
+        db = SessionLocal()
+        db.execute(Receta.__table__.insert(), [
+            {"id": i, "nombre": f"Receta {i}", "descripcion": "Receta familiar de la abuela " * 8,
+             "tiempo_preparacion": 30, "porciones": 4}
+            for i in range(1, args.recetas + 1)
+        ])
+        db.execute(Paso.__table__.insert(), [
+            {"receta_id": i, "numero_paso": n, "descripcion": f"Paso {n}: picar, mezclar y cocinar a fuego lento"}
+            for i in range(1, args.recetas + 1) for n in range(1, 9)
+        ])
+        db.commit()
+
+        print(f"Página de {args.pagina} recetas (de {args.recetas}), mejor de {args.repeticiones}")
+        print(f"{'variante':<40}{'ms':>10}{'bytes':>12}")
+        for nombre, fields, incluir in VARIANTES:
+            campos = parsear_lista(fields, CAMPOS_RECETA, "fields", ())
+            relaciones = parsear_lista(incluir, RELACIONES_RECETA, "incluir", ("pasos",))
+            mejor, tamano = float("inf"), 0
+            for _ in range(args.repeticiones):
+                inicio = time.perf_counter()
+                filas = db.execute(
+                    select(*columnas_recetas(campos)).order_by(Receta.id).limit(args.pagina)
+                ).all()
+                cuerpo = respuesta_json(construir_recetas(db, filas, relaciones, campos)).body
+                mejor = min(mejor, time.perf_counter() - inicio)
+                tamano = len(cuerpo)
+            print(f"{nombre:<40}{mejor * 1000:>10.2f}{tamano:>12,}")
+        db.close()
+
+if __name__ == "__main__":
+    main()
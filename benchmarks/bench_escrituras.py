@@ -0,0 +1,68 @@
+"""
+Benchmark de escrituras: commit por petición vs escritura por lotes
+
+Simula varios hilos de peticiones (como el threadpool de FastAPI) creando
+ingredientes sobre un archivo SQLite, primero con un commit por operación y
+luego con EscritorPorLotes (group commit), y reporta escrituras por segundo.
+
+Uso:
+    python benchmarks/bench_escrituras.py [--hilos 32] [--operaciones 2000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def crear_ingrediente(nombre):
+    from database import Ingrediente
+
+    def operacion(db):
+        db.add(Ingrediente(nombre=nombre, unidad_medida="gramos", categoria="bench"))
+        db.flush()
+        return nombre
+    return operacion
+
+def medir(ejecutar, prefijo: str, hilos: int, operaciones: int) -> float:
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        list(pool.map(ejecutar, (crear_ingrediente(f"{prefijo}-{i}") for i in range(operaciones))))
+    return operaciones / (time.perf_counter() - inicio)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hilos", type=int, default=32)
+    parser.add_argument("--operaciones", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directorio, 'bench.db')}"
+        sys.path.insert(0, RAIZ)
+        from database import init_db, EscritorPorLotes
+        from database.db_config import SessionLocal
+
+        init_db()
+
+        def por_peticion(operacion):
+            with SessionLocal() as db:
+                resultado = operacion(db)
+                db.commit()
+                return resultado
+
+        escritor = EscritorPorLotes(SessionLocal)
+
+        individual = medir(por_peticion, "individual", args.hilos, args.operaciones)
+        lotes = medir(escritor.ejecutar, "lote", args.hilos, args.operaciones)
+
+    print(f"{'modo':<22}{'escrituras/s':>14}")
+    print(f"{'commit por petición':<22}{individual:>14.1f}")
+    print(f"{'escritura por lotes':<22}{lotes:>14.1f}")
+    print(f"\nLotes confirmados: {escritor.lotes_confirmados} "
+          f"(media {args.operaciones / max(escritor.lotes_confirmados, 1):.1f} operaciones por commit)")
+    print(f"Mejora: {lotes / individual:.1f}x")
+
+if __name__ == "__main__":
+    main()
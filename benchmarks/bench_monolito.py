@@ -0,0 +1,114 @@
+"""
+Benchmark de latencia del gateway: modo proxy vs modo monolito
+
+En modo proxy los servicios corren en procesos uvicorn aparte y el gateway les
+llama por HTTP sobre loopback; en modo monolito el gateway les despacha por
+ASGI dentro del mismo proceso. En ambos casos el gateway se invoca en proceso
+para medir solo el salto gateway -> servicio.
+
+Uso:
+    python benchmarks/bench_monolito.py [--peticiones 500]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PUERTO_RECETAS = 8201
+PUERTO_INGREDIENTES = 8202
+
+SCRIPT_MEDICION = """
+import asyncio, json, statistics, sys, time
+import httpx
+from api_gateway.app import app
+from database import init_db
+
+async def main(peticiones):
+    init_db()
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://gateway") as client:
+        receta = (await client.post("/api/recetas/", json={
+            "nombre": "Bench", "pasos": [{"numero_paso": 1, "descripcion": "Paso"}]
+        })).json()
+        for _ in range(20):
+            await client.get(f"/api/recetas/{receta['id']}")
+        tiempos = []
+        for _ in range(peticiones):
+            inicio = time.perf_counter()
+            response = await client.get(f"/api/recetas/{receta['id']}")
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+            assert response.status_code == 200
+    tiempos.sort()
+    print(json.dumps({
+        "media": statistics.mean(tiempos),
+        "p50": tiempos[len(tiempos) // 2],
+        "p99": tiempos[int(len(tiempos) * 0.99) - 1],
+    }))
+
+asyncio.run(main(int(sys.argv[1])))
+"""
+
+def esperar_listo(url: str, intentos: int = 200):
+    for _ in range(intentos):
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"El servicio no respondió en {url}")
+
+def medir(modo: str, env: dict, peticiones: int) -> dict:
+    env = dict(env, GATEWAY_MODO=modo, PYTHONPATH=RAIZ)
+    salida = subprocess.run(
+        [sys.executable, "-c", SCRIPT_MEDICION, str(peticiones)],
+        cwd=RAIZ, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peticiones", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(directorio, 'bench.db')}",
+            RECETAS_SERVICE_URL=f"http://127.0.0.1:{PUERTO_RECETAS}",
+            INGREDIENTES_SERVICE_URL=f"http://127.0.0.1:{PUERTO_INGREDIENTES}",
+        )
+        servicios = [
+            subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", modulo, "--port", str(puerto), "--log-level", "warning"],
+                cwd=RAIZ, env=env
+            )
+            for modulo, puerto in (
+                ("servicio_recetas.app:app", PUERTO_RECETAS),
+                ("servicio_ingredientes.app:app", PUERTO_INGREDIENTES),
+            )
+        ]
+        try:
+            esperar_listo(f"http://127.0.0.1:{PUERTO_RECETAS}/ready")
+            esperar_listo(f"http://127.0.0.1:{PUERTO_INGREDIENTES}/ready")
+            resultados = {"proxy": medir("proxy", env, args.peticiones)}
+        finally:
+            for proceso in servicios:
+                proceso.terminate()
+                proceso.wait()
+        resultados["monolito"] = medir("monolito", env, args.peticiones)
+
+    print(f"{'modo':<10}{'media (ms)':>12}{'p50 (ms)':>12}{'p99 (ms)':>12}")
+    for modo, r in resultados.items():
+        print(f"{modo:<10}{r['media']:>12.3f}{r['p50']:>12.3f}{r['p99']:>12.3f}")
+    ahorro = resultados["proxy"]["media"] - resultados["monolito"]["media"]
+    print(f"\nLatencia media ahorrada por petición: {ahorro:.3f} ms")
+
+if __name__ == "__main__":
+    main()
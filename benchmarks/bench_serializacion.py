@@ -0,0 +1,89 @@
+"""
+Benchmark de serialización del listado de recetas
+
+Compara, para páginas de 100, 1.000 y 10.000 recetas con 5 pasos cada una:
+
+- ORM: objetos Receta del ORM validados con RecetaResponse (from_attributes)
+  y serializados con el codificador JSON estándar, como hace FastAPI con
+  response_model.
+- Rápido: tuplas SQL armadas como diccionarios y serializadas a bytes con
+  pydantic-core en una sola pasada (ruta actual de listar_recetas).
+
+Uso:
+    python benchmarks/bench_serializacion.py [--repeticiones 5]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TAMANOS = (100, 1_000, 10_000)
+
+def preparar(directorio: str):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directorio, 'bench.db')}"
+    sys.path.insert(0, RAIZ)
+    from database import init_db, Receta, Paso
+    from database.db_config import SessionLocal
+
+    init_db()
+    db = SessionLocal()
+    for i in range(max(TAMANOS)):
+        receta = Receta(nombre=f"Receta {i}", descripcion="Descripción de prueba " * 5,
+                        tiempo_preparacion=30, porciones=4)
+        receta.pasos = [Paso(numero_paso=n, descripcion=f"Paso {n}: mezclar y cocinar") for n in range(1, 6)]
+        db.add(receta)
+    db.commit()
+    db.close()
+    return SessionLocal
+
+def cronometrar(funcion, repeticiones: int) -> float:
+    mejores = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        mejores.append(time.perf_counter() - inicio)
+    return min(mejores) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        SessionLocal = preparar(directorio)
+
+        from pydantic import TypeAdapter
+        from sqlalchemy import select
+        from database import Receta
+        from servicio_recetas.app import RecetaResponse, COLUMNAS_RECETA, construir_recetas, respuesta_json
+
+        adaptador = TypeAdapter(List[RecetaResponse])
+
+        def ruta_orm(limite):
+            db = SessionLocal()
+            recetas = db.query(Receta).order_by(Receta.id).limit(limite).all()
+            datos = adaptador.dump_python(adaptador.validate_python(recetas), mode="json")
+            cuerpo = json.dumps(datos, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            db.close()
+            return cuerpo
+
+        def ruta_rapida(limite):
+            db = SessionLocal()
+            filas = db.execute(select(*COLUMNAS_RECETA).order_by(Receta.id).limit(limite)).all()
+            cuerpo = respuesta_json(construir_recetas(db, filas)).body
+            db.close()
+            return cuerpo
+
+        print(f"{'recetas':>8}{'ORM (ms)':>12}{'rápido (ms)':>14}{'aceleración':>14}")
+        for tamano in TAMANOS:
+            assert json.loads(ruta_orm(tamano)) == json.loads(ruta_rapida(tamano))
+            orm = cronometrar(lambda: ruta_orm(tamano), args.repeticiones)
+            rapido = cronometrar(lambda: ruta_rapida(tamano), args.repeticiones)
+            print(f"{tamano:>8}{orm:>12.2f}{rapido:>14.2f}{orm / rapido:>13.1f}x")
+
+if __name__ == "__main__":
+    main()
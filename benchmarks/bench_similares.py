@@ -0,0 +1,101 @@
+"""
+Benchmark del motor de recetas similares sobre datos sintéticos
+
+Genera N recetas con ingredientes de popularidad sesgada (unos pocos muy
+comunes, muchos raros), construye el índice desde SQLite y mide la latencia
+de consultas individuales, el rendimiento en lote y, como referencia, la
+comparación ingenua receta por receta con conjuntos de Python.
+
+Uso:
+    python benchmarks/bench_similares.py [--recetas 100000] [--ingredientes 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def generar(db, recetas: int, ingredientes: int, por_receta: int):
+    from database import Receta, Ingrediente, RecetaIngrediente
+
+    rng = random.Random(42)
+    pesos = [1 / (i + 1) for i in range(ingredientes)]
+    # Las claves foráneas se aplican: los ingredientes tienen que existir antes de los vínculos
+    db.execute(Ingrediente.__table__.insert(), [
+        {"id": i, "nombre": f"Ingrediente {i}"} for i in range(1, ingredientes + 1)
+    ])
+    db.execute(Receta.__table__.insert(), [{"id": i, "nombre": f"Receta {i}"} for i in range(1, recetas + 1)])
+    links = []
+    for receta_id in range(1, recetas + 1):
+        for ingrediente_id in set(rng.choices(range(1, ingredientes + 1), weights=pesos, k=por_receta)):
+            links.append({"receta_id": receta_id, "ingrediente_id": ingrediente_id, "cantidad": 1.0})
+    db.execute(RecetaIngrediente.__table__.insert(), links)
+    db.commit()
+    return links
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recetas", type=int, default=100_000)
+    parser.add_argument("--ingredientes", type=int, default=2_000)
+    parser.add_argument("--por-receta", type=int, default=8)
+    parser.add_argument("--consultas", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directorio, 'bench.db')}"
+        sys.path.insert(0, RAIZ)
+        from database import init_db
+        from database.db_config import SessionLocal
+        from servicio_recetas.similares import IndiceSimilitud
+
+        init_db()
+        db = SessionLocal()
+        links = generar(db, args.recetas, args.ingredientes, args.por_receta)
+
+        indice = IndiceSimilitud()
+        inicio = time.perf_counter()
+        indice.sincronizar(db)
+        construccion = time.perf_counter() - inicio
+        db.close()
+
+    rng = random.Random(7)
+    consultas = [rng.randint(1, args.recetas) for _ in range(args.consultas)]
+
+    tiempos = []
+    for receta_id in consultas:
+        inicio = time.perf_counter()
+        indice.vecinos(receta_id, k=10)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+
+    inicio = time.perf_counter()
+    indice.vecinos_lote(consultas, k=10)
+    lote = time.perf_counter() - inicio
+
+    # Referencia: Jaccard receta por receta con conjuntos de Python
+    conjuntos = {}
+    for link in links:
+        conjuntos.setdefault(link["receta_id"], set()).add(link["ingrediente_id"])
+    ingenuas = consultas[:5]
+    inicio = time.perf_counter()
+    for receta_id in ingenuas:
+        propio = conjuntos.get(receta_id, set())
+        puntajes = [
+            (len(propio & otro) / len(propio | otro), otro_id)
+            for otro_id, otro in conjuntos.items() if otro_id != receta_id and propio | otro
+        ]
+        sorted(puntajes, reverse=True)[:10]
+    ingenua = (time.perf_counter() - inicio) / len(ingenuas) * 1000
+
+    print(f"Recetas: {args.recetas}, ingredientes: {args.ingredientes}, vínculos: {len(links)}")
+    print(f"Construcción del índice:        {construccion:8.2f} s")
+    print(f"Consulta individual p50:        {tiempos[len(tiempos) // 2]:8.2f} ms")
+    print(f"Consulta individual p99:        {tiempos[int(len(tiempos) * 0.99) - 1]:8.2f} ms")
+    print(f"En lote ({len(consultas)} consultas):       {lote / len(consultas) * 1000:8.2f} ms por consulta")
+    print(f"Comparación ingenua por pares:  {ingenua:8.2f} ms por consulta")
+
+if __name__ == "__main__":
+    main()
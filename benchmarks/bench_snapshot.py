@@ -0,0 +1,125 @@
+"""
+Benchmark del snapshot de lectura en memoria (RECETAS_SNAPSHOT=1)
+
+Genera recetas con 6 pasos y 4 ingredientes (textos de pasos repetidos,
+como en un recetario real) y compara:
+
+- Memoria por receta del snapshot (tracemalloc) frente a las mismas recetas
+  cargadas como objetos del ORM con sus pasos e ingredientes.
+- Peticiones por segundo de obtener una receta y de listar una página de
+  100, con consulta SQL + armado de diccionarios frente al snapshot (ambos
+  incluyen la serialización JSON de la respuesta).
+
+Uso:
+    python benchmarks/bench_snapshot.py [--recetas 20000] [--segundos 2]
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PASOS_COMUNES = ("Picar la cebolla", "Mezclar los ingredientes", "Hornear 30 minutos", "Dejar reposar",
+                 "Salpimentar", "Servir caliente", "Batir los huevos", "Hervir el agua")
+
+def medir_memoria(cargar) -> tuple:
+    """Bytes retenidos por lo que devuelve `cargar` (se mantiene vivo hasta medir)"""
+    gc.collect()
+    tracemalloc.start()
+    antes = tracemalloc.get_traced_memory()[0]
+    objeto = cargar()
+    gc.collect()
+    despues = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return objeto, despues - antes
+
+def por_segundo(operacion, segundos: float) -> float:
+    operaciones, inicio = 0, time.perf_counter()
+    while time.perf_counter() - inicio < segundos:
+        operacion()
+        operaciones += 1
+    return operaciones / (time.perf_counter() - inicio)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recetas", type=int, default=20_000)
+    parser.add_argument("--segundos", type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directorio, 'bench.db')}"
+        sys.path.insert(0, RAIZ)
+        from sqlalchemy import select
+        from sqlalchemy.orm import selectinload
+        from database import init_db, Receta, Paso, Ingrediente, RecetaIngrediente
+        from database.db_config import SessionLocal
+        from servicio_recetas.app import COLUMNAS_RECETA, construir_recetas, obtener_receta_dict, respuesta_json
+        from servicio_recetas.snapshot import SnapshotRecetas
+
+        init_db()
+        azar = random.Random(7)
+        db = SessionLocal()
+        db.execute(Ingrediente.__table__.insert(), [
+            {"id": i, "nombre": f"Ingrediente {i}", "categoria": "varios"} for i in range(1, 201)
+        ])
+        db.execute(Receta.__table__.insert(), [
+            {"id": i, "nombre": f"Receta {i}", "descripcion": "Receta familiar de la abuela",
+             "tiempo_preparacion": azar.choice((10, 20, 30, 45, 60, None)), "porciones": azar.randint(1, 8)}
+            for i in range(1, args.recetas + 1)
+        ])
+        db.execute(Paso.__table__.insert(), [
+            {"receta_id": i, "numero_paso": n, "descripcion": azar.choice(PASOS_COMUNES)}
+            for i in range(1, args.recetas + 1) for n in range(1, 7)
+        ])
+        db.execute(RecetaIngrediente.__table__.insert(), [
+            {"receta_id": i, "ingrediente_id": ingrediente_id, "cantidad": 1.0}
+            for i in range(1, args.recetas + 1) for ingrediente_id in azar.sample(range(1, 201), 4)
+        ])
+        db.commit()
+
+        def cargar_snapshot():
+            snapshot = SnapshotRecetas(intervalo=3600)
+            snapshot.reconstruir(db)
+            return snapshot
+
+        def cargar_orm():
+            recetas = db.execute(
+                select(Receta).options(selectinload(Receta.pasos), selectinload(Receta.ingredientes))
+            ).scalars().all()
+            return recetas
+
+        snapshot, bytes_snapshot = medir_memoria(cargar_snapshot)
+        orm, bytes_orm = medir_memoria(cargar_orm)
+        del orm
+        db.expunge_all()
+
+        print(f"{args.recetas} recetas (6 pasos y 4 ingredientes cada una)")
+        print(f"{'memoria por receta':<40}{'bytes':>12}")
+        print(f"{'  snapshot (columnas + textos internados)':<40}{bytes_snapshot / args.recetas:>12,.0f}")
+        print(f"{'  objetos del ORM':<40}{bytes_orm / args.recetas:>12,.0f}")
+
+        ids = [azar.randint(1, args.recetas) for _ in range(1000)]
+        siguiente = iter(ids * 10_000).__next__
+
+        def listar_sql():
+            filas = db.execute(select(*COLUMNAS_RECETA).order_by(Receta.id).offset(500).limit(100)).all()
+            return respuesta_json(construir_recetas(db, filas)).body
+
+        variantes = (
+            ("obtener, SQL", lambda: respuesta_json(obtener_receta_dict(db, siguiente())).body),
+            ("obtener, snapshot", lambda: respuesta_json(snapshot.obtener(siguiente())).body),
+            ("listar 100, SQL", listar_sql),
+            ("listar 100, snapshot", lambda: respuesta_json(snapshot.listar(skip=500, limit=100)).body),
+        )
+        print(f"\n{'operación':<40}{'req/s':>12}")
+        for nombre, operacion in variantes:
+            print(f"{nombre:<40}{por_segundo(operacion, args.segundos):>12,.0f}")
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark de escalado con varios workers de gunicorn
+
+Levanta el servicio de recetas con 1, 2, 4... workers (hasta el número de
+CPUs), lo carga con varios procesos cliente y reporta req/s y la eficiencia
+respecto al escalado lineal ideal.
+
+Uso:
+    python benchmarks/bench_workers.py [--segundos 5] [--max-workers N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PUERTO = 8101
+
+def cpus_disponibles() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def sembrar(database_url: str, cantidad: int = 200):
+    """Crear el esquema y algunas recetas con pasos"""
+    os.environ["DATABASE_URL"] = database_url
+    sys.path.insert(0, RAIZ)
+    from database import init_db, Receta, Paso
+    from database.db_config import SessionLocal
+
+    init_db()
+    db = SessionLocal()
+    for i in range(cantidad):
+        receta = Receta(nombre=f"Receta {i}", descripcion="Benchmark", tiempo_preparacion=30, porciones=4)
+        receta.pasos = [Paso(numero_paso=n, descripcion=f"Paso {n}") for n in range(1, 6)]
+        db.add(receta)
+    db.commit()
+    db.close()
+
+def generar_carga(url: str, segundos: float) -> int:
+    """Proceso cliente: peticiones secuenciales durante `segundos`"""
+    completadas = 0
+    fin = time.perf_counter() + segundos
+    with httpx.Client(timeout=10.0) as client:
+        while time.perf_counter() < fin:
+            client.get(url)
+            completadas += 1
+    return completadas
+
+def esperar_listo(url: str, intentos: int = 200):
+    for _ in range(intentos):
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"El servicio no respondió en {url}")
+
+def medir(workers: int, database_url: str, segundos: float, clientes: int) -> float:
+    env = dict(os.environ, DATABASE_URL=database_url, WEB_CONCURRENCY=str(workers), GUNICORN_LOG_LEVEL="warning")
+    proceso = subprocess.Popen(
+        ["gunicorn", "servicio_recetas.app:app", "-c", "gunicorn.conf.py",
+         "--bind", f"127.0.0.1:{PUERTO}", "--access-logfile", "/dev/null"],
+        cwd=RAIZ, env=env
+    )
+    try:
+        esperar_listo(f"http://127.0.0.1:{PUERTO}/ready")
+        url = f"http://127.0.0.1:{PUERTO}/recetas?limit=20"
+        with ProcessPoolExecutor(max_workers=clientes) as pool:
+            totales = list(pool.map(generar_carga, [url] * clientes, [segundos] * clientes))
+        return sum(totales) / segundos
+    finally:
+        proceso.terminate()
+        proceso.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segundos", type=float, default=5.0)
+    parser.add_argument("--max-workers", type=int, default=cpus_disponibles())
+    args = parser.parse_args()
+
+    niveles = [1]
+    while niveles[-1] * 2 <= args.max_workers:
+        niveles.append(niveles[-1] * 2)
+    if niveles[-1] != args.max_workers:
+        niveles.append(args.max_workers)
+
+    with tempfile.TemporaryDirectory() as directorio:
+        database_url = f"sqlite:///{os.path.join(directorio, 'bench.db')}"
+        sembrar(database_url)
+
+        base = None
+        print(f"{'workers':>8}{'req/s':>12}{'aceleración':>14}{'eficiencia':>12}")
+        for workers in niveles:
+            # El doble de clientes que workers para mantenerlos ocupados
+            rps = medir(workers, database_url, args.segundos, clientes=workers * 2)
+            base = base or rps
+            aceleracion = rps / base
+            print(f"{workers:>8}{rps:>12.1f}{aceleracion:>13.2f}x{aceleracion / workers:>11.0%}")
+
+if __name__ == "__main__":
+    main()
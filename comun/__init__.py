@@ -0,0 +1,3 @@
+"""
+Utilidades compartidas por el gateway y los microservicios
+"""
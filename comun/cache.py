@@ -0,0 +1,591 @@
+"""
+Caché compartida entre procesos e instancias
+
+Con varias instancias del gateway y de los servicios, una caché en memoria
+de cada proceso se duplica y no se entera de las escrituras de los demás.
+CACHE_URL elige el almacenamiento:
+
+- `redis://host:puerto/db`: cualquier servidor que hable el protocolo de
+  Redis (RESP). El cliente es mínimo (sockets y un pool de conexiones), sin
+  dependencias nuevas.
+- `memoria://`: diccionario del propio proceso, para un solo worker o pruebas.
+- Sin CACHE_URL la caché está desactivada.
+
+ServidorRESP es un sustituto local que implementa los comandos que usa el
+cliente (GET, SET con PX, MGET, DEL, INCR, PUBLISH, SUBSCRIBE), para pruebas
+y desarrollo sin Redis: `python -m comun.cache --puerto 6379`.
+
+CacheCompartida agrega sobre el almacenamiento:
+
+- Grupos versionados: las claves incluyen la versión del grupo ("recetas",
+  "ingredientes"). Una escritura incrementa la versión con INCR y la publica
+  por pub/sub; cada proceso actualiza la versión que conoce al recibir el
+  mensaje (y la relee cada `ttl_version` segundos por si se perdió uno), así
+  una escritura invalida listados con cualquier combinación de filtros sin
+  borrarlos uno por uno. La suscripción se abre en el primer uso y de nuevo
+  en cada proceso hijo tras un fork (GUNICORN_PRELOAD=1), porque el hilo que
+  escucha no pasa al hijo.
+- Lecturas múltiples en una sola ida y vuelta (MGET) y escrituras en un
+  pipeline, para armar listados con entradas por receta o ingrediente.
+- Protección contra estampidas con refresco temprano probabilístico
+  (XFetch): cada entrada guarda cuánto costó calcularla y su vencimiento, y
+  una lectura la da por vencida antes de tiempo con probabilidad creciente a
+  medida que se acerca el vencimiento. Así un solo proceso la recalcula
+  mientras los demás siguen usando la anterior, en lugar de recalcularla
+  todos a la vez cuando vence.
+
+Los errores del almacenamiento no hacen fallar las peticiones: se cuentan en
+`errores` y la lectura se calcula sin caché.
+"""
+import math
+import os
+import random
+import socket
+import socketserver
+import struct
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+# Canal de pub/sub por el que se anuncian las nuevas versiones de los grupos
+CANAL_INVALIDACIONES = "invalidaciones"
+# Cabecera de cada entrada: segundos que costó calcularla y vencimiento (epoch)
+_CABECERA = struct.Struct("!dd")
+
+class ErrorCache(Exception):
+    """Fallo del almacenamiento de la caché (conexión, protocolo o respuesta de error)"""
+
+class CacheMemoria:
+    """Almacenamiento en memoria del proceso, con vencimiento y tope de entradas (LRU)"""
+
+    def __init__(self, max_entradas: int = 10000):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self._suscriptores: Dict[str, List[Callable]] = {}
+
+    def obtener_varios(self, claves: List[str]) -> List[Optional[bytes]]:
+        ahora = time.monotonic()
+        valores = []
+        with self._lock:
+            for clave in claves:
+                entrada = self._datos.get(clave)
+                if entrada is None or (entrada[1] is not None and entrada[1] <= ahora):
+                    valores.append(None)
+                    continue
+                self._datos.move_to_end(clave)
+                valores.append(entrada[0])
+        return valores
+
+    def guardar_varios(self, valores: Dict[str, bytes], ttl: Optional[float] = None):
+        expira = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            for clave, valor in valores.items():
+                self._datos[clave] = (valor, expira)
+                self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def incrementar(self, clave: str) -> int:
+        with self._lock:
+            valor = int(self._datos.get(clave, (b"0", None))[0]) + 1
+            self._datos[clave] = (str(valor).encode(), None)
+        return valor
+
+    def eliminar(self, claves: Iterable[str]):
+        with self._lock:
+            for clave in claves:
+                self._datos.pop(clave, None)
+
+    def publicar(self, canal: str, mensaje: bytes):
+        for callback in list(self._suscriptores.get(canal, ())):
+            callback(mensaje)
+
+    def suscribir(self, canal: str, callback: Callable[[Optional[bytes]], None]):
+        suscriptores = self._suscriptores.setdefault(canal, [])
+        if callback not in suscriptores:
+            suscriptores.append(callback)
+
+    def cerrar(self):
+        self._suscriptores.clear()
+
+def _codificar(comando: Tuple) -> bytes:
+    partes = [b"*%d\r\n" % len(comando)]
+    for argumento in comando:
+        if not isinstance(argumento, bytes):
+            argumento = str(argumento).encode()
+        partes.append(b"$%d\r\n%s\r\n" % (len(argumento), argumento))
+    return b"".join(partes)
+
+def _leer_respuesta(archivo):
+    """Leer una respuesta RESP2; los errores del servidor se devuelven como ErrorCache"""
+    linea = archivo.readline()
+    if not linea.endswith(b"\r\n"):
+        raise ConnectionError("Conexión cerrada por el servidor de caché")
+    tipo, contenido = linea[:1], linea[1:-2]
+    if tipo == b"+":
+        return contenido.decode()
+    if tipo == b"-":
+        return ErrorCache(contenido.decode())
+    if tipo == b":":
+        return int(contenido)
+    if tipo == b"$":
+        largo = int(contenido)
+        if largo < 0:
+            return None
+        datos = archivo.read(largo + 2)
+        if len(datos) != largo + 2:
+            raise ConnectionError("Conexión cerrada por el servidor de caché")
+        return datos[:-2]
+    if tipo == b"*":
+        cantidad = int(contenido)
+        return None if cantidad < 0 else [_leer_respuesta(archivo) for _ in range(cantidad)]
+    raise ErrorCache(f"Respuesta RESP desconocida: {linea!r}")
+
+class ConexionRESP:
+    """Una conexión TCP con un servidor RESP"""
+
+    def __init__(self, host: str, puerto: int, db: int = 0, timeout: Optional[float] = 0.5):
+        self.socket = socket.create_connection((host, puerto), timeout=timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.archivo = self.socket.makefile("rb")
+        if db:
+            self.canalizar([("SELECT", db)])
+
+    def enviar(self, comandos: List[Tuple]):
+        self.socket.sendall(b"".join(_codificar(comando) for comando in comandos))
+
+    def leer(self):
+        return _leer_respuesta(self.archivo)
+
+    def canalizar(self, comandos: List[Tuple]) -> list:
+        """Enviar todos los comandos juntos (pipeline) y leer sus respuestas en orden"""
+        self.enviar(comandos)
+        respuestas = [self.leer() for _ in comandos]
+        for respuesta in respuestas:
+            if isinstance(respuesta, ErrorCache):
+                raise respuesta
+        return respuestas
+
+    def cerrar(self):
+        try:
+            self.archivo.close()
+            self.socket.close()
+        except OSError:
+            pass
+
+class CacheRedis:
+    """Almacenamiento en un servidor RESP (Redis o ServidorRESP), con un pool de conexiones"""
+
+    def __init__(self, host: str = "localhost", puerto: int = 6379, db: int = 0, timeout: float = 0.5,
+                 max_libres: int = 16):
+        self.host, self.puerto, self.db, self.timeout = host, puerto, db, timeout
+        self.max_libres = max_libres
+        self._libres: List[ConexionRESP] = []
+        self._lock = threading.Lock()
+        self._cerrada = threading.Event()
+        self._suscripciones: List[ConexionRESP] = []
+        _instancias_redis.add(self)
+
+    @classmethod
+    def desde_url(cls, url: str, **opciones) -> "CacheRedis":
+        partes = urlparse(url)
+        db = int(partes.path.strip("/") or 0)
+        return cls(partes.hostname or "localhost", partes.port or 6379, db, **opciones)
+
+    def _canalizar(self, comandos: List[Tuple]) -> list:
+        with self._lock:
+            conexion = self._libres.pop() if self._libres else None
+        try:
+            if conexion is None:
+                conexion = ConexionRESP(self.host, self.puerto, self.db, self.timeout)
+            respuestas = conexion.canalizar(comandos)
+        except ErrorCache:
+            # Error del servidor: la conexión sigue sincronizada y se reutiliza
+            self._devolver(conexion)
+            raise
+        except (OSError, ValueError) as error:
+            if conexion is not None:
+                conexion.cerrar()
+            raise ErrorCache(f"Caché no disponible: {error}") from error
+        self._devolver(conexion)
+        return respuestas
+
+    def _devolver(self, conexion: ConexionRESP):
+        with self._lock:
+            if len(self._libres) < self.max_libres:
+                self._libres.append(conexion)
+                return
+        conexion.cerrar()
+
+    def obtener_varios(self, claves: List[str]) -> List[Optional[bytes]]:
+        if not claves:
+            return []
+        return self._canalizar([("MGET", *claves)])[0]
+
+    def guardar_varios(self, valores: Dict[str, bytes], ttl: Optional[float] = None):
+        if not valores:
+            return
+        extra = ("PX", max(1, int(ttl * 1000))) if ttl else ()
+        self._canalizar([("SET", clave, valor, *extra) for clave, valor in valores.items()])
+
+    def incrementar(self, clave: str) -> int:
+        return self._canalizar([("INCR", clave)])[0]
+
+    def eliminar(self, claves: Iterable[str]):
+        claves = list(claves)
+        if claves:
+            self._canalizar([("DEL", *claves)])
+
+    def publicar(self, canal: str, mensaje: bytes):
+        self._canalizar([("PUBLISH", canal, mensaje)])
+
+    def suscribir(self, canal: str, callback: Callable[[Optional[bytes]], None]):
+        """
+        Escuchar `canal` en un hilo con su propia conexión. Tras reconectar se
+        llama `callback(None)`: pudieron perderse mensajes mientras tanto.
+        """
+        def escuchar():
+            espera = 0.1
+            while not self._cerrada.is_set():
+                try:
+                    conexion = ConexionRESP(self.host, self.puerto, self.db, timeout=None)
+                except OSError:
+                    self._cerrada.wait(espera)
+                    espera = min(espera * 2, 5.0)
+                    continue
+                self._suscripciones.append(conexion)
+                try:
+                    conexion.enviar([("SUBSCRIBE", canal)])
+                    conexion.leer()  # confirmación de la suscripción
+                    callback(None)
+                    espera = 0.1
+                    while True:
+                        mensaje = conexion.leer()
+                        if isinstance(mensaje, list) and mensaje[0] == b"message":
+                            callback(mensaje[2])
+                except (OSError, ValueError):
+                    pass
+                finally:
+                    conexion.cerrar()
+                    self._suscripciones.remove(conexion)
+
+        threading.Thread(target=escuchar, name=f"cache-sub-{canal}", daemon=True).start()
+
+    def cerrar(self):
+        self._cerrada.set()
+        for conexion in list(self._suscripciones) + self._libres:
+            try:
+                conexion.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conexion.cerrar()
+        self._libres = []
+
+    def descartar_heredado(self):
+        """
+        En el hijo de un fork: las conexiones del pool y de las suscripciones
+        son del padre (compartirlas mezclaría respuestas) y sus hilos no
+        existen. Se olvidan sin cerrarlas para no cortárselas al padre.
+        """
+        self._lock = threading.Lock()
+        self._libres = []
+        self._suscripciones = []
+
+# Almacenamientos Redis del proceso, para soltar sus conexiones en los hijos de un fork
+_instancias_redis = weakref.WeakSet()
+
+def _descartar_conexiones_heredadas():
+    for almacenamiento in list(_instancias_redis):
+        almacenamiento.descartar_heredado()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_descartar_conexiones_heredadas)
+
+class ServidorRESP(socketserver.ThreadingTCPServer):
+    """Servidor RESP mínimo en memoria (sustituto local de Redis para pruebas y desarrollo)"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", puerto: int = 0):
+        self.datos: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self.suscriptores: Dict[bytes, set] = {}
+        self.lock = threading.Lock()
+        super().__init__((host, puerto), _ManejadorRESP)
+
+    @property
+    def url(self) -> str:
+        host, puerto = self.server_address[:2]
+        return f"redis://{host}:{puerto}/0"
+
+    def iniciar(self) -> "ServidorRESP":
+        threading.Thread(target=self.serve_forever, name="servidor-resp", daemon=True).start()
+        return self
+
+    def detener(self):
+        self.shutdown()
+        self.server_close()
+
+    def vigente(self, clave: bytes) -> Optional[bytes]:
+        entrada = self.datos.get(clave)
+        if entrada is None:
+            return None
+        if entrada[1] is not None and entrada[1] <= time.monotonic():
+            del self.datos[clave]
+            return None
+        return entrada[0]
+
+class _ManejadorRESP(socketserver.StreamRequestHandler):
+
+    def responder(self, valor):
+        if valor is None:
+            self.wfile.write(b"$-1\r\n")
+        elif isinstance(valor, ErrorCache):
+            self.wfile.write(b"-ERR %s\r\n" % str(valor).encode())
+        elif isinstance(valor, int):
+            self.wfile.write(b":%d\r\n" % valor)
+        elif isinstance(valor, str):
+            self.wfile.write(b"+%s\r\n" % valor.encode())
+        elif isinstance(valor, bytes):
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(valor), valor))
+        else:
+            self.wfile.write(b"*%d\r\n" % len(valor))
+            for elemento in valor:
+                self.responder(elemento)
+
+    def handle(self):
+        servidor: ServidorRESP = self.server
+        self.canales = set()
+        try:
+            while True:
+                comando = _leer_respuesta(self.rfile)
+                if not isinstance(comando, list) or not comando:
+                    return
+                with servidor.lock:
+                    respuesta = self.ejecutar(servidor, comando[0].upper(), comando[1:])
+                    self.responder(respuesta)
+                    self.wfile.flush()
+        except (OSError, ValueError, ErrorCache):
+            pass
+        finally:
+            with servidor.lock:
+                for canal in self.canales:
+                    servidor.suscriptores.get(canal, set()).discard(self)
+
+    def ejecutar(self, servidor: ServidorRESP, nombre: bytes, args: list):
+        if nombre == b"PING":
+            return "PONG"
+        if nombre in (b"SELECT", b"FLUSHDB"):
+            if nombre == b"FLUSHDB":
+                servidor.datos.clear()
+            return "OK"
+        if nombre == b"GET":
+            return servidor.vigente(args[0])
+        if nombre == b"MGET":
+            return [servidor.vigente(clave) for clave in args]
+        if nombre == b"SET":
+            expira = None
+            if len(args) >= 4 and args[2].upper() in (b"PX", b"EX"):
+                factor = 1000 if args[2].upper() == b"EX" else 1
+                expira = time.monotonic() + int(args[3]) * factor / 1000
+            servidor.datos[args[0]] = (args[1], expira)
+            return "OK"
+        if nombre == b"DEL":
+            return sum(servidor.datos.pop(clave, None) is not None for clave in args)
+        if nombre == b"INCR":
+            valor = int(servidor.vigente(args[0]) or 0) + 1
+            servidor.datos[args[0]] = (str(valor).encode(), None)
+            return valor
+        if nombre == b"PUBLISH":
+            receptores = list(servidor.suscriptores.get(args[0], ()))
+            for receptor in receptores:
+                try:
+                    receptor.responder([b"message", args[0], args[1]])
+                    receptor.wfile.flush()
+                except OSError:
+                    pass
+            return len(receptores)
+        if nombre == b"SUBSCRIBE":
+            for canal in args:
+                servidor.suscriptores.setdefault(canal, set()).add(self)
+                self.canales.add(canal)
+            return [b"subscribe", args[-1], len(self.canales)]
+        return ErrorCache(f"comando no soportado '{nombre.decode()}'")
+
+def _empaquetar(valor: bytes, delta: float, expira: float) -> bytes:
+    return _CABECERA.pack(delta, expira) + valor
+
+def _desempaquetar(crudo: bytes) -> Tuple[bytes, float, float]:
+    delta, expira = _CABECERA.unpack_from(crudo)
+    return crudo[_CABECERA.size:], delta, expira
+
+class CacheCompartida:
+    """Grupos versionados, lecturas en lote y refresco temprano (XFetch) sobre un almacenamiento"""
+
+    def __init__(self, almacenamiento, prefijo: str = "recetario", ttl: float = 60.0, beta: float = 1.0,
+                 ttl_version: float = 5.0, semilla: Optional[int] = None):
+        self.almacenamiento = almacenamiento
+        self.prefijo = prefijo
+        self.ttl = ttl
+        self.beta = beta
+        self.ttl_version = ttl_version
+        self.aciertos = self.fallos = self.errores = 0
+        self._azar = random.Random(semilla)
+        # grupo -> (versión, instante en que se leyó)
+        self._versiones: Dict[str, Tuple[int, float]] = {}
+        self._canal = f"{prefijo}:{CANAL_INVALIDACIONES}"
+        # Proceso en el que se abrió la suscripción (None: todavía no se usó)
+        self._suscrita_en: Optional[int] = None
+        self._lock_suscripcion = threading.Lock()
+
+    def _suscribir(self):
+        """Escuchar las invalidaciones desde el primer uso en cada proceso (también tras un fork)"""
+        if self._suscrita_en == os.getpid():
+            return
+        with self._lock_suscripcion:
+            if self._suscrita_en == os.getpid():
+                return
+            # Lo heredado del padre pudo quedar viejo mientras no se escuchaba
+            self._versiones.clear()
+            self.almacenamiento.suscribir(self._canal, self._recibir)
+            self._suscrita_en = os.getpid()
+
+    def _recibir(self, mensaje: Optional[bytes]):
+        if mensaje is None:
+            # Suscripción (re)establecida: lo conocido hasta ahora puede estar viejo
+            self._versiones.clear()
+            return
+        grupo, _, version = mensaje.decode().partition(" ")
+        actual = self._versiones.get(grupo)
+        if actual is None or int(version) > actual[0]:
+            self._versiones[grupo] = (int(version), time.monotonic())
+
+    def _clave_version(self, grupo: str) -> str:
+        return f"{self.prefijo}:version:{grupo}"
+
+    def version(self, grupo: str) -> int:
+        self._suscribir()
+        conocida = self._versiones.get(grupo)
+        if conocida is not None and time.monotonic() - conocida[1] < self.ttl_version:
+            return conocida[0]
+        crudo = self.almacenamiento.obtener_varios([self._clave_version(grupo)])[0]
+        version = int(crudo) if crudo is not None else 0
+        self._versiones[grupo] = (version, time.monotonic())
+        return version
+
+    def refrescar(self, *grupos: str):
+        """Olvidar las versiones conocidas: la próxima lectura las relee (leer lo recién escrito)"""
+        for grupo in grupos:
+            self._versiones.pop(grupo, None)
+
+    def invalidar(self, *grupos: str):
+        """Invalidar todas las entradas de los grupos (nueva versión) y avisar a los demás procesos"""
+        self._suscribir()
+        for grupo in grupos:
+            try:
+                version = self.almacenamiento.incrementar(self._clave_version(grupo))
+                self._versiones[grupo] = (version, time.monotonic())
+                self.almacenamiento.publicar(self._canal, f"{grupo} {version}".encode())
+            except ErrorCache:
+                self.errores += 1
+                self._versiones.pop(grupo, None)
+
+    def _clave(self, grupo: str, version: int, clave: str) -> str:
+        return f"{self.prefijo}:{grupo}:v{version}:{clave}"
+
+    def leer(self, grupo: str, claves: List[str]) -> Tuple[Dict[str, bytes], Optional[int]]:
+        """
+        Entradas vigentes de `claves` en una sola consulta y la versión del
+        grupo con la que guardar las faltantes (None si la caché falló).
+        Una entrada cerca de vencer puede darse por faltante antes de tiempo.
+        """
+        try:
+            version = self.version(grupo)
+            crudos = self.almacenamiento.obtener_varios([self._clave(grupo, version, clave) for clave in claves])
+        except ErrorCache:
+            self.errores += 1
+            return {}, None
+        ahora = time.time()
+        encontrados = {}
+        for clave, crudo in zip(claves, crudos):
+            if crudo is None:
+                continue
+            valor, delta, expira = _desempaquetar(crudo)
+            # XFetch: vence antes con probabilidad mayor cuanto más costó calcularla y más cerca está
+            if ahora - delta * self.beta * math.log(1.0 - self._azar.random()) < expira:
+                encontrados[clave] = valor
+        self.aciertos += len(encontrados)
+        self.fallos += len(claves) - len(encontrados)
+        return encontrados, version
+
+    def guardar(self, grupo: str, version: Optional[int], valores: Dict[str, bytes], delta: float = 0.0,
+                ttl: Optional[float] = None):
+        """Guardar con un pipeline las entradas calculadas en `delta` segundos"""
+        if version is None or not valores:
+            return
+        ttl = ttl or self.ttl
+        expira = time.time() + ttl
+        try:
+            self.almacenamiento.guardar_varios({
+                self._clave(grupo, version, clave): _empaquetar(valor, delta, expira)
+                for clave, valor in valores.items()
+            }, ttl)
+        except ErrorCache:
+            self.errores += 1
+
+    def obtener_varios(self, grupo: str, claves: List[str],
+                       calcular: Callable[[List[str]], Dict[str, bytes]]) -> Dict[str, bytes]:
+        """Entradas de `claves`; las faltantes se calculan juntas con `calcular(faltantes)`"""
+        encontrados, version = self.leer(grupo, claves)
+        faltantes = [clave for clave in claves if clave not in encontrados]
+        if faltantes:
+            inicio = time.monotonic()
+            calculados = calcular(faltantes)
+            self.guardar(grupo, version, calculados, time.monotonic() - inicio)
+            encontrados.update(calculados)
+        return encontrados
+
+    def obtener(self, grupo: str, clave: str, calcular: Callable[[], Optional[bytes]]) -> Optional[bytes]:
+        """Entrada de `clave`, calculada con `calcular()` si falta (None no se guarda)"""
+        def calcular_una(_):
+            valor = calcular()
+            return {} if valor is None else {clave: valor}
+        return self.obtener_varios(grupo, [clave], calcular_una).get(clave)
+
+    def estado(self) -> dict:
+        return {"aciertos": self.aciertos, "fallos": self.fallos, "errores": self.errores}
+
+def cache_desde_entorno() -> Optional[CacheCompartida]:
+    """Caché configurada con CACHE_URL, CACHE_TTL_SEGUNDOS y CACHE_XFETCH_BETA (None sin CACHE_URL)"""
+    return crear_cache(
+        os.getenv("CACHE_URL", ""),
+        ttl=float(os.getenv("CACHE_TTL_SEGUNDOS", "60")),
+        beta=float(os.getenv("CACHE_XFETCH_BETA", "1"))
+    )
+
+def crear_cache(url: Optional[str], **opciones) -> Optional[CacheCompartida]:
+    """CacheCompartida para CACHE_URL (`redis://...` o `memoria://`); None si no hay URL"""
+    if not url:
+        return None
+    if url.startswith("memoria://"):
+        return CacheCompartida(CacheMemoria(), **opciones)
+    if url.startswith("redis://"):
+        return CacheCompartida(CacheRedis.desde_url(url), **opciones)
+    raise ValueError(f"CACHE_URL no soportada: {url}")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Servidor RESP local en memoria (sustituto de Redis)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=6379)
+    args = parser.parse_args()
+    servidor = ServidorRESP(args.host, args.puerto)
+    print(f"Escuchando en {servidor.url}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        servidor.server_close()
@@ -0,0 +1,150 @@
+"""
+Diagnóstico en caliente del proceso
+
+Endpoints bajo /debug para investigar un servicio lento sin redesplegar:
+
+- GET /debug/profile?segundos=N: perfilador por muestreo. Un hilo lee
+  sys._current_frames() cada `intervalo_ms` y cuenta las pilas de todos los
+  hilos; no instrumenta llamadas, así que el costo es el de cada muestra.
+  Devuelve las pilas en formato "collapsed" (una línea por pila,
+  `marco;marco;marco cantidad`), listo para flamegraph.pl o speedscope.
+- GET /debug/memoria: los puntos de asignación con más memoria según
+  tracemalloc (se activa en la primera llamada y `detener=true` lo apaga) y
+  el tamaño del identity map de las sesiones de SQLAlchemy abiertas.
+
+Están desactivados salvo que se defina DEBUG_TOKEN: sin él responden 404, y
+con él exigen el mismo valor en el header X-Debug-Token. Con varios workers
+de gunicorn cada petición diagnostica solo el worker que la atiende.
+"""
+import gc
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+PERFIL_MAX_SEGUNDOS = 60
+# Marcos guardados por asignación mientras tracemalloc está activo
+TRACEMALLOC_MARCOS = 10
+
+_perfil_en_curso = threading.Lock()
+
+def verificar_token(x_debug_token: Optional[str] = Header(default=None)):
+    """Dependencia: 404 si el diagnóstico está desactivado, 403 si el token no coincide"""
+    esperado = os.getenv("DEBUG_TOKEN", "")
+    if not esperado:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_debug_token or not hmac.compare_digest(x_debug_token.encode(), esperado.encode()):
+        raise HTTPException(status_code=403, detail="Token de diagnóstico inválido")
+
+def _marco(frame) -> str:
+    codigo = frame.f_code
+    return f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{frame.f_lineno})"
+
+def perfilar(segundos: float, intervalo: float) -> Counter:
+    """Muestrear las pilas de todos los hilos (salvo el propio) durante `segundos`"""
+    propio = threading.get_ident()
+    nombres = {hilo.ident: hilo.name for hilo in threading.enumerate()}
+    pilas = Counter()
+    fin = time.monotonic() + segundos
+    while time.monotonic() < fin:
+        for ident, frame in sys._current_frames().items():
+            if ident == propio:
+                continue
+            marcos = []
+            while frame is not None:
+                marcos.append(_marco(frame))
+                frame = frame.f_back
+            marcos.append(nombres.get(ident) or f"hilo-{ident}")
+            pilas[";".join(reversed(marcos))] += 1
+        time.sleep(intervalo)
+    return pilas
+
+def tamanos_identity_map() -> dict:
+    """Objetos cargados en las sesiones de SQLAlchemy vivas, en total y por modelo"""
+    try:
+        from sqlalchemy.orm.session import _sessions
+    except ImportError:
+        return {"sesiones": 0, "objetos": 0, "por_modelo": {}}
+    sesiones = list(_sessions.values())
+    por_modelo = Counter()
+    for sesion in sesiones:
+        for objeto in list(sesion.identity_map.values()):
+            por_modelo[type(objeto).__name__] += 1
+    return {
+        "sesiones": len(sesiones),
+        "objetos": sum(por_modelo.values()),
+        "nuevos": sum(len(sesion.new) for sesion in sesiones),
+        "modificados": sum(len(sesion.dirty) for sesion in sesiones),
+        "por_modelo": dict(por_modelo.most_common()),
+    }
+
+def resumen_tracemalloc(top: int) -> dict:
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_MARCOS)
+        return {"activo": True, "recien_iniciado": True, "top": []}
+    captura = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    actual, pico = tracemalloc.get_traced_memory()
+    return {
+        "activo": True,
+        "recien_iniciado": False,
+        "actual_bytes": actual,
+        "pico_bytes": pico,
+        "top": [
+            {
+                "archivo": estadistica.traceback[0].filename,
+                "linea": estadistica.traceback[0].lineno,
+                "bytes": estadistica.size,
+                "bloques": estadistica.count,
+            }
+            for estadistica in captura.statistics("lineno")[:top]
+        ],
+    }
+
+def crear_router_diagnostico() -> APIRouter:
+    """Router con /debug/profile y /debug/memoria, protegido por DEBUG_TOKEN"""
+    router = APIRouter(prefix="/debug", dependencies=[Depends(verificar_token)], include_in_schema=False)
+
+    @router.get("/profile", response_class=PlainTextResponse)
+    def perfil(segundos: float = 5.0, intervalo_ms: float = 5.0):
+        """Pilas muestreadas en formato collapsed (una línea por pila, con su cantidad de muestras)"""
+        if not 0 < segundos <= PERFIL_MAX_SEGUNDOS:
+            raise HTTPException(status_code=400, detail=f"segundos debe estar entre 0 y {PERFIL_MAX_SEGUNDOS}")
+        if not 1 <= intervalo_ms <= 1000:
+            raise HTTPException(status_code=400, detail="intervalo_ms debe estar entre 1 y 1000")
+        # Un perfil a la vez: dos muestreadores se medirían entre sí
+        if not _perfil_en_curso.acquire(blocking=False):
+            raise HTTPException(status_code=409, detail="Ya hay un perfil en curso")
+        try:
+            pilas = perfilar(segundos, intervalo_ms / 1000)
+        finally:
+            _perfil_en_curso.release()
+        return PlainTextResponse(
+            "".join(f"{pila} {cantidad}\n" for pila, cantidad in pilas.most_common()),
+            headers={"X-Muestras": str(sum(pilas.values()))}
+        )
+
+    @router.get("/memoria")
+    def memoria(top: int = 20, detener: bool = False):
+        """Mayores puntos de asignación (tracemalloc) e identity maps de SQLAlchemy"""
+        if detener:
+            tracemalloc.stop()
+            datos_tracemalloc = {"activo": False}
+        else:
+            datos_tracemalloc = resumen_tracemalloc(min(max(top, 1), 200))
+        return {
+            "tracemalloc": datos_tracemalloc,
+            "identity_map": tamanos_identity_map(),
+            "gc": {"objetos": len(gc.get_objects()), "conteos": gc.get_count()},
+        }
+
+    return router
@@ -0,0 +1,19 @@
+"""
+Parámetros de consulta compartidos por los microservicios
+"""
+from typing import Iterable, Optional
+
+from fastapi import HTTPException
+
+def parsear_lista(valor: Optional[str], permitidos: Iterable[str], parametro: str, defecto: Iterable[str]) -> tuple:
+    """Interpretar un parámetro separado por comas; 400 si trae valores no soportados"""
+    if valor is None:
+        return tuple(defecto)
+    elegidos = tuple(dict.fromkeys(parte.strip() for parte in valor.split(",") if parte.strip()))
+    desconocidos = [elegido for elegido in elegidos if elegido not in permitidos]
+    if desconocidos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Valores no soportados en {parametro}: {', '.join(desconocidos)}. Use: {', '.join(permitidos)}"
+        )
+    return elegidos
@@ -1,7 +1,16 @@
 """
 Módulo de base de datos
 """
-from .db_config import get_db, init_db, Base, engine
-from .models import Receta, Paso, Ingrediente, RecetaIngrediente
+from .db_config import get_db, init_db, base_datos_lista, Base, engine, ESQUEMA_VERSION
+from .models import (Receta, Paso, Ingrediente, RecetaIngrediente, Cambio, RecetaFirma, IndiceEstado,
+                     RecetaResumen, CategoriaBit, Trabajo, EstadisticaIngrediente, EstadisticaCategoria, Contador)
+from .lotes import ejecutar_escritura, EscritorPorLotes
+from .cambios import registrar_cambio, registrar_cambios, listar_cambios, seq_actual, SeguidorCambios
+from .replicas import get_db_lectura, get_db_escritura, configurar_replicas, LecturaPropiaMiddleware
+from .resumen import recalcular_resumenes, ajustar_num_pasos, recetas_con_ingrediente
+from .trabajos import EjecutorTrabajos, ContextoTrabajo, encolar, contar_pendientes, trabajo_dict
 
-__all__ = ["get_db", "init_db", "Base", "engine", "Receta", "Paso", "Ingrediente", "RecetaIngrediente"]
+__all__ = ["get_db", "get_db_lectura", "get_db_escritura", "configurar_replicas", "LecturaPropiaMiddleware", "init_db", "base_datos_lista", "Base", "engine", "ESQUEMA_VERSION", "ejecutar_escritura", "EscritorPorLotes",
+           "registrar_cambio", "registrar_cambios", "listar_cambios", "seq_actual", "SeguidorCambios", "Receta", "Paso", "Ingrediente", "RecetaIngrediente", "Cambio",
+           "RecetaFirma", "IndiceEstado", "RecetaResumen", "CategoriaBit", "Trabajo", "EstadisticaIngrediente", "EstadisticaCategoria", "Contador", "recalcular_resumenes", "ajustar_num_pasos",
+           "recetas_con_ingrediente", "EjecutorTrabajos", "ContextoTrabajo", "encolar", "contar_pendientes", "trabajo_dict"]
@@ -0,0 +1,156 @@
+"""
+Registro de cambios (outbox) para sincronización incremental
+
+Cada escritura de los microservicios agrega un evento a la tabla `cambios`
+dentro de su misma transacción. Los consumidores leen los eventos en orden
+de `seq` a partir del último que procesaron, sin volver a leer todo.
+
+Leer desde un cursor supone que los `seq` se confirman en orden. SQLite
+serializa las escrituras y así ocurre; con escrituras concurrentes
+(PostgreSQL) una transacción con un `seq` menor puede confirmarse después de
+que se leyó uno mayor, y ese evento quedaría atrás del cursor. Por eso sólo
+se entregan los eventos hasta el horizonte: el mayor `seq` registrado hace
+más de CAMBIOS_MARGEN_SEGUNDOS. Una transacción que tarde más que el margen
+entre escribir su evento y confirmarse todavía puede perderse.
+
+Cada entidad se consulta por separado con el índice (entidad, seq), que ya
+devuelve las filas en orden, y los resultados se mezclan por `seq`.
+"""
+import heapq
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+from .models import Cambio
+
+MARGEN_SEGUNDOS = float(os.getenv("CAMBIOS_MARGEN_SEGUNDOS", "2"))
+
+COLUMNAS_EVENTO = (Cambio.seq, Cambio.entidad, Cambio.entidad_id, Cambio.operacion, Cambio.datos, Cambio.creado_en)
+
+def _escrituras_serializadas(db: Session) -> bool:
+    """Si el motor confirma los `seq` en orden (SQLite admite un solo escritor a la vez)"""
+    return db.get_bind().dialect.name == "sqlite"
+
+def horizonte(db: Session) -> int:
+    """Mayor `seq` que ya no puede quedar atrás de uno confirmado después (ver el docstring del módulo)"""
+    if _escrituras_serializadas(db) or MARGEN_SEGUNDOS <= 0:
+        return db.execute(select(func.max(Cambio.seq))).scalar() or 0
+    limite = datetime.now(timezone.utc) - timedelta(seconds=MARGEN_SEGUNDOS)
+    # Se recorre la clave primaria desde el final: sólo se saltan los eventos dentro del margen
+    return db.execute(
+        select(Cambio.seq).where(Cambio.creado_en <= limite).order_by(Cambio.seq.desc()).limit(1)
+    ).scalar() or 0
+
+def _eventos(db: Session, entidades: Iterable[str], desde: int, hasta: int, limite: int) -> list:
+    """Filas de los eventos con desde < seq <= hasta, en orden: una consulta por entidad y mezcla por seq"""
+    if hasta <= desde:
+        return []
+    consultas = (
+        db.execute(
+            select(*COLUMNAS_EVENTO)
+            .where(Cambio.entidad == entidad, Cambio.seq > desde, Cambio.seq <= hasta)
+            .order_by(Cambio.seq)
+            .limit(limite)
+        ).all()
+        for entidad in dict.fromkeys(entidades)
+    )
+    return list(heapq.merge(*consultas, key=lambda fila: fila.seq))[:limite]
+
+def registrar_cambio(db: Session, entidad: str, entidad_id: int, operacion: str, datos: Optional[dict] = None):
+    """Agregar un evento al registro de cambios en la transacción actual"""
+    db.add(Cambio(
+        entidad=entidad,
+        entidad_id=entidad_id,
+        operacion=operacion,
+        datos=json.dumps(datos, ensure_ascii=False) if datos is not None else None
+    ))
+
+def registrar_cambios(db: Session, entidad: str, entidad_ids: Iterable[int], operacion: str):
+    """Agregar en una sola sentencia un evento sin datos por cada id (borrados masivos)"""
+    filas = [
+        {"entidad": entidad, "entidad_id": entidad_id, "operacion": operacion, "datos": None}
+        for entidad_id in entidad_ids
+    ]
+    if filas:
+        db.execute(insert(Cambio), filas)
+
+def listar_cambios(db: Session, entidades: Iterable[str], desde: int = 0, limite: int = 100) -> List[dict]:
+    """Obtener en orden los eventos posteriores a `desde` y anteriores al horizonte"""
+    filas = _eventos(db, entidades, desde, horizonte(db), limite)
+    return [
+        {
+            "seq": fila.seq,
+            "entidad": fila.entidad,
+            "entidad_id": fila.entidad_id,
+            "operacion": fila.operacion,
+            "datos": json.loads(fila.datos) if fila.datos is not None else None,
+            "creado_en": fila.creado_en.isoformat(),
+        }
+        for fila in filas
+    ]
+
+def seq_actual(db: Session) -> int:
+    """Último `seq` entregable del registro (de cualquier entidad), para empezar a seguirlo desde ahora"""
+    return horizonte(db)
+
+class SeguidorCambios:
+    """
+    Posición de un consumidor en el registro de cambios.
+
+    Los índices en memoria de cada proceso la usan para aplicar solo los
+    eventos nuevos. Además del último `seq` guarda la fecha de ese evento,
+    así detecta si el registro se recreó y hay que reconstruir desde cero.
+    """
+
+    def __init__(self, entidades: Iterable[str]):
+        self.entidades = tuple(entidades)
+        self.ultimo_seq = 0
+        self._marca = None
+
+    def posicionar(self, db: Session):
+        """
+        Situarse en el horizonte del registro (llamar antes de cargar el estado
+        completo): los eventos posteriores se vuelven a aplicar, lo que es inocuo.
+        """
+        seq = horizonte(db)
+        marca = db.execute(select(Cambio.creado_en).where(Cambio.seq == seq)).scalar() if seq else None
+        self.ultimo_seq, self._marca = seq, marca
+
+    def restaurar(self, db: Session, seq: int) -> bool:
+        """Situarse en un `seq` guardado; devuelve False si ese evento ya no existe"""
+        if seq == 0:
+            self.ultimo_seq, self._marca = 0, None
+            return True
+        marca = db.execute(select(Cambio.creado_en).where(Cambio.seq == seq)).scalar()
+        if marca is None:
+            return False
+        self.ultimo_seq, self._marca = seq, marca
+        return True
+
+    def nuevos(self, db: Session, lote: int = 1000) -> Optional[List[tuple]]:
+        """
+        Obtener (seq, entidad, entidad_id, operacion, datos) de los eventos nuevos
+        y avanzar la posición. Devuelve None si la posición ya no es válida.
+        """
+        if self.ultimo_seq:
+            marca = db.execute(
+                select(Cambio.creado_en).where(Cambio.seq == self.ultimo_seq)
+            ).scalar()
+            if marca != self._marca:
+                return None
+
+        eventos = []
+        hasta = horizonte(db)
+        while True:
+            filas = _eventos(db, self.entidades, self.ultimo_seq, hasta, lote)
+            for fila in filas:
+                datos = json.loads(fila.datos) if fila.datos is not None else None
+                eventos.append((fila.seq, fila.entidad, fila.entidad_id, fila.operacion, datos))
+            if filas:
+                self.ultimo_seq, self._marca = filas[-1].seq, filas[-1].creado_en
+            if len(filas) < lote:
+                return eventos
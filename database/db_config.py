@@ -1,26 +1,59 @@
 """
 Configuración de base de datos compartida para todos los microservicios
 """
+import logging
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, inspect, select, text, Table, Column, Integer
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.schema import AddConstraint, CreateTable, MetaData
+
+logger = logging.getLogger(__name__)
 
 # Obtener la ruta de la base de datos desde variable de entorno o usar valor por defecto
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./recetario.db")
 
+# Versión del esquema. Incrementarla cada vez que cambien los modelos para que
+# init_db vuelva a crear las tablas en el siguiente arranque.
+ESQUEMA_VERSION = 7
+
 # Crear engine de SQLAlchemy
 engine = create_engine(
-    DATABASE_URL, 
+    DATABASE_URL,
     connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
 )
 
+@event.listens_for(Engine, "connect")
+def _activar_claves_foraneas(conexion_dbapi, registro):
+    """SQLite no aplica ON DELETE CASCADE/RESTRICT si no se activa en cada conexión"""
+    if type(conexion_dbapi).__module__.startswith("sqlite3"):
+        cursor = conexion_dbapi.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+def _descartar_conexiones_heredadas():
+    """Tras un fork, el proceso hijo no debe reutilizar conexiones del padre"""
+    engine.dispose(close=False)
+
+# Necesario cuando gunicorn precarga la app y luego hace fork de los workers
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_descartar_conexiones_heredadas)
+
 # Crear sesión local
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Base para modelos
 Base = declarative_base()
 
+# Marcador con la versión de esquema aplicada a la base de datos
+esquema_version = Table(
+    "esquema_version",
+    Base.metadata,
+    Column("version", Integer, primary_key=True),
+)
+
 def get_db():
     """Dependencia para obtener la sesión de base de datos"""
     db = SessionLocal()
@@ -29,6 +62,167 @@ def get_db():
     finally:
         db.close()
 
-def init_db():
-    """Inicializar la base de datos creando todas las tablas"""
-    Base.metadata.create_all(bind=engine)
+def version_esquema(bind=None):
+    """Obtener la versión de esquema registrada, o None si no hay marcador"""
+    try:
+        with (bind or engine).connect() as conn:
+            return conn.execute(select(esquema_version.c.version)).scalar()
+    except SQLAlchemyError:
+        return None
+
+def base_datos_lista(bind=None):
+    """Verificar que la base de datos responde y tiene el esquema actual"""
+    try:
+        with (bind or engine).connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except SQLAlchemyError:
+        return False
+    return version_esquema(bind) == ESQUEMA_VERSION
+
+def _filas_huerfanas(tabla, restriccion):
+    """Condición de las filas de `tabla` que apuntan a una fila inexistente"""
+    columna = restriccion.elements[0]
+    referida = columna.column
+    return columna.parent.is_not(None) & ~select(referida).where(referida == columna.parent).exists()
+
+def _migrar_claves_foraneas(bind):
+    """
+    Ajustar las claves foráneas de tablas ya existentes a las de los modelos
+    (ON DELETE CASCADE/RESTRICT). Primero se borran las filas huérfanas que
+    dejaban los borrados anteriores, que impedirían aplicar las restricciones.
+    SQLite no permite alterar una clave foránea: la tabla se reconstruye.
+    Devuelve las filas huérfanas borradas de cada tabla.
+    """
+    inspector = inspect(bind)
+    existentes = set(inspector.get_table_names())
+    pendientes = []
+    for tabla in Base.metadata.sorted_tables:
+        if tabla.name not in existentes or not tabla.foreign_key_constraints:
+            continue
+        reflejadas = {
+            (tuple(fk["constrained_columns"]), fk["referred_table"]): (fk.get("options") or {}).get("ondelete")
+            for fk in inspector.get_foreign_keys(tabla.name)
+        }
+        for restriccion in tabla.foreign_key_constraints:
+            clave = (tuple(restriccion.column_keys), restriccion.referred_table.name)
+            if (reflejadas.get(clave) or "").upper() != (restriccion.ondelete or "").upper():
+                pendientes.append((tabla, restriccion))
+    if not pendientes:
+        return {}
+
+    borradas = {}
+    with bind.begin() as conn:
+        for tabla, restriccion in pendientes:
+            filas = conn.execute(tabla.delete().where(_filas_huerfanas(tabla, restriccion))).rowcount
+            borradas[tabla.name] = borradas.get(tabla.name, 0) + filas
+    borradas = {tabla: filas for tabla, filas in borradas.items() if filas}
+    for tabla, filas in borradas.items():
+        logger.warning("Migración de claves foráneas: %d filas huérfanas borradas de %s", filas, tabla)
+
+    if bind.dialect.name != "sqlite":
+        with bind.begin() as conn:
+            for tabla, restriccion in pendientes:
+                nombre = next(
+                    (fk["name"] for fk in inspect(conn).get_foreign_keys(tabla.name)
+                     if fk["constrained_columns"] == list(restriccion.column_keys)),
+                    None
+                )
+                if nombre:
+                    conn.execute(text(f'ALTER TABLE {tabla.name} DROP CONSTRAINT "{nombre}"'))
+                conn.execute(AddConstraint(restriccion))
+        return borradas
+
+    # El PRAGMA no tiene efecto dentro de una transacción: se cambia antes de abrirla
+    with bind.connect() as conn:
+        conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        conn.commit()
+        try:
+            with conn.begin():
+                # Copia de los modelos para que las claves foráneas de la tabla nueva resuelvan
+                destino = MetaData()
+                for original in Base.metadata.sorted_tables:
+                    original.to_metadata(destino)
+                for tabla in dict.fromkeys(tabla for tabla, _ in pendientes):
+                    # Los índices se vuelven a crear después, con la tabla ya renombrada
+                    nueva = tabla.to_metadata(destino, name=f"_nueva_{tabla.name}")
+                    conn.execute(CreateTable(nueva))
+                    columnas = ", ".join(columna.name for columna in tabla.columns)
+                    conn.exec_driver_sql(
+                        f"INSERT INTO {nueva.name} ({columnas}) SELECT {columnas} FROM {tabla.name}"
+                    )
+                    conn.exec_driver_sql(f"DROP TABLE {tabla.name}")
+                    conn.exec_driver_sql(f"ALTER TABLE {nueva.name} RENAME TO {tabla.name}")
+        finally:
+            conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+            conn.commit()
+    return borradas
+
+@contextmanager
+def _bloqueo_migracion(bind):
+    """
+    Bloqueo exclusivo entre procesos para migrar el esquema: todos los
+    workers y los dos servicios llaman a init_db al arrancar. En SQLite es un
+    flock sobre `<base>.lock` y en PostgreSQL un advisory lock; con otros
+    motores (o sin fcntl) la migración debe correr una vez antes de los workers.
+    """
+    if bind.dialect.name == "postgresql":
+        with bind.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:clave)"), {"clave": 0x7265636574})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:clave)"), {"clave": 0x7265636574})
+        return
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+    ruta = bind.url.database if bind.dialect.name == "sqlite" else None
+    if fcntl is None or not ruta or ruta == ":memory:" or ruta.startswith("file:"):
+        yield
+        return
+    with open(f"{ruta}.lock", "a") as archivo:
+        fcntl.flock(archivo, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(archivo, fcntl.LOCK_UN)
+
+def init_db(bind=None):
+    """
+    Inicializar la base de datos creando todas las tablas.
+
+    Si el marcador de versión ya coincide con ESQUEMA_VERSION no se toca el
+    esquema, así cada worker que arranca evita la reflexión de create_all.
+    Si hay que migrar, un solo proceso lo hace y los demás esperan.
+    Devuelve True si se creó o actualizó el esquema.
+    """
+    bind = bind or engine
+    if version_esquema(bind) == ESQUEMA_VERSION:
+        return False
+    with _bloqueo_migracion(bind):
+        # Otro proceso pudo migrar mientras se esperaba el bloqueo
+        if version_esquema(bind) == ESQUEMA_VERSION:
+            return False
+        _migrar_esquema(bind)
+    return True
+
+def _migrar_esquema(bind):
+    """Crear y migrar las tablas, completar los datos derivados y registrar la versión (con el bloqueo tomado)"""
+    Base.metadata.create_all(bind=bind)
+    _migrar_claves_foraneas(bind)
+    # create_all no agrega índices nuevos a tablas que ya existían
+    for tabla in Base.metadata.sorted_tables:
+        for indice in tabla.indexes:
+            indice.create(bind=bind, checkfirst=True)
+
+    # Importación diferida: resumen depende de los modelos, que dependen de este módulo
+    from .resumen import completar_resumenes
+    from .estadisticas import reconstruir_estadisticas
+    completar_resumenes(bind)
+    with Session(bind) as db:
+        reconstruir_estadisticas(db)
+        db.commit()
+    with bind.begin() as conn:
+        conn.execute(esquema_version.delete())
+        conn.execute(esquema_version.insert().values(version=ESQUEMA_VERSION))
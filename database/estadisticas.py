@@ -0,0 +1,152 @@
+"""
+Estadísticas de uso mantenidas de forma incremental
+
+Contar las recetas de cada ingrediente o los ingredientes de cada categoría
+exige agregar receta_ingrediente e ingredientes completas. En su lugar, cada
+escritura que crea o borra recetas o ingredientes ajusta unos contadores
+dentro de su misma transacción:
+
+- estadistica_ingrediente: recetas distintas que usan cada ingrediente, con
+  un índice por uso para leer los más usados sin ordenar la tabla.
+- estadistica_categoria: ingredientes de cada categoría.
+- contadores: total de recetas y de ingredientes.
+
+El ajuste cuesta lo que tocan las filas escritas y la lectura no depende del
+tamaño de los datos. Si los contadores se desvían (datos cargados por fuera
+de los servicios) se reconstruyen desde cero con:
+
+    python -m database.estadisticas
+"""
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, delete, distinct, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from .models import Receta, Ingrediente, RecetaIngrediente, EstadisticaIngrediente, EstadisticaCategoria, Contador
+
+def _sumar(db: Session, modelo, clave, valor, deltas: Dict):
+    """Sumar cada delta a la fila de su clave, creándola si todavía no existe"""
+    deltas = {k: d for k, d in deltas.items() if d}
+    if not deltas:
+        return
+    existentes = set(db.execute(select(clave).where(clave.in_(list(deltas)))).scalars())
+    tabla = modelo.__table__
+    if existentes:
+        db.execute(
+            update(tabla)
+            .where(tabla.c[clave.key] == bindparam("_clave"))
+            .values({valor.key: tabla.c[valor.key] + bindparam("_delta")}),
+            [{"_clave": k, "_delta": deltas[k]} for k in existentes]
+        )
+    nuevas = [{clave.key: k, valor.key: d} for k, d in deltas.items() if k not in existentes]
+    if nuevas:
+        db.execute(insert(tabla), nuevas)
+
+def contar_recetas(db: Session, receta_ids: Iterable[int], signo: int):
+    """
+    Sumar (signo=1, después de insertarlas) o restar (signo=-1, antes de
+    borrarlas) las recetas indicadas y sus usos de cada ingrediente.
+    """
+    receta_ids = list(set(receta_ids))
+    if not receta_ids:
+        return
+    usos = db.execute(
+        select(RecetaIngrediente.ingrediente_id, func.count(distinct(RecetaIngrediente.receta_id)))
+        .where(RecetaIngrediente.receta_id.in_(receta_ids))
+        .group_by(RecetaIngrediente.ingrediente_id)
+    ).all()
+    existentes = db.execute(select(func.count(Receta.id)).where(Receta.id.in_(receta_ids))).scalar_one()
+    _sumar(db, EstadisticaIngrediente, EstadisticaIngrediente.ingrediente_id, EstadisticaIngrediente.num_recetas,
+           {ingrediente_id: signo * recetas for ingrediente_id, recetas in usos})
+    _sumar(db, Contador, Contador.nombre, Contador.valor, {"recetas": signo * existentes})
+
+def contar_ingredientes(db: Session, ingrediente_ids: Iterable[int], signo: int):
+    """Sumar o restar los ingredientes indicados del total y de sus categorías"""
+    ingrediente_ids = list(set(ingrediente_ids))
+    if not ingrediente_ids:
+        return
+    por_categoria = Counter(dict(db.execute(
+        select(Ingrediente.categoria, func.count(Ingrediente.id))
+        .where(Ingrediente.id.in_(ingrediente_ids))
+        .group_by(Ingrediente.categoria)
+    ).all()))
+    total = sum(por_categoria.values())
+    por_categoria.pop(None, None)
+    _sumar(db, EstadisticaCategoria, EstadisticaCategoria.categoria, EstadisticaCategoria.num_ingredientes,
+           {categoria: signo * cantidad for categoria, cantidad in por_categoria.items()})
+    _sumar(db, Contador, Contador.nombre, Contador.valor, {"ingredientes": signo * total})
+
+def mover_categoria(db: Session, anterior: Optional[str], nueva: Optional[str]):
+    """Pasar un ingrediente de una categoría a otra"""
+    deltas = Counter()
+    if anterior is not None:
+        deltas[anterior] -= 1
+    if nueva is not None:
+        deltas[nueva] += 1
+    _sumar(db, EstadisticaCategoria, EstadisticaCategoria.categoria, EstadisticaCategoria.num_ingredientes, deltas)
+
+def total(db: Session, nombre: str) -> int:
+    return db.execute(select(Contador.valor).where(Contador.nombre == nombre)).scalar() or 0
+
+def ingredientes_mas_usados(db: Session, limite: int = 10) -> List[dict]:
+    """Los `limite` ingredientes con más recetas, leídos en orden del índice de uso"""
+    filas = db.execute(
+        select(EstadisticaIngrediente.ingrediente_id, Ingrediente.nombre, EstadisticaIngrediente.num_recetas)
+        .join(Ingrediente, Ingrediente.id == EstadisticaIngrediente.ingrediente_id)
+        .where(EstadisticaIngrediente.num_recetas > 0)
+        .order_by(EstadisticaIngrediente.num_recetas.desc(), EstadisticaIngrediente.ingrediente_id.desc())
+        .limit(limite)
+    ).all()
+    return [fila._asdict() for fila in filas]
+
+def recetas_por_ingrediente(db: Session, ingrediente_ids: Iterable[int]) -> Dict[int, int]:
+    """Recetas que usan cada ingrediente (0 para los que no usa ninguna)"""
+    ingrediente_ids = list(set(ingrediente_ids))
+    usos = dict(db.execute(
+        select(EstadisticaIngrediente.ingrediente_id, EstadisticaIngrediente.num_recetas)
+        .where(EstadisticaIngrediente.ingrediente_id.in_(ingrediente_ids))
+    ).all()) if ingrediente_ids else {}
+    return {ingrediente_id: usos.get(ingrediente_id, 0) for ingrediente_id in sorted(ingrediente_ids)}
+
+def ingredientes_por_categoria(db: Session) -> Dict[str, int]:
+    return dict(db.execute(
+        select(EstadisticaCategoria.categoria, EstadisticaCategoria.num_ingredientes)
+        .where(EstadisticaCategoria.num_ingredientes > 0)
+        .order_by(EstadisticaCategoria.categoria)
+    ).all())
+
+def reconstruir_estadisticas(db: Session):
+    """Recalcular todos los contadores desde cero (migración y reparación)"""
+    for modelo in (EstadisticaIngrediente, EstadisticaCategoria, Contador):
+        db.execute(delete(modelo))
+    usos = db.execute(
+        select(RecetaIngrediente.ingrediente_id, func.count(distinct(RecetaIngrediente.receta_id)))
+        .group_by(RecetaIngrediente.ingrediente_id)
+    ).all()
+    if usos:
+        db.execute(insert(EstadisticaIngrediente), [
+            {"ingrediente_id": ingrediente_id, "num_recetas": recetas} for ingrediente_id, recetas in usos
+        ])
+    categorias = db.execute(
+        select(Ingrediente.categoria, func.count(Ingrediente.id))
+        .where(Ingrediente.categoria.is_not(None))
+        .group_by(Ingrediente.categoria)
+    ).all()
+    if categorias:
+        db.execute(insert(EstadisticaCategoria), [
+            {"categoria": categoria, "num_ingredientes": cantidad} for categoria, cantidad in categorias
+        ])
+    db.execute(insert(Contador), [
+        {"nombre": "recetas", "valor": db.execute(select(func.count(Receta.id))).scalar_one()},
+        {"nombre": "ingredientes", "valor": db.execute(select(func.count(Ingrediente.id))).scalar_one()},
+    ])
+
+if __name__ == "__main__":
+    from .db_config import SessionLocal, init_db
+    # init_db ya reconstruye si el esquema estaba desactualizado; se repite igual por si se desviaron
+    init_db()
+    with SessionLocal() as db:
+        reconstruir_estadisticas(db)
+        db.commit()
+        print(f"Estadísticas reconstruidas: {total(db, 'recetas')} recetas, {total(db, 'ingredientes')} ingredientes")
@@ -0,0 +1,117 @@
+"""
+Escritura por lotes (group commit)
+
+En SQLite cada commit implica un fsync y el bloqueo global de escritura, lo
+que limita las escrituras por segundo. Con ESCRITURA_POR_LOTES=1 las
+operaciones de escritura de los handlers se encolan y un hilo escritor las
+ejecuta en una sola sesión, confirmándolas juntas en lotes acotados por
+tamaño (LOTE_MAX_OPERACIONES) y por latencia (LOTE_ESPERA_MS).
+
+Cada operación es una función que recibe la sesión, hace sus cambios y
+devuelve datos ya serializables (no objetos del ORM). Si una operación falla
+el lote se deshace, esa petición recibe su error y el resto se vuelve a
+ejecutar, de modo que cada petición obtiene su propio resultado.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from .db_config import SessionLocal
+
+class EscritorPorLotes:
+    """Hilo que agrupa operaciones de escritura y las confirma en un único commit"""
+
+    def __init__(self, session_factory=SessionLocal, max_operaciones: int = 64, espera_maxima: float = 0.002):
+        self.session_factory = session_factory
+        self.max_operaciones = max_operaciones
+        self.espera_maxima = espera_maxima
+        self.lotes_confirmados = 0
+        self._cola = queue.Queue()
+        self._hilo = threading.Thread(target=self._bucle, name="escritor-por-lotes", daemon=True)
+        self._hilo.start()
+
+    def ejecutar(self, operacion):
+        """Encolar la operación y esperar su resultado (o su excepción)"""
+        futuro = Future()
+        self._cola.put((operacion, futuro))
+        return futuro.result()
+
+    def _bucle(self):
+        while True:
+            lote = [self._cola.get()]
+            limite = time.monotonic() + self.espera_maxima
+            while len(lote) < self.max_operaciones:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(self._cola.get(timeout=restante))
+                except queue.Empty:
+                    break
+            self._procesar([(op, futuro) for op, futuro in lote if futuro.set_running_or_notify_cancel()])
+
+    def _procesar(self, pendientes):
+        while pendientes:
+            with self.session_factory() as db:
+                resultados = []
+                fallo = None
+                for indice, (operacion, _) in enumerate(pendientes):
+                    try:
+                        resultados.append(operacion(db))
+                    except Exception as error:
+                        fallo = (indice, error)
+                        break
+
+                if fallo is None:
+                    try:
+                        db.commit()
+                    except Exception as error:
+                        db.rollback()
+                        if len(pendientes) == 1:
+                            pendientes[0][1].set_exception(error)
+                        else:
+                            # No se sabe qué operación provocó el fallo: reintentar de a una
+                            for pendiente in pendientes:
+                                self._procesar([pendiente])
+                        return
+                    self.lotes_confirmados += 1
+                    for (_, futuro), resultado in zip(pendientes, resultados):
+                        futuro.set_result(resultado)
+                    return
+
+                db.rollback()
+                indice, error = fallo
+                pendientes[indice][1].set_exception(error)
+                pendientes = pendientes[:indice] + pendientes[indice + 1:]
+
+_escritor = None
+_escritor_lock = threading.Lock()
+
+def escritura_por_lotes_activa() -> bool:
+    return os.getenv("ESCRITURA_POR_LOTES", "0") == "1"
+
+def obtener_escritor() -> EscritorPorLotes:
+    """Escritor del proceso, creado al primer uso (después del fork de los workers)"""
+    global _escritor
+    with _escritor_lock:
+        if _escritor is None:
+            _escritor = EscritorPorLotes(
+                max_operaciones=int(os.getenv("LOTE_MAX_OPERACIONES", "64")),
+                espera_maxima=float(os.getenv("LOTE_ESPERA_MS", "2")) / 1000
+            )
+        return _escritor
+
+def ejecutar_escritura(db, operacion):
+    """
+    Ejecutar una operación de escritura y confirmarla.
+
+    Sin escritura por lotes la operación usa la sesión de la petición y se
+    confirma de inmediato; con ella se delega en el escritor del proceso.
+    """
+    if escritura_por_lotes_activa():
+        return obtener_escritor().ejecutar(operacion)
+    resultado = operacion(db)
+    db.commit()
+    return resultado
@@ -1,7 +1,8 @@
 """
 Modelos de base de datos compartidos
 """
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Float
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Float, DateTime, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from database.db_config import Base
 
@@ -11,18 +12,19 @@ class Receta(Base):
     id = Column(Integer, primary_key=True, index=True)
     nombre = Column(String(200), nullable=False)
     descripcion = Column(Text)
-    tiempo_preparacion = Column(Integer)  # en minutos
-    porciones = Column(Integer)
+    tiempo_preparacion = Column(Integer, index=True)  # en minutos
+    porciones = Column(Integer, index=True)
     
     # Relaciones
-    pasos = relationship("Paso", back_populates="receta", cascade="all, delete-orphan")
-    ingredientes = relationship("RecetaIngrediente", back_populates="receta", cascade="all, delete-orphan")
+    # Los hijos se borran en la base de datos (ON DELETE CASCADE), sin cargarlos
+    pasos = relationship("Paso", back_populates="receta", cascade="all, delete-orphan", passive_deletes=True)
+    ingredientes = relationship("RecetaIngrediente", back_populates="receta", cascade="all, delete-orphan", passive_deletes=True)
 
 class Paso(Base):
     __tablename__ = "pasos"
     
     id = Column(Integer, primary_key=True, index=True)
-    receta_id = Column(Integer, ForeignKey("recetas.id"), nullable=False)
+    receta_id = Column(Integer, ForeignKey("recetas.id", ondelete="CASCADE"), nullable=False, index=True)
     numero_paso = Column(Integer, nullable=False)
     descripcion = Column(Text, nullable=False)
     
@@ -38,17 +40,111 @@ class Ingrediente(Base):
     categoria = Column(String(100))  # lácteos, vegetales, carnes, etc.
     
     # Relación con recetas
-    recetas = relationship("RecetaIngrediente", back_populates="ingrediente")
+    # Un ingrediente en uso no se puede borrar (ON DELETE RESTRICT)
+    recetas = relationship("RecetaIngrediente", back_populates="ingrediente", passive_deletes="all")
 
 class RecetaIngrediente(Base):
     """Tabla intermedia para relacionar recetas con ingredientes"""
     __tablename__ = "receta_ingrediente"
     
     id = Column(Integer, primary_key=True, index=True)
-    receta_id = Column(Integer, ForeignKey("recetas.id"), nullable=False)
-    ingrediente_id = Column(Integer, ForeignKey("ingredientes.id"), nullable=False)
+    receta_id = Column(Integer, ForeignKey("recetas.id", ondelete="CASCADE"), nullable=False, index=True)
+    ingrediente_id = Column(Integer, ForeignKey("ingredientes.id", ondelete="RESTRICT"), nullable=False, index=True)
     cantidad = Column(Float, nullable=False)
     
     # Relaciones
     receta = relationship("Receta", back_populates="ingredientes")
     ingrediente = relationship("Ingrediente", back_populates="recetas")
+
+class Cambio(Base):
+    """Registro de cambios (outbox) escrito en la misma transacción que cada escritura"""
+    __tablename__ = "cambios"
+    __table_args__ = (
+        Index("ix_cambios_entidad_seq", "entidad", "seq"),
+        {"sqlite_autoincrement": True},
+    )
+    
+    seq = Column(Integer, primary_key=True)
+    entidad = Column(String(50), nullable=False)  # receta, paso, ingrediente
+    entidad_id = Column(Integer, nullable=False)
+    operacion = Column(String(20), nullable=False)  # crear, actualizar, eliminar
+    datos = Column(Text)  # estado nuevo en JSON (vacío al eliminar)
+    creado_en = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+class RecetaFirma(Base):
+    """Firma MinHash persistida de cada receta (detección de casi duplicados)"""
+    __tablename__ = "receta_minhash"
+    
+    receta_id = Column(Integer, ForeignKey("recetas.id", ondelete="CASCADE"), primary_key=True)
+    firma = Column(LargeBinary, nullable=False)
+
+class IndiceEstado(Base):
+    """Último evento del registro de cambios aplicado a cada índice persistido"""
+    __tablename__ = "indices_estado"
+    
+    nombre = Column(String(50), primary_key=True)
+    ultimo_seq = Column(Integer, nullable=False, default=0)
+
+class RecetaResumen(Base):
+    """Datos derivados de cada receta para filtrar sin unir pasos ni ingredientes"""
+    __tablename__ = "receta_resumen"
+    
+    receta_id = Column(Integer, ForeignKey("recetas.id", ondelete="CASCADE"), primary_key=True)
+    num_pasos = Column(Integer, nullable=False, default=0, index=True)
+    num_ingredientes = Column(Integer, nullable=False, default=0)
+    mascara_categorias = Column(Integer, nullable=False, default=0)  # un bit por categoría de ingrediente
+
+class CategoriaBit(Base):
+    """Bit asignado a cada categoría de ingrediente en RecetaResumen.mascara_categorias"""
+    __tablename__ = "categoria_bit"
+    
+    categoria = Column(String(100), primary_key=True)
+    bit = Column(Integer, nullable=False, unique=True)
+
+class EstadisticaIngrediente(Base):
+    """Recetas que usan cada ingrediente, mantenido en cada escritura (ver database/estadisticas.py)"""
+    __tablename__ = "estadistica_ingrediente"
+    __table_args__ = (
+        # Ingredientes más usados: recorrido del índice en orden descendente
+        Index("ix_estadistica_ingrediente_uso", "num_recetas", "ingrediente_id"),
+    )
+    
+    ingrediente_id = Column(Integer, ForeignKey("ingredientes.id", ondelete="CASCADE"), primary_key=True)
+    num_recetas = Column(Integer, nullable=False, default=0)
+
+class EstadisticaCategoria(Base):
+    """Ingredientes de cada categoría"""
+    __tablename__ = "estadistica_categoria"
+    
+    categoria = Column(String(100), primary_key=True)
+    num_ingredientes = Column(Integer, nullable=False, default=0)
+
+class Contador(Base):
+    """Totales mantenidos en cada escritura ("recetas", "ingredientes")"""
+    __tablename__ = "contadores"
+    
+    nombre = Column(String(50), primary_key=True)
+    valor = Column(Integer, nullable=False, default=0)
+
+class Trabajo(Base):
+    """Trabajo en segundo plano (importación, exportación, reconstrucción de índices)"""
+    __tablename__ = "trabajos"
+    __table_args__ = (
+        Index("ix_trabajos_estado_id", "estado", "id"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    tipo = Column(String(50), nullable=False)
+    estado = Column(String(20), nullable=False, default="pendiente")  # pendiente, en_curso, completado, fallido
+    parametros = Column(Text)  # JSON
+    progreso = Column(Float, nullable=False, default=0.0)  # 0 a 1
+    mensaje = Column(Text)
+    resultado = Column(Text)  # resumen en JSON al terminar
+    archivo = Column(String(500))  # archivo descargable con el resultado
+    error = Column(Text)
+    intentos = Column(Integer, nullable=False, default=0)
+    reclamado_por = Column(String(100))  # trabajador que lo ejecuta
+    latido_en = Column(DateTime)  # último avance informado por ese trabajador
+    creado_en = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    iniciado_en = Column(DateTime)
+    terminado_en = Column(DateTime)
@@ -0,0 +1,191 @@
+"""
+Separación de lecturas y escrituras
+
+Con DATABASE_READ_URL (una o varias URLs separadas por comas) los handlers
+de solo lectura usan get_db_lectura, que abre la sesión en una réplica
+elegida por turnos (REPLICAS_POLITICA=round_robin) o por menor número de
+sesiones abiertas (menos_cargada). Los handlers de escritura usan
+get_db_escritura, que va siempre a la primaria y marca al cliente: durante
+LECTURA_PROPIA_SEGUNDOS sus lecturas también van a la primaria, así ve sus
+propias escrituras aunque la réplica tenga retraso.
+
+El cliente se identifica por X-API-Key, X-Forwarded-For (que agrega el
+gateway) o la IP de la conexión. La marca se guarda en memoria del proceso
+que atendió la escritura y además viaja con el cliente en la cookie
+`lectura_propia` (hasta cuándo leer de la primaria), que agrega
+LecturaPropiaMiddleware: así la respeta cualquier worker o instancia que
+reciba la lectura siguiente.
+"""
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from fastapi import Depends, Request
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from .db_config import get_db
+
+POLITICAS = ("round_robin", "menos_cargada")
+
+# Cookie con el instante (epoch) hasta el que el cliente lee de la primaria
+COOKIE_LECTURA_PROPIA = "lectura_propia"
+
+class Replica:
+    """Engine de una réplica de lectura y sus sesiones abiertas"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False} if "sqlite" in url else {}
+        )
+        self.sesiones = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.en_curso = 0
+
+class EnrutadorLecturas:
+    """Elige la réplica de cada lectura y recuerda qué clientes escribieron hace poco"""
+
+    def __init__(self, urls: List[str] = (), politica: str = "round_robin", ventana: float = 5.0,
+                 max_clientes: int = 10000):
+        if politica not in POLITICAS:
+            raise ValueError(f"Política de réplicas no soportada: {politica}")
+        self.replicas = [Replica(url) for url in urls]
+        self.politica = politica
+        self.ventana = ventana
+        self.max_clientes = max_clientes
+        self._turno = itertools.count()
+        self._lock = threading.Lock()
+        # clave de cliente -> instante hasta el que lee de la primaria
+        self._escrituras = OrderedDict()
+
+    @property
+    def activo(self) -> bool:
+        return bool(self.replicas)
+
+    def elegir(self) -> Replica:
+        with self._lock:
+            if self.politica == "menos_cargada":
+                replica = min(self.replicas, key=lambda candidata: candidata.en_curso)
+            else:
+                replica = self.replicas[next(self._turno) % len(self.replicas)]
+            replica.en_curso += 1
+            return replica
+
+    def liberar(self, replica: Replica):
+        with self._lock:
+            replica.en_curso -= 1
+
+    def marcar_escritura(self, clave: str, ahora: float = None):
+        ahora = time.monotonic() if ahora is None else ahora
+        with self._lock:
+            self._escrituras[clave] = ahora + self.ventana
+            self._escrituras.move_to_end(clave)
+            while len(self._escrituras) > self.max_clientes:
+                self._escrituras.popitem(last=False)
+
+    def requiere_primaria(self, clave: str, ahora: float = None) -> bool:
+        ahora = time.monotonic() if ahora is None else ahora
+        with self._lock:
+            hasta = self._escrituras.get(clave)
+            if hasta is None:
+                return False
+            if hasta <= ahora:
+                del self._escrituras[clave]
+                return False
+            return True
+
+    def descartar_conexiones(self):
+        for replica in self.replicas:
+            replica.engine.dispose(close=False)
+
+def _urls_configuradas() -> List[str]:
+    return [url.strip() for url in os.getenv("DATABASE_READ_URL", "").split(",") if url.strip()]
+
+enrutador = EnrutadorLecturas(
+    _urls_configuradas(),
+    politica=os.getenv("REPLICAS_POLITICA", "round_robin"),
+    ventana=float(os.getenv("LECTURA_PROPIA_SEGUNDOS", "5"))
+)
+
+# Igual que el engine principal: tras un fork no reutilizar conexiones del padre
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: enrutador.descartar_conexiones())
+
+def configurar_replicas(urls: List[str], politica: Optional[str] = None, ventana: Optional[float] = None) -> EnrutadorLecturas:
+    """Reemplazar las réplicas configuradas (una lista vacía las desactiva)"""
+    global enrutador
+    enrutador = EnrutadorLecturas(
+        urls,
+        politica=politica or enrutador.politica,
+        ventana=enrutador.ventana if ventana is None else ventana
+    )
+    return enrutador
+
+def clave_cliente(request: Request) -> str:
+    api_key = request.headers.get("x-api-key")
+    if api_key:
+        return f"key:{api_key}"
+    reenviado = request.headers.get("x-forwarded-for")
+    if reenviado:
+        return f"ip:{reenviado.split(',')[0].strip()}"
+    return f"ip:{request.client.host if request.client else 'desconocido'}"
+
+def lectura_propia_vigente(request: Request, ventana: float, ahora: float = None) -> bool:
+    """Si la cookie del cliente pide leer de la primaria (acotada a la ventana, no se puede extender)"""
+    ahora = time.time() if ahora is None else ahora
+    try:
+        hasta = float(request.cookies.get(COOKIE_LECTURA_PROPIA, 0))
+    except ValueError:
+        return False
+    return ahora < hasta <= ahora + ventana
+
+def get_db_lectura(request: Request, db: Session = Depends(get_db)):
+    """Sesión para handlers de solo lectura: una réplica, salvo que el cliente haya escrito hace poco"""
+    actual = enrutador
+    if (not actual.activo or actual.requiere_primaria(clave_cliente(request))
+            or lectura_propia_vigente(request, actual.ventana)):
+        yield db
+        return
+    replica = actual.elegir()
+    sesion = replica.sesiones()
+    try:
+        yield sesion
+    finally:
+        sesion.close()
+        actual.liberar(replica)
+
+def get_db_escritura(request: Request, db: Session = Depends(get_db)):
+    """Sesión de la primaria para handlers que escriben; marca al cliente para leer sus escrituras"""
+    try:
+        yield db
+    finally:
+        if enrutador.activo:
+            enrutador.marcar_escritura(clave_cliente(request))
+            request.state.lectura_propia = (time.time() + enrutador.ventana, enrutador.ventana)
+
+class LecturaPropiaMiddleware:
+    """Agregar la cookie de lectura propia a las respuestas de las peticiones que escribieron"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def enviar(mensaje):
+            # get_db_escritura deja la marca en el estado de la petición antes de enviar la respuesta
+            marca = scope.get("state", {}).get("lectura_propia")
+            if mensaje["type"] == "http.response.start" and marca is not None:
+                hasta, ventana = marca
+                cookie = (f"{COOKIE_LECTURA_PROPIA}={hasta:.3f}; Max-Age={max(1, int(ventana))}; "
+                          "Path=/; HttpOnly; SameSite=Lax")
+                mensaje["headers"] = list(mensaje.get("headers", [])) + [(b"set-cookie", cookie.encode())]
+            await send(mensaje)
+
+        await self.app(scope, receive, enviar)
@@ -0,0 +1,115 @@
+"""
+Resumen precalculado por receta
+
+receta_resumen guarda por receta el número de pasos, el número de
+ingredientes distintos y una máscara de bits con las categorías de sus
+ingredientes (cada categoría recibe un bit en categoria_bit). Se mantiene
+dentro de las mismas operaciones de escritura que modifican recetas, pasos o
+ingredientes, de modo que los filtros y facetas de recetas se resuelven con
+un único join 1:1 sin recorrer pasos ni receta_ingrediente.
+"""
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, distinct, func, select, update
+from sqlalchemy.orm import Session
+
+from .models import Receta, Paso, Ingrediente, RecetaIngrediente, RecetaResumen, CategoriaBit
+
+# Bits utilizables en un entero con signo de 64 bits
+MAX_BITS_CATEGORIA = 63
+
+# Recetas recalculadas por sentencia al completar resúmenes faltantes
+TAMANO_LOTE_RESUMEN = 500
+
+def bits_categorias(db: Session, categorias: Iterable[str], asignar: bool = True) -> Dict[str, int]:
+    """
+    Bit de cada categoría. Con `asignar` las categorías nuevas reciben el
+    siguiente bit libre; las que ya no caben en la máscara no aparecen.
+    """
+    categorias = {categoria for categoria in categorias if categoria}
+    if not categorias:
+        return {}
+    bits = dict(db.execute(
+        select(CategoriaBit.categoria, CategoriaBit.bit).where(CategoriaBit.categoria.in_(categorias))
+    ).all())
+    nuevas = sorted(categorias - set(bits))
+    if asignar and nuevas:
+        siguiente = db.execute(select(func.coalesce(func.max(CategoriaBit.bit) + 1, 0))).scalar()
+        for categoria in nuevas:
+            if siguiente >= MAX_BITS_CATEGORIA:
+                break
+            db.add(CategoriaBit(categoria=categoria, bit=siguiente))
+            bits[categoria] = siguiente
+            siguiente += 1
+        db.flush()
+    return bits
+
+def categorias_por_bit(db: Session) -> Dict[int, str]:
+    return {bit: categoria for categoria, bit in db.execute(select(CategoriaBit.categoria, CategoriaBit.bit))}
+
+def recalcular_resumenes(db: Session, receta_ids: Iterable[int]):
+    """Recalcular desde cero el resumen de las recetas indicadas (las inexistentes se descartan)"""
+    receta_ids = list(set(receta_ids))
+    if not receta_ids:
+        return
+    existentes = db.execute(select(Receta.id).where(Receta.id.in_(receta_ids))).scalars().all()
+    pasos = dict(db.execute(
+        select(Paso.receta_id, func.count()).where(Paso.receta_id.in_(existentes)).group_by(Paso.receta_id)
+    ).all())
+    ingredientes = dict(db.execute(
+        select(RecetaIngrediente.receta_id, func.count(distinct(RecetaIngrediente.ingrediente_id)))
+        .where(RecetaIngrediente.receta_id.in_(existentes))
+        .group_by(RecetaIngrediente.receta_id)
+    ).all())
+    categorias = db.execute(
+        select(distinct(RecetaIngrediente.receta_id), Ingrediente.categoria)
+        .join(Ingrediente, Ingrediente.id == RecetaIngrediente.ingrediente_id)
+        .where(RecetaIngrediente.receta_id.in_(existentes), Ingrediente.categoria.is_not(None))
+    ).all()
+    bits = bits_categorias(db, (categoria for _, categoria in categorias))
+    mascaras: Dict[int, int] = {}
+    for receta_id, categoria in categorias:
+        if categoria in bits:
+            mascaras[receta_id] = mascaras.get(receta_id, 0) | (1 << bits[categoria])
+
+    db.execute(delete(RecetaResumen).where(RecetaResumen.receta_id.in_(receta_ids)))
+    if existentes:
+        db.execute(RecetaResumen.__table__.insert(), [
+            {
+                "receta_id": receta_id,
+                "num_pasos": pasos.get(receta_id, 0),
+                "num_ingredientes": ingredientes.get(receta_id, 0),
+                "mascara_categorias": mascaras.get(receta_id, 0),
+            }
+            for receta_id in existentes
+        ])
+
+def ajustar_num_pasos(db: Session, receta_id: int, delta: int):
+    """Sumar `delta` al número de pasos de la receta sin recalcular el resto"""
+    db.execute(
+        update(RecetaResumen)
+        .where(RecetaResumen.receta_id == receta_id)
+        .values(num_pasos=RecetaResumen.num_pasos + delta)
+    )
+
+def recetas_con_ingrediente(db: Session, ingrediente_id: int) -> List[int]:
+    """Recetas cuyo resumen depende del ingrediente (para recalcularlas si cambia su categoría)"""
+    return db.execute(
+        select(distinct(RecetaIngrediente.receta_id)).where(RecetaIngrediente.ingrediente_id == ingrediente_id)
+    ).scalars().all()
+
+def completar_resumenes(bind, lote: Optional[int] = None):
+    """Crear el resumen de las recetas que todavía no lo tienen (migración de datos existentes)"""
+    lote = lote or TAMANO_LOTE_RESUMEN
+    with Session(bind) as db:
+        while True:
+            faltantes = db.execute(
+                select(Receta.id)
+                .outerjoin(RecetaResumen, RecetaResumen.receta_id == Receta.id)
+                .where(RecetaResumen.receta_id.is_(None))
+                .limit(lote)
+            ).scalars().all()
+            if not faltantes:
+                break
+            recalcular_resumenes(db, faltantes)
+            db.commit()
@@ -0,0 +1,246 @@
+"""
+Trabajos en segundo plano
+
+Las operaciones largas (importar un catálogo, exportar todo, reconstruir
+índices) no se ejecutan dentro de la petición: se guardan en la tabla
+`trabajos` como pendientes y la petición responde enseguida con el id.
+
+EjecutorTrabajos reclama los pendientes con un UPDATE condicionado al estado,
+así varios workers (o un proceso trabajador aparte) pueden compartir la cola
+sin ejecutar dos veces el mismo trabajo. Cada trabajo informa su avance, que
+además sirve de latido: si un trabajador muere, su trabajo queda sin latido y
+otro lo retoma pasados `latido_max` segundos, hasta `max_intentos` veces.
+
+La concurrencia por proceso está acotada por `max_concurrencia` (por defecto
+1) para que los trabajos no dejen sin CPU ni conexiones a las peticiones.
+Los tipos de trabajo se registran con el decorador `tipo`; cada función
+recibe la sesión y un ContextoTrabajo, y devuelve un resumen serializable.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from .db_config import SessionLocal
+from .models import Trabajo
+
+ESTADOS = ("pendiente", "en_curso", "completado", "fallido")
+
+# Intervalo mínimo entre dos escrituras de avance de un mismo trabajo
+INTERVALO_AVANCE = 0.5
+
+class TrabajoPerdido(Exception):
+    """El trabajo fue reclamado por otro trabajador (este dejó de latir a tiempo)"""
+
+def encolar(db: Session, tipo: str, parametros: Optional[dict] = None) -> int:
+    """Agregar un trabajo pendiente (se confirma con la transacción de `db`)"""
+    return db.execute(
+        insert(Trabajo).values(
+            tipo=tipo,
+            estado="pendiente",
+            parametros=json.dumps(parametros or {}, ensure_ascii=False)
+        ).returning(Trabajo.id)
+    ).scalar_one()
+
+def contar_pendientes(db: Session) -> int:
+    return db.execute(select(func.count(Trabajo.id)).where(Trabajo.estado == "pendiente")).scalar_one()
+
+def _fecha(valor: Optional[datetime]) -> Optional[str]:
+    return valor.isoformat() if valor is not None else None
+
+def trabajo_dict(trabajo: Trabajo) -> dict:
+    return {
+        "id": trabajo.id,
+        "tipo": trabajo.tipo,
+        "estado": trabajo.estado,
+        "progreso": trabajo.progreso,
+        "mensaje": trabajo.mensaje,
+        "resultado": json.loads(trabajo.resultado) if trabajo.resultado and trabajo.estado == "completado" else None,
+        "descargable": trabajo.estado == "completado" and trabajo.archivo is not None,
+        "error": trabajo.error,
+        "intentos": trabajo.intentos,
+        "creado_en": _fecha(trabajo.creado_en),
+        "iniciado_en": _fecha(trabajo.iniciado_en),
+        "terminado_en": _fecha(trabajo.terminado_en),
+    }
+
+class ContextoTrabajo:
+    """Lo que ve la función de un trabajo: parámetros, avance, archivo de salida y punto de control"""
+
+    def __init__(self, ejecutor: "EjecutorTrabajos", trabajo: Trabajo):
+        self.id = trabajo.id
+        self.tipo = trabajo.tipo
+        self.parametros = json.loads(trabajo.parametros or "{}")
+        # Al retomar un trabajo interrumpido, `resultado` guarda su último punto de control
+        self.punto_control = json.loads(trabajo.resultado) if trabajo.resultado else None
+        self.ruta_archivo = None
+        self._ejecutor = ejecutor
+        self._ultimo_avance = 0.0
+
+    def archivo(self, extension: str) -> str:
+        """Ruta del archivo descargable con el resultado del trabajo"""
+        os.makedirs(self._ejecutor.directorio, exist_ok=True)
+        self.ruta_archivo = os.path.join(self._ejecutor.directorio, f"trabajo-{self.id}.{extension}")
+        return self.ruta_archivo
+
+    def avance(self, progreso: float, mensaje: Optional[str] = None, forzar: bool = False):
+        """Informar el avance (0 a 1); se escribe como mucho cada INTERVALO_AVANCE segundos"""
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultimo_avance < INTERVALO_AVANCE:
+            return
+        self._ultimo_avance = ahora
+        with self._ejecutor.session_factory() as db:
+            self._actualizar(db, progreso=min(max(progreso, 0.0), 1.0), mensaje=mensaje)
+            db.commit()
+
+    def guardar_punto_control(self, db: Session, datos: dict):
+        """Guardar en la transacción de `db` hasta dónde llegó el trabajo, para retomarlo sin repetir"""
+        self.punto_control = datos
+        self._actualizar(db, resultado=json.dumps(datos, ensure_ascii=False))
+
+    def _actualizar(self, db: Session, **valores):
+        filas = db.execute(
+            update(Trabajo)
+            .where(Trabajo.id == self.id, Trabajo.estado == "en_curso",
+                   Trabajo.reclamado_por == self._ejecutor.nombre)
+            .values(latido_en=datetime.now(timezone.utc), **valores)
+        ).rowcount
+        if not filas:
+            raise TrabajoPerdido(f"El trabajo {self.id} ya no pertenece a {self._ejecutor.nombre}")
+
+class EjecutorTrabajos:
+    """Reclama trabajos pendientes de la tabla `trabajos` y los ejecuta en un pool acotado"""
+
+    def __init__(self, session_factory=SessionLocal, directorio: str = "trabajos", max_concurrencia: int = 1,
+                 intervalo: float = 1.0, latido_max: float = 300.0, max_intentos: int = 3):
+        self.session_factory = session_factory
+        self.directorio = directorio
+        self.max_concurrencia = max(1, max_concurrencia)
+        self.intervalo = intervalo
+        self.latido_max = latido_max
+        self.max_intentos = max_intentos
+        self.nombre = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.tipos: Dict[str, Callable] = {}
+        self._cupos = threading.Semaphore(self.max_concurrencia)
+        self._detener = threading.Event()
+        self._hilo = None
+        self._pool = None
+
+    def tipo(self, nombre: str):
+        """Decorador que registra la función que ejecuta los trabajos de tipo `nombre`"""
+        def registrar(funcion):
+            self.tipos[nombre] = funcion
+            return funcion
+        return registrar
+
+    def iniciar(self):
+        """Arrancar el hilo que reparte trabajos al pool (una sola vez por proceso)"""
+        if self._hilo is not None:
+            return
+        self._detener.clear()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrencia, thread_name_prefix="trabajo")
+        self._hilo = threading.Thread(target=self._bucle, name="ejecutor-trabajos", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._pool.shutdown(wait=True)
+            self._hilo = self._pool = None
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            if not self._cupos.acquire(timeout=self.intervalo):
+                continue
+            try:
+                trabajo_id = self._reclamar()
+            except Exception:
+                trabajo_id = None
+            if trabajo_id is None:
+                self._cupos.release()
+                self._detener.wait(self.intervalo)
+                continue
+            self._pool.submit(self._ejecutar_y_liberar, trabajo_id)
+
+    def _ejecutar_y_liberar(self, trabajo_id: int):
+        try:
+            self.ejecutar(trabajo_id)
+        finally:
+            self._cupos.release()
+
+    def _reclamar(self) -> Optional[int]:
+        """Tomar el pendiente más antiguo (o uno abandonado) con un UPDATE condicionado al estado"""
+        ahora = datetime.now(timezone.utc)
+        abandonado = and_(Trabajo.estado == "en_curso", Trabajo.latido_en < ahora - timedelta(seconds=self.latido_max))
+        with self.session_factory() as db:
+            # Los abandonados que ya agotaron sus intentos no se retoman más
+            db.execute(
+                update(Trabajo)
+                .where(abandonado, Trabajo.intentos >= self.max_intentos)
+                .values(estado="fallido", error="El trabajador dejó de responder", terminado_en=ahora)
+            )
+            db.commit()
+            disponible = or_(Trabajo.estado == "pendiente", abandonado)
+            while True:
+                trabajo_id = db.execute(
+                    select(Trabajo.id).where(disponible).order_by(Trabajo.id).limit(1)
+                ).scalar()
+                if trabajo_id is None:
+                    return None
+                filas = db.execute(
+                    update(Trabajo)
+                    .where(Trabajo.id == trabajo_id, disponible)
+                    .values(estado="en_curso", reclamado_por=self.nombre, latido_en=ahora,
+                            iniciado_en=func.coalesce(Trabajo.iniciado_en, ahora),
+                            intentos=Trabajo.intentos + 1)
+                ).rowcount
+                db.commit()
+                if filas:
+                    return trabajo_id
+                # Otro trabajador lo reclamó entre el SELECT y el UPDATE: probar el siguiente
+
+    def procesar_pendiente(self) -> Optional[int]:
+        """Reclamar y ejecutar un trabajo en el hilo actual (proceso trabajador y pruebas)"""
+        trabajo_id = self._reclamar()
+        if trabajo_id is not None:
+            self.ejecutar(trabajo_id)
+        return trabajo_id
+
+    def ejecutar(self, trabajo_id: int):
+        """Ejecutar un trabajo ya reclamado por este ejecutor y guardar su resultado o su error"""
+        with self.session_factory() as db:
+            trabajo = db.get(Trabajo, trabajo_id)
+            contexto = ContextoTrabajo(self, trabajo)
+            funcion = self.tipos.get(trabajo.tipo)
+            db.commit()
+            try:
+                if funcion is None:
+                    raise ValueError(f"Tipo de trabajo desconocido: {trabajo.tipo}")
+                resumen = funcion(db, contexto)
+                db.commit()
+            except TrabajoPerdido:
+                db.rollback()
+                return
+            except Exception as error:
+                db.rollback()
+                self._terminar(db, contexto, estado="fallido", error=f"{type(error).__name__}: {error}")
+                return
+            self._terminar(db, contexto, estado="completado", progreso=1.0,
+                           resultado=json.dumps(resumen or {}, ensure_ascii=False), archivo=contexto.ruta_archivo)
+
+    def _terminar(self, db: Session, contexto: ContextoTrabajo, **valores):
+        db.execute(
+            update(Trabajo)
+            .where(Trabajo.id == contexto.id, Trabajo.reclamado_por == self.nombre)
+            .values(terminado_en=datetime.now(timezone.utc), **valores)
+        )
+        db.commit()
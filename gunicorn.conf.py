@@ -0,0 +1,40 @@
+"""
+Configuración de gunicorn para servir cualquiera de las apps con varios workers
+
+Uso:
+    gunicorn servicio_recetas.app:app -c gunicorn.conf.py --bind 0.0.0.0:8001
+
+Cada worker es un proceso independiente (shared-nothing): no comparte memoria
+con los demás, por lo que cualquier caché en proceso debe poder reconstruirse
+desde la base de datos. Para recargar el código sin cortar peticiones en curso
+basta con enviar SIGHUP al proceso maestro (`kill -HUP <pid>`).
+"""
+import os
+
+def _cpus_disponibles() -> int:
+    """Número de CPUs que el proceso puede usar (respeta la afinidad del contenedor)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# Un worker por CPU salvo que WEB_CONCURRENCY indique otra cosa
+workers = int(os.getenv("WEB_CONCURRENCY", str(_cpus_disponibles())))
+# Los workers lo heredan: el gateway reparte entre ellos sus límites de admisión
+os.environ["GUNICORN_WORKERS"] = str(workers)
+worker_class = "uvicorn.workers.UvicornWorker"
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+
+# Con preload la app se importa una sola vez en el maestro y los workers la
+# heredan al hacer fork; a cambio SIGHUP ya no recarga el código. El pool de
+# conexiones heredado se descarta en cada hijo (ver database/db_config.py).
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+
+# Tiempo que se da a los workers para terminar sus peticiones al recargar/parar
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+keepalive = 5
+
+accesslog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
@@ -3,19 +3,33 @@ Microservicio de Ingredientes
 Maneja operaciones CRUD para ingredientes
 """
 from fastapi import FastAPI, HTTPException, Depends
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from sqlalchemy import delete, distinct, select
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import Iterable, List, Optional
 from pydantic import BaseModel, ConfigDict
+from pydantic_core import to_json
 import sys
 import os
 
 # Agregar el directorio padre al path para importar database
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import get_db, init_db, Ingrediente
+from database import get_db, get_db_lectura, get_db_escritura, LecturaPropiaMiddleware, init_db, base_datos_lista, ejecutar_escritura, registrar_cambio, registrar_cambios, listar_cambios, seq_actual, Ingrediente, Receta, RecetaIngrediente
+from database import recalcular_resumenes, recetas_con_ingrediente
+from database.estadisticas import contar_ingredientes, mover_categoria, total, ingredientes_por_categoria, recetas_por_ingrediente
+from comun.diagnostico import crear_router_diagnostico
+from comun.parametros import parsear_lista
+from comun.cache import cache_desde_entorno
 
 app = FastAPI(title="Microservicio de Ingredientes", version="1.0.0")
 
+# Cookie de lectura propia tras cada escritura (réplicas de lectura)
+app.add_middleware(LecturaPropiaMiddleware)
+
+# Perfilado y memoria en caliente (/debug/*), solo con DEBUG_TOKEN definido
+app.include_router(crear_router_diagnostico())
+
 # Modelos Pydantic
 class IngredienteCreate(BaseModel):
     nombre: str
@@ -35,6 +49,112 @@ class IngredienteResponse(BaseModel):
     unidad_medida: Optional[str] = None
     categoria: Optional[str] = None
 
+# Serialización rápida para listados
+COLUMNAS_INGREDIENTE = (
+    Ingrediente.id,
+    Ingrediente.nombre,
+    Ingrediente.unidad_medida,
+    Ingrediente.categoria,
+)
+
+# Campos y relaciones seleccionables con ?fields= e ?incluir=
+CAMPOS_INGREDIENTE = {columna.key: columna for columna in COLUMNAS_INGREDIENTE}
+RELACIONES_INGREDIENTE = ("recetas",)
+
+def columnas_ingredientes(campos: Optional[Iterable[str]] = None) -> tuple:
+    """Columnas a seleccionar para los campos pedidos (el id siempre, para cargar relaciones)"""
+    if not campos:
+        return COLUMNAS_INGREDIENTE
+    return (Ingrediente.id, *(CAMPOS_INGREDIENTE[campo] for campo in campos if campo != "id"))
+
+def construir_ingredientes(db: Session, filas, incluir: Iterable[str] = (),
+                           campos: Optional[Iterable[str]] = None) -> List[dict]:
+    """
+    Armar los ingredientes como diccionarios. Con incluir=recetas se agregan
+    las recetas que usan cada ingrediente, cargadas en una sola consulta.
+    """
+    ingredientes = [fila._asdict() for fila in filas]
+    if ingredientes and "recetas" in incluir:
+        por_id = {ingrediente["id"]: ingrediente for ingrediente in ingredientes}
+        for ingrediente in ingredientes:
+            ingrediente["recetas"] = []
+        usos = db.execute(
+            select(RecetaIngrediente.ingrediente_id, RecetaIngrediente.receta_id, RecetaIngrediente.cantidad, Receta.nombre)
+            .join(Receta, Receta.id == RecetaIngrediente.receta_id)
+            .where(RecetaIngrediente.ingrediente_id.in_(list(por_id)))
+            .order_by(RecetaIngrediente.ingrediente_id, RecetaIngrediente.receta_id)
+        )
+        for ingrediente_id, receta_id, cantidad, nombre in usos:
+            por_id[ingrediente_id]["recetas"].append(
+                {"receta_id": receta_id, "cantidad": cantidad, "nombre_receta": nombre}
+            )
+    if campos and "id" not in campos:
+        for ingrediente in ingredientes:
+            del ingrediente["id"]
+    return ingredientes
+
+def respuesta_json(contenido, status_code: int = 200) -> Response:
+    """Serializar directamente a bytes con el serializador compilado de pydantic-core"""
+    return Response(content=to_json(contenido), status_code=status_code, media_type="application/json")
+
+# Caché compartida entre procesos (ver comun/cache.py), desactivada sin CACHE_URL.
+# Con incluir=recetas los ingredientes llevan nombres de recetas y las recetas
+# llevan nombres de ingredientes: toda escritura invalida los dos grupos
+cache = cache_desde_entorno()
+GRUPOS_CACHE = ("recetas", "ingredientes")
+
+def escribir(db: Session, operacion):
+    """Ejecutar la escritura e invalidar la caché antes de responder"""
+    resultado = ejecutar_escritura(db, operacion)
+    if cache is not None:
+        cache.invalidar(*GRUPOS_CACHE)
+    return resultado
+
+def ingredientes_cacheados(db: Session, ingrediente_ids: List[int], incluir: Iterable[str],
+                           campos: Iterable[str]) -> List[bytes]:
+    """
+    JSON de cada ingrediente, en el orden de `ingrediente_ids`, con un solo
+    MGET a la caché. Los que faltan se arman desde `db`, que debe ser la
+    primaria: una réplica atrasada dejaría cacheado un dato viejo.
+    """
+    sufijo = f"{','.join(campos)}|{','.join(incluir)}"
+    claves = {f"ingrediente:{ingrediente_id}:{sufijo}": ingrediente_id for ingrediente_id in ingrediente_ids}
+    
+    def calcular(faltantes: List[str]) -> dict:
+        filas = db.execute(
+            select(*columnas_ingredientes(campos))
+            .where(Ingrediente.id.in_([claves[clave] for clave in faltantes]))
+        ).all()
+        calculados = {}
+        for ingrediente in construir_ingredientes(db, filas, incluir):
+            ingrediente_id = ingrediente["id"] if not campos or "id" in campos else ingrediente.pop("id")
+            calculados[f"ingrediente:{ingrediente_id}:{sufijo}"] = to_json(ingrediente)
+        return calculados
+    
+    encontrados = cache.obtener_varios("ingredientes", list(claves), calcular)
+    return [encontrados[clave] for clave in claves if clave in encontrados]
+
+# Entidades cuyos cambios publica este servicio
+ENTIDADES_CAMBIOS = ("ingrediente",)
+
+# Exportación en streaming
+TAMANO_LOTE_EXPORT = 1000
+
+def generar_export_ingredientes(bind):
+    """
+    Generar el NDJSON de todos los ingredientes leyendo con un cursor en
+    streaming (yield_per). Usa su propia sesión porque la de la petición se
+    cierra antes de enviar el cuerpo.
+    """
+    with Session(bind) as db:
+        resultado = db.execute(
+            select(*COLUMNAS_INGREDIENTE)
+            .order_by(Ingrediente.id)
+            .execution_options(yield_per=TAMANO_LOTE_EXPORT)
+        )
+        for lote in resultado.partitions():
+            yield b"".join(to_json(fila._asdict()) + b"\n" for fila in lote)
+
 # Eventos de inicio
 @app.on_event("startup")
 def startup_event():
@@ -46,80 +166,208 @@ def health_check():
     """Verificar que el servicio está activo"""
     return {"status": "healthy", "service": "ingredientes"}
 
+@app.get("/ready")
+def readiness_check(db: Session = Depends(get_db)):
+    """Verificar que el servicio puede atender peticiones (base de datos lista)"""
+    if not base_datos_lista(db.get_bind()):
+        return JSONResponse(
+            status_code=503,
+            content={"status": "not_ready", "service": "ingredientes"}
+        )
+    return {"status": "ready", "service": "ingredientes"}
+
+@app.get("/cambios")
+def obtener_cambios(desde: int = 0, limit: int = 100, db: Session = Depends(get_db_lectura)):
+    """Obtener en orden los cambios de ingredientes posteriores a `desde`"""
+    cambios = listar_cambios(db, ENTIDADES_CAMBIOS, desde, min(max(limit, 1), 1000))
+    return respuesta_json({
+        "cambios": cambios,
+        "ultimo_seq": cambios[-1]["seq"] if cambios else desde,
+        "seq_actual": seq_actual(db)
+    })
+
+@app.get("/estadisticas")
+def obtener_estadisticas(ids: Optional[str] = None, db: Session = Depends(get_db_lectura)):
+    """
+    Total de ingredientes y cuántos hay por categoría, leídos de los
+    contadores; con `ids` (hasta 100) también cuántas recetas usan cada uno.
+    """
+    try:
+        ingrediente_ids = {int(valor) for valor in ids.split(",") if valor.strip()} if ids else set()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids debe ser una lista de enteros separados por comas")
+    if len(ingrediente_ids) > 100:
+        raise HTTPException(status_code=400, detail="Se admiten hasta 100 ids")
+    estadisticas = {
+        "ingredientes": total(db, "ingredientes"),
+        "ingredientes_por_categoria": ingredientes_por_categoria(db)
+    }
+    if ingrediente_ids:
+        estadisticas["recetas_por_ingrediente"] = recetas_por_ingrediente(db, ingrediente_ids)
+    return respuesta_json(estadisticas)
+
 @app.post("/ingredientes", response_model=IngredienteResponse, status_code=201)
-def crear_ingrediente(ingrediente: IngredienteCreate, db: Session = Depends(get_db)):
+def crear_ingrediente(ingrediente: IngredienteCreate, db: Session = Depends(get_db_escritura)):
     """Crear un nuevo ingrediente"""
-    # Verificar si ya existe
-    existing = db.query(Ingrediente).filter(Ingrediente.nombre == ingrediente.nombre).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="El ingrediente ya existe")
+    def operacion(db: Session):
+        # Verificar si ya existe
+        existing = db.query(Ingrediente).filter(Ingrediente.nombre == ingrediente.nombre).first()
+        if existing:
+            raise HTTPException(status_code=400, detail="El ingrediente ya existe")
+        
+        db_ingrediente = Ingrediente(
+            nombre=ingrediente.nombre,
+            unidad_medida=ingrediente.unidad_medida,
+            categoria=ingrediente.categoria
+        )
+        db.add(db_ingrediente)
+        db.flush()
+        contar_ingredientes(db, [db_ingrediente.id], 1)
+        resultado = IngredienteResponse.model_validate(db_ingrediente)
+        registrar_cambio(db, "ingrediente", db_ingrediente.id, "crear", resultado.model_dump())
+        return resultado
     
-    db_ingrediente = Ingrediente(
-        nombre=ingrediente.nombre,
-        unidad_medida=ingrediente.unidad_medida,
-        categoria=ingrediente.categoria
-    )
-    db.add(db_ingrediente)
-    db.commit()
-    db.refresh(db_ingrediente)
-    return db_ingrediente
+    return escribir(db, operacion)
 
 @app.get("/ingredientes", response_model=List[IngredienteResponse])
 def listar_ingredientes(
     skip: int = 0, 
     limit: int = 100, 
     categoria: Optional[str] = None,
-    db: Session = Depends(get_db)
+    fields: Optional[str] = None,
+    incluir: Optional[str] = None,
+    db: Session = Depends(get_db_lectura),
+    primaria: Session = Depends(get_db)
 ):
-    """Obtener lista de ingredientes, opcionalmente filtrados por categoría"""
-    query = db.query(Ingrediente)
+    """
+    Obtener lista de ingredientes, opcionalmente filtrados por categoría.
+    `fields` elige las columnas e incluir=recetas agrega las recetas que usan cada uno.
+    """
+    campos = parsear_lista(fields, CAMPOS_INGREDIENTE, "fields", ())
+    relaciones = parsear_lista(incluir, RELACIONES_INGREDIENTE, "incluir", ())
+    # Con caché sólo se consultan los ids de la página; el resto sale de la caché
+    query = select(Ingrediente.id) if cache is not None else select(*columnas_ingredientes(campos))
     
     if categoria:
-        query = query.filter(Ingrediente.categoria == categoria)
+        query = query.where(Ingrediente.categoria == categoria)
     
-    ingredientes = query.offset(skip).limit(limit).all()
-    return ingredientes
+    filas = db.execute(query.order_by(Ingrediente.id).offset(skip).limit(limit))
+    if cache is not None:
+        cuerpos = ingredientes_cacheados(primaria, [fila.id for fila in filas], relaciones, campos)
+        return Response(content=b"[" + b",".join(cuerpos) + b"]", media_type="application/json")
+    return respuesta_json(construir_ingredientes(db, filas, relaciones, campos))
+
+@app.get("/ingredientes/export")
+def exportar_ingredientes(db: Session = Depends(get_db_lectura)):
+    """Exportar todos los ingredientes como NDJSON"""
+    return StreamingResponse(
+        generar_export_ingredientes(db.get_bind()),
+        media_type="application/x-ndjson"
+    )
 
 @app.get("/ingredientes/{ingrediente_id}", response_model=IngredienteResponse)
-def obtener_ingrediente(ingrediente_id: int, db: Session = Depends(get_db)):
-    """Obtener un ingrediente específico por ID"""
-    ingrediente = db.query(Ingrediente).filter(Ingrediente.id == ingrediente_id).first()
-    if not ingrediente:
+def obtener_ingrediente(ingrediente_id: int, fields: Optional[str] = None, incluir: Optional[str] = None,
+                        db: Session = Depends(get_db_lectura), primaria: Session = Depends(get_db)):
+    """Obtener un ingrediente específico por ID (admite ?fields= e ?incluir= como el listado)"""
+    campos = parsear_lista(fields, CAMPOS_INGREDIENTE, "fields", ())
+    relaciones = parsear_lista(incluir, RELACIONES_INGREDIENTE, "incluir", ())
+    if cache is not None:
+        cuerpos = ingredientes_cacheados(primaria, [ingrediente_id], relaciones, campos)
+        if not cuerpos:
+            raise HTTPException(status_code=404, detail="Ingrediente no encontrado")
+        return Response(content=cuerpos[0], media_type="application/json")
+    filas = db.execute(select(*columnas_ingredientes(campos)).where(Ingrediente.id == ingrediente_id)).all()
+    if not filas:
         raise HTTPException(status_code=404, detail="Ingrediente no encontrado")
-    return ingrediente
+    return respuesta_json(construir_ingredientes(db, filas, relaciones, campos)[0])
 
 @app.put("/ingredientes/{ingrediente_id}", response_model=IngredienteResponse)
 def actualizar_ingrediente(
     ingrediente_id: int, 
     ingrediente_update: IngredienteUpdate, 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_escritura)
 ):
     """Actualizar un ingrediente existente"""
-    ingrediente = db.query(Ingrediente).filter(Ingrediente.id == ingrediente_id).first()
-    if not ingrediente:
-        raise HTTPException(status_code=404, detail="Ingrediente no encontrado")
+    def operacion(db: Session):
+        ingrediente = db.query(Ingrediente).filter(Ingrediente.id == ingrediente_id).first()
+        if not ingrediente:
+            raise HTTPException(status_code=404, detail="Ingrediente no encontrado")
+        
+        update_data = ingrediente_update.model_dump(exclude_unset=True)
+        anterior = ingrediente.categoria
+        cambia_categoria = "categoria" in update_data and update_data["categoria"] != anterior
+        for key, value in update_data.items():
+            setattr(ingrediente, key, value)
+        
+        db.flush()
+        if cambia_categoria:
+            mover_categoria(db, anterior, ingrediente.categoria)
+            # La máscara de categorías de las recetas que lo usan queda desactualizada
+            recalcular_resumenes(db, recetas_con_ingrediente(db, ingrediente_id))
+        resultado = IngredienteResponse.model_validate(ingrediente)
+        registrar_cambio(db, "ingrediente", ingrediente_id, "actualizar", resultado.model_dump())
+        return resultado
     
-    update_data = ingrediente_update.model_dump(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(ingrediente, key, value)
+    return escribir(db, operacion)
+
+@app.delete("/ingredientes")
+def eliminar_ingredientes(ids: Optional[str] = None, categoria: Optional[str] = None,
+                          db: Session = Depends(get_db_escritura)):
+    """
+    Eliminar varios ingredientes: los de `ids` (separados por comas) y/o los
+    de una categoría. Los que alguna receta usa no se borran y se devuelven
+    en `en_uso`.
+    """
+    try:
+        ingrediente_ids = {int(valor) for valor in ids.split(",") if valor.strip()} if ids else set()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids debe ser una lista de enteros separados por comas")
+    if not ingrediente_ids and not categoria:
+        raise HTTPException(status_code=400, detail="Indique ids o una categoría para eliminar ingredientes")
+    
+    def operacion(db: Session):
+        query = select(Ingrediente.id)
+        if ingrediente_ids:
+            query = query.where(Ingrediente.id.in_(ingrediente_ids))
+        if categoria:
+            query = query.where(Ingrediente.categoria == categoria)
+        candidatos = db.execute(query.order_by(Ingrediente.id)).scalars().all()
+        en_uso = set(db.execute(
+            select(distinct(RecetaIngrediente.ingrediente_id))
+            .where(RecetaIngrediente.ingrediente_id.in_(candidatos))
+        ).scalars())
+        eliminados = [ingrediente_id for ingrediente_id in candidatos if ingrediente_id not in en_uso]
+        if eliminados:
+            contar_ingredientes(db, eliminados, -1)
+            db.execute(
+                delete(Ingrediente).where(Ingrediente.id.in_(eliminados)),
+                execution_options={"synchronize_session": False}
+            )
+            registrar_cambios(db, "ingrediente", eliminados, "eliminar")
+        return {"eliminados": len(eliminados), "ids": eliminados, "en_uso": sorted(en_uso)}
     
-    db.commit()
-    db.refresh(ingrediente)
-    return ingrediente
+    return escribir(db, operacion)
 
 @app.delete("/ingredientes/{ingrediente_id}")
-def eliminar_ingrediente(ingrediente_id: int, db: Session = Depends(get_db)):
-    """Eliminar un ingrediente"""
-    ingrediente = db.query(Ingrediente).filter(Ingrediente.id == ingrediente_id).first()
-    if not ingrediente:
-        raise HTTPException(status_code=404, detail="Ingrediente no encontrado")
+def eliminar_ingrediente(ingrediente_id: int, db: Session = Depends(get_db_escritura)):
+    """Eliminar un ingrediente; si alguna receta lo usa se rechaza con 409"""
+    def operacion(db: Session):
+        if db.execute(
+            select(RecetaIngrediente.id).where(RecetaIngrediente.ingrediente_id == ingrediente_id).limit(1)
+        ).first():
+            raise HTTPException(status_code=409, detail="El ingrediente está en uso en alguna receta")
+        contar_ingredientes(db, [ingrediente_id], -1)
+        if not db.execute(delete(Ingrediente).where(Ingrediente.id == ingrediente_id)).rowcount:
+            raise HTTPException(status_code=404, detail="Ingrediente no encontrado")
+        
+        registrar_cambio(db, "ingrediente", ingrediente_id, "eliminar")
+        db.flush()
+        return {"message": "Ingrediente eliminado exitosamente"}
     
-    db.delete(ingrediente)
-    db.commit()
-    return {"message": "Ingrediente eliminado exitosamente"}
+    return escribir(db, operacion)
 
 @app.get("/ingredientes/buscar/{nombre}")
-def buscar_ingrediente(nombre: str, db: Session = Depends(get_db)):
+def buscar_ingrediente(nombre: str, db: Session = Depends(get_db_lectura)):
     """Buscar ingredientes por nombre (búsqueda parcial)"""
     ingredientes = db.query(Ingrediente).filter(
         Ingrediente.nombre.ilike(f"%{nombre}%")
@@ -128,4 +376,9 @@ def buscar_ingrediente(nombre: str, db: Session = Depends(get_db)):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8002)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        # Con varios workers uvicorn necesita la app como cadena importable
+        uvicorn.run("servicio_ingredientes.app:app", host="0.0.0.0", port=8002, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8002)
@@ -2,25 +2,56 @@
 Microservicio de Recetas
 Maneja operaciones CRUD para recetas y sus pasos de preparación
 """
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from sqlalchemy import case, delete, exists, func, insert, select, update
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from pydantic import BaseModel, ConfigDict
+from typing import Dict, Iterable, List, Optional, Union
+from pydantic import BaseModel, ConfigDict, ValidationError
+from pydantic_core import to_json
 import sys
 import os
+import uuid
 
 # Agregar el directorio padre al path para importar database
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import get_db, init_db, Receta, Paso, RecetaIngrediente
+from database import get_db, get_db_lectura, get_db_escritura, LecturaPropiaMiddleware, init_db, base_datos_lista, ejecutar_escritura, registrar_cambio, registrar_cambios, listar_cambios, seq_actual, Receta, Paso, Ingrediente, RecetaIngrediente
+from database import RecetaResumen, IndiceEstado, Trabajo, recalcular_resumenes, ajustar_num_pasos
+from database import EjecutorTrabajos, ContextoTrabajo, encolar, contar_pendientes, trabajo_dict
+from database.estadisticas import contar_recetas, reconstruir_estadisticas, total, ingredientes_mas_usados
+from database.resumen import bits_categorias, categorias_por_bit
+from database.db_config import SessionLocal
+from comun.diagnostico import crear_router_diagnostico
+from comun.parametros import parsear_lista
+from comun.cache import cache_desde_entorno
+
+from servicio_recetas.similares import indice_similitud, METRICAS
+from servicio_recetas.duplicados import indice_duplicados, firma_minhash, texto_receta, NOMBRE_INDICE
+from servicio_recetas.snapshot import snapshot_recetas
 
 app = FastAPI(title="Microservicio de Recetas", version="1.0.0")
 
+# Cookie de lectura propia tras cada escritura (réplicas de lectura)
+app.add_middleware(LecturaPropiaMiddleware)
+
+# Perfilado y memoria en caliente (/debug/*), solo con DEBUG_TOKEN definido
+app.include_router(crear_router_diagnostico())
+
 # Modelos Pydantic para validación
 class PasoCreate(BaseModel):
     numero_paso: int
     descripcion: str
 
+class PasoReemplazo(BaseModel):
+    id: Optional[int] = None  # paso existente a conservar; sin id se reutiliza uno con la misma descripción o se crea
+    numero_paso: int
+    descripcion: str
+
+class PasoMovimiento(BaseModel):
+    numero_paso: int
+
 class PasoResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
     
@@ -63,10 +94,437 @@ class RecetaResponse(BaseModel):
     porciones: Optional[int] = None
     pasos: List[PasoResponse] = []
 
+class FacetasResponse(BaseModel):
+    total: int
+    categorias: Dict[str, int]
+    num_pasos: Dict[str, int]
+    tiempo_preparacion: Dict[str, int]
+    porciones: Dict[str, int]
+
+class RecetasConFacetasResponse(BaseModel):
+    recetas: List[RecetaResponse]
+    facetas: FacetasResponse
+
+class TrabajoCreate(BaseModel):
+    tipo: str
+    parametros: dict = {}
+
+# Serialización rápida para listados
+COLUMNAS_RECETA = (
+    Receta.id,
+    Receta.nombre,
+    Receta.descripcion,
+    Receta.tiempo_preparacion,
+    Receta.porciones,
+)
+
+# Campos y relaciones seleccionables con ?fields= e ?incluir=
+CAMPOS_RECETA = {columna.key: columna for columna in COLUMNAS_RECETA}
+RELACIONES_RECETA = ("pasos", "ingredientes")
+
+def columnas_recetas(campos: Optional[Iterable[str]] = None) -> tuple:
+    """Columnas a seleccionar para los campos pedidos (el id siempre, para cargar relaciones)"""
+    if not campos:
+        return COLUMNAS_RECETA
+    return (Receta.id, *(CAMPOS_RECETA[campo] for campo in campos if campo != "id"))
+
+def construir_recetas(db: Session, filas, incluir: Iterable[str] = ("pasos",),
+                      campos: Optional[Iterable[str]] = None) -> List[dict]:
+    """
+    Armar las recetas como diccionarios a partir de tuplas SQL, sin crear
+    objetos del ORM. Cada relación incluida (pasos, ingredientes) se carga
+    para todas las recetas en una sola consulta; las no incluidas no se
+    consultan. Con `campos` la respuesta sólo lleva esas columnas.
+    """
+    recetas = [fila._asdict() for fila in filas]
+    if not recetas:
+        return recetas
+
+    por_id = {receta["id"]: receta for receta in recetas}
+    if "pasos" in incluir:
+        for receta in recetas:
+            receta["pasos"] = []
+        pasos = db.execute(
+            select(Paso.receta_id, Paso.id, Paso.numero_paso, Paso.descripcion)
+            .where(Paso.receta_id.in_(list(por_id)))
+            .order_by(Paso.receta_id, Paso.numero_paso, Paso.id)
+        )
+        for receta_id, paso_id, numero_paso, descripcion in pasos:
+            por_id[receta_id]["pasos"].append(
+                {"id": paso_id, "numero_paso": numero_paso, "descripcion": descripcion}
+            )
+    if "ingredientes" in incluir:
+        for receta in recetas:
+            receta["ingredientes"] = []
+        ingredientes = db.execute(
+            select(
+                RecetaIngrediente.receta_id,
+                RecetaIngrediente.ingrediente_id,
+                RecetaIngrediente.cantidad,
+                Ingrediente.nombre,
+            )
+            .outerjoin(Ingrediente, Ingrediente.id == RecetaIngrediente.ingrediente_id)
+            .where(RecetaIngrediente.receta_id.in_(list(por_id)))
+            .order_by(RecetaIngrediente.receta_id, RecetaIngrediente.id)
+        )
+        for receta_id, ingrediente_id, cantidad, nombre in ingredientes:
+            por_id[receta_id]["ingredientes"].append(
+                {"ingrediente_id": ingrediente_id, "cantidad": cantidad, "nombre_ingrediente": nombre}
+            )
+    if campos and "id" not in campos:
+        for receta in recetas:
+            del receta["id"]
+    return recetas
+
+def obtener_receta_dict(db: Session, receta_id: int, incluir: Iterable[str] = ("pasos",),
+                        campos: Optional[Iterable[str]] = None) -> Optional[dict]:
+    """Obtener una receta con sus pasos como diccionario, o None si no existe"""
+    filas = db.execute(select(*columnas_recetas(campos)).where(Receta.id == receta_id)).all()
+    recetas = construir_recetas(db, filas, incluir, campos)
+    return recetas[0] if recetas else None
+
+# Filtros y facetas del listado, resueltos sobre recetas + receta_resumen
+ORDENES = {
+    "id": (Receta.id,),
+    "tiempo": (Receta.tiempo_preparacion.asc().nulls_last(), Receta.id),
+    "-tiempo": (Receta.tiempo_preparacion.desc().nulls_last(), Receta.id),
+    "nombre": (Receta.nombre, Receta.id),
+    "-nombre": (Receta.nombre.desc(), Receta.id),
+}
+
+RANGOS_TIEMPO = (("0-15", 0, 15), ("16-30", 16, 30), ("31-60", 31, 60), ("61+", 61, None))
+
+def condiciones_recetas(db: Session, tiempo_min=None, tiempo_max=None, porciones_min=None,
+                        porciones_max=None, max_pasos=None, categorias=()) -> list:
+    """Condiciones SQL de los filtros del listado (suponen el join con RecetaResumen)"""
+    condiciones = []
+    if tiempo_min is not None:
+        condiciones.append(Receta.tiempo_preparacion >= tiempo_min)
+    if tiempo_max is not None:
+        condiciones.append(Receta.tiempo_preparacion <= tiempo_max)
+    if porciones_min is not None:
+        condiciones.append(Receta.porciones >= porciones_min)
+    if porciones_max is not None:
+        condiciones.append(Receta.porciones <= porciones_max)
+    if max_pasos is not None:
+        condiciones.append(RecetaResumen.num_pasos <= max_pasos)
+    if categorias:
+        bits = bits_categorias(db, categorias, asignar=False)
+        mascara = sum(1 << bit for bit in set(bits.values()))
+        if mascara:
+            condiciones.append(RecetaResumen.mascara_categorias.op("&")(mascara) == mascara)
+        # Categorías sin bit (desconocidas o fuera de la máscara): comprobación directa
+        for categoria in set(categorias) - set(bits):
+            condiciones.append(exists().where(
+                RecetaIngrediente.receta_id == Receta.id,
+                RecetaIngrediente.ingrediente_id == Ingrediente.id,
+                Ingrediente.categoria == categoria,
+            ))
+    return condiciones
+
+def calcular_facetas(db: Session, condiciones: list) -> dict:
+    """Conteos por categoría, número de pasos, rango de tiempo y porciones sobre las recetas filtradas"""
+    def agrupar(columna):
+        return db.execute(
+            select(columna, func.count())
+            .select_from(Receta)
+            .join(RecetaResumen, RecetaResumen.receta_id == Receta.id)
+            .where(*condiciones, columna.is_not(None))
+            .group_by(columna)
+            .order_by(columna)
+        ).all()
+
+    nombres_bits = categorias_por_bit(db)
+    columnas = [func.count()] + [
+        func.coalesce(func.sum(RecetaResumen.mascara_categorias.op(">>")(bit).op("&")(1)), 0)
+        for bit in nombres_bits
+    ]
+    total, *por_bit = db.execute(
+        select(*columnas)
+        .select_from(Receta)
+        .join(RecetaResumen, RecetaResumen.receta_id == Receta.id)
+        .where(*condiciones)
+    ).one()
+
+    rango = case(
+        *[
+            ((Receta.tiempo_preparacion <= hasta) if hasta is not None else (Receta.tiempo_preparacion >= desde), nombre)
+            for nombre, desde, hasta in RANGOS_TIEMPO
+        ]
+    )
+    tiempos = dict(agrupar(rango))
+    return {
+        "total": total,
+        "categorias": {
+            categoria: conteo
+            for categoria, conteo in sorted(zip(nombres_bits.values(), por_bit)) if conteo
+        },
+        "num_pasos": {str(valor): conteo for valor, conteo in agrupar(RecetaResumen.num_pasos)},
+        "tiempo_preparacion": {nombre: tiempos[nombre] for nombre, _, _ in RANGOS_TIEMPO if nombre in tiempos},
+        "porciones": {str(valor): conteo for valor, conteo in agrupar(Receta.porciones)},
+    }
+
+def respuesta_json(contenido, status_code: int = 200) -> Response:
+    """Serializar directamente a bytes con el serializador compilado de pydantic-core"""
+    return Response(content=to_json(contenido), status_code=status_code, media_type="application/json")
+
+# Entidades cuyos cambios publica este servicio
+ENTIDADES_CAMBIOS = ("receta", "paso")
+
+# Exportación en streaming
+TAMANO_LOTE_EXPORT = 500
+
+# Con RECETAS_SNAPSHOT=1 obtener y listar se atienden desde un snapshot en
+# memoria (ver servicio_recetas/snapshot.py)
+SNAPSHOT_ACTIVO = os.getenv("RECETAS_SNAPSHOT", "0") == "1"
+
+# Caché compartida entre procesos (ver comun/cache.py), desactivada sin CACHE_URL.
+# Las respuestas de cada servicio llevan datos del otro (nombres de ingredientes
+# o de recetas), así que toda escritura invalida los dos grupos
+cache = cache_desde_entorno()
+GRUPOS_CACHE = ("recetas", "ingredientes")
+
+def escribir(db: Session, operacion):
+    """Ejecutar la escritura y aplicarla en el snapshot y la caché antes de responder"""
+    resultado = ejecutar_escritura(db, operacion)
+    if SNAPSHOT_ACTIVO:
+        snapshot_recetas.sincronizar(db)
+    if cache is not None:
+        cache.invalidar(*GRUPOS_CACHE)
+    return resultado
+
+def recetas_cacheadas(db: Session, receta_ids: List[int], incluir: Iterable[str],
+                      campos: Iterable[str]) -> List[bytes]:
+    """
+    JSON de cada receta, en el orden de `receta_ids`, leído de la caché con
+    un solo MGET; las que faltan se arman juntas y se guardan. El listado y
+    el detalle comparten las entradas. `db` debe ser la primaria: lo que se
+    guarda lo leen todos los procesos y una réplica atrasada lo dejaría viejo.
+    """
+    sufijo = f"{','.join(campos)}|{','.join(incluir)}"
+    claves = {f"receta:{receta_id}:{sufijo}": receta_id for receta_id in receta_ids}
+    
+    def calcular(faltantes: List[str]) -> dict:
+        filas = db.execute(
+            select(*columnas_recetas(campos)).where(Receta.id.in_([claves[clave] for clave in faltantes]))
+        ).all()
+        # Se arman con el id para ubicar cada una; se quita después si no se pidió
+        calculadas = {}
+        for receta in construir_recetas(db, filas, incluir):
+            receta_id = receta["id"] if not campos or "id" in campos else receta.pop("id")
+            calculadas[f"receta:{receta_id}:{sufijo}"] = to_json(receta)
+        return calculadas
+    
+    encontradas = cache.obtener_varios("recetas", list(claves), calcular)
+    return [encontradas[clave] for clave in claves if clave in encontradas]
+
+def buscar_duplicados(db: Session, receta: RecetaCreate, umbral: float, limite: int = 10) -> List[dict]:
+    """Recetas existentes cuyo texto es casi idéntico al de `receta` según MinHash/LSH"""
+    indice_duplicados.sincronizar(db)
+    firma = firma_minhash(texto_receta(receta.nombre, receta.descripcion, (paso.descripcion for paso in receta.pasos)))
+    return [
+        {"receta_id": receta_id, "nombre": nombre, "similitud": similitud}
+        for receta_id, nombre, similitud in indice_duplicados.candidatos(firma, umbral=umbral, limite=limite)
+    ]
+
+def generar_export_recetas(bind):
+    """
+    Generar el NDJSON de todas las recetas con pasos e ingredientes.
+
+    Las recetas se leen con un cursor en streaming (yield_per) y los hijos de
+    cada lote se cargan aparte, así la memoria no depende del total de filas.
+    Usa su propia sesión porque la de la petición se cierra antes de enviar
+    el cuerpo.
+    """
+    with Session(bind) as db:
+        resultado = db.execute(
+            select(*COLUMNAS_RECETA)
+            .order_by(Receta.id)
+            .execution_options(yield_per=TAMANO_LOTE_EXPORT)
+        )
+        for lote in resultado.partitions():
+            recetas = construir_recetas(db, lote, incluir=("pasos", "ingredientes"))
+            yield b"".join(to_json(receta) + b"\n" for receta in recetas)
+
+# Trabajos en segundo plano (ver database/trabajos.py). Con TRABAJOS_EN_PROCESO=0
+# este proceso solo los encola y los ejecuta `python -m servicio_recetas.trabajador`
+TRABAJOS_EN_PROCESO = os.getenv("TRABAJOS_EN_PROCESO", "1") == "1"
+TRABAJOS_MAX_PENDIENTES = int(os.getenv("TRABAJOS_MAX_PENDIENTES", "100"))
+TAMANO_LOTE_IMPORTACION = 500
+# Errores de validación que se guardan en el informe de una importación
+ERRORES_MAX_IMPORTACION = 1000
+# Tipos que leen un archivo subido: solo se crean con POST /jobs/importar
+TRABAJOS_CON_ENTRADA = ("importar_recetas",)
+
+ejecutor_trabajos = EjecutorTrabajos(
+    directorio=os.getenv("TRABAJOS_DIR", "trabajos"),
+    max_concurrencia=int(os.getenv("TRABAJOS_MAX_CONCURRENCIA", "1")),
+    latido_max=float(os.getenv("TRABAJOS_LATIDO_MAX_SEGUNDOS", "300")),
+)
+
+def importar_lote(db: Session, lote: List[tuple], estado: dict) -> int:
+    """Insertar un lote de recetas validadas con una sentencia por tabla; devuelve cuántas se crearon"""
+    ingrediente_ids = {ingrediente.ingrediente_id for _, receta in lote for ingrediente in receta.ingredientes}
+    existentes = set(db.execute(
+        select(Ingrediente.id).where(Ingrediente.id.in_(ingrediente_ids))
+    ).scalars()) if ingrediente_ids else set()
+    validas = []
+    for numero, receta in lote:
+        faltantes = {ingrediente.ingrediente_id for ingrediente in receta.ingredientes} - existentes
+        if faltantes:
+            anotar_error_importacion(estado, numero, f"Ingredientes inexistentes: {sorted(faltantes)}")
+        else:
+            validas.append(receta)
+    if not validas:
+        return 0
+    
+    receta_ids = db.execute(
+        insert(Receta).returning(Receta.id, sort_by_parameter_order=True),
+        [
+            {"nombre": receta.nombre, "descripcion": receta.descripcion,
+             "tiempo_preparacion": receta.tiempo_preparacion, "porciones": receta.porciones}
+            for receta in validas
+        ]
+    ).scalars().all()
+    pasos = [
+        {"receta_id": receta_id, "numero_paso": paso.numero_paso, "descripcion": paso.descripcion}
+        for receta_id, receta in zip(receta_ids, validas) for paso in receta.pasos
+    ]
+    if pasos:
+        db.execute(insert(Paso), pasos)
+    ingredientes = [
+        {"receta_id": receta_id, "ingrediente_id": ingrediente.ingrediente_id, "cantidad": ingrediente.cantidad}
+        for receta_id, receta in zip(receta_ids, validas) for ingrediente in receta.ingredientes
+    ]
+    if ingredientes:
+        db.execute(insert(RecetaIngrediente), ingredientes)
+    recalcular_resumenes(db, receta_ids)
+    contar_recetas(db, receta_ids, 1)
+    registrar_cambios(db, "receta", receta_ids, "crear")
+    return len(receta_ids)
+
+def anotar_error_importacion(estado: dict, numero: int, detalle):
+    estado["con_errores"] += 1
+    if len(estado["errores"]) < ERRORES_MAX_IMPORTACION:
+        estado["errores"].append({"linea": numero, "detalle": detalle})
+
+@ejecutor_trabajos.tipo("importar_recetas")
+def trabajo_importar_recetas(db: Session, trabajo: ContextoTrabajo) -> dict:
+    """
+    Importar un NDJSON de recetas (el formato de /recetas/export, sin ids).
+
+    Cada lote se confirma junto con el punto de control del trabajo, así al
+    retomarlo tras una caída se saltean las líneas ya importadas.
+    """
+    entrada = trabajo.parametros["entrada"]
+    estado = trabajo.punto_control or {"linea": 0, "importadas": 0, "con_errores": 0, "errores": []}
+    total = os.path.getsize(entrada) or 1
+    
+    def confirmar(lote: List[tuple], numero: int, posicion: int):
+        estado["importadas"] += importar_lote(db, lote, estado)
+        estado["linea"] = numero
+        trabajo.guardar_punto_control(db, estado)
+        db.commit()
+        if cache is not None:
+            cache.invalidar(*GRUPOS_CACHE)
+        trabajo.avance(posicion / total, f"{estado['importadas']} recetas importadas")
+    
+    with open(entrada, "rb") as archivo:
+        lote, numero = [], estado["linea"]
+        for numero, linea in enumerate(archivo, 1):
+            if numero <= estado["linea"] or not linea.strip():
+                continue
+            try:
+                lote.append((numero, RecetaCreate.model_validate_json(linea)))
+            except ValidationError as error:
+                anotar_error_importacion(
+                    estado, numero, error.errors(include_url=False, include_context=False, include_input=False)
+                )
+            if len(lote) >= TAMANO_LOTE_IMPORTACION:
+                confirmar(lote, numero, archivo.tell())
+                lote = []
+        confirmar(lote, numero, total)
+    
+    with open(trabajo.archivo("json"), "wb") as informe:
+        informe.write(to_json(estado))
+    os.remove(entrada)
+    return {"importadas": estado["importadas"], "con_errores": estado["con_errores"]}
+
+@ejecutor_trabajos.tipo("exportar_recetas")
+def trabajo_exportar_recetas(db: Session, trabajo: ContextoTrabajo) -> dict:
+    """
+    Escribir el NDJSON de /recetas/export en un archivo descargable.
+
+    A diferencia del export en streaming, lee por páginas de id con una
+    transacción corta cada una: en SQLite un cursor abierto durante toda la
+    exportación bloquearía las escrituras (incluido el avance del trabajo).
+    """
+    total = db.execute(select(func.count(Receta.id))).scalar_one()
+    escritas, ultimo_id = 0, 0
+    with open(trabajo.archivo("ndjson"), "wb") as salida:
+        while True:
+            filas = db.execute(
+                select(*COLUMNAS_RECETA).where(Receta.id > ultimo_id).order_by(Receta.id).limit(TAMANO_LOTE_EXPORT)
+            ).all()
+            if not filas:
+                break
+            recetas = construir_recetas(db, filas, incluir=("pasos", "ingredientes"))
+            db.commit()
+            salida.write(b"".join(to_json(receta) + b"\n" for receta in recetas))
+            escritas += len(recetas)
+            ultimo_id = filas[-1].id
+            trabajo.avance(escritas / max(total, escritas), f"{escritas} de {total} recetas")
+    return {"recetas": escritas}
+
+@ejecutor_trabajos.tipo("reconstruir_indices")
+def trabajo_reconstruir_indices(db: Session, trabajo: ContextoTrabajo) -> dict:
+    """Recalcular resúmenes y firmas MinHash desde cero y reconstruir los índices en memoria"""
+    receta_ids = db.execute(select(Receta.id).order_by(Receta.id)).scalars().all()
+    for inicio in range(0, len(receta_ids), TAMANO_LOTE_EXPORT):
+        recalcular_resumenes(db, receta_ids[inicio:inicio + TAMANO_LOTE_EXPORT])
+        db.commit()
+        hechas = min(inicio + TAMANO_LOTE_EXPORT, len(receta_ids))
+        trabajo.avance(0.6 * hechas / len(receta_ids), "Recalculando resúmenes")
+    
+    trabajo.avance(0.6, "Recalculando firmas MinHash", forzar=True)
+    # Sin estado guardado el índice de duplicados descarta las firmas persistidas
+    db.execute(delete(IndiceEstado).where(IndiceEstado.nombre == NOMBRE_INDICE))
+    db.commit()
+    # Un aviso por lote de firmas mantiene el latido del trabajo durante el paso más largo
+    indice_duplicados.reconstruir(
+        db, lambda fraccion: trabajo.avance(0.6 + 0.3 * fraccion, "Recalculando firmas MinHash")
+    )
+    trabajo.avance(0.9, "Reconstruyendo índices en memoria", forzar=True)
+    indice_similitud.reconstruir(db)
+    if SNAPSHOT_ACTIVO:
+        snapshot_recetas.reconstruir(db)
+    reconstruir_estadisticas(db)
+    db.commit()
+    return {"recetas": len(receta_ids)}
+
+def encolar_trabajo(db: Session, tipo: str, parametros: dict) -> dict:
+    trabajo_id = encolar(db, tipo, parametros)
+    db.commit()
+    return {"id": trabajo_id, "tipo": tipo, "estado": "pendiente", "url": f"/jobs/{trabajo_id}"}
+
+def verificar_cupo_trabajos(db: Session):
+    """503 si la cola ya tiene TRABAJOS_MAX_PENDIENTES trabajos sin empezar"""
+    if contar_pendientes(db) >= TRABAJOS_MAX_PENDIENTES:
+        raise HTTPException(status_code=503, detail="Demasiados trabajos pendientes, reintentar más tarde")
+
 # Eventos de inicio
 @app.on_event("startup")
 def startup_event():
     init_db()
+    if SNAPSHOT_ACTIVO:
+        with SessionLocal() as db:
+            snapshot_recetas.reconstruir(db)
+    if TRABAJOS_EN_PROCESO:
+        ejecutor_trabajos.iniciar()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    ejecutor_trabajos.detener()
 
 # Endpoints
 @app.get("/health")
@@ -74,108 +532,480 @@ def health_check():
     """Verificar que el servicio está activo"""
     return {"status": "healthy", "service": "recetas"}
 
+@app.get("/ready")
+def readiness_check(db: Session = Depends(get_db)):
+    """Verificar que el servicio puede atender peticiones (base de datos lista)"""
+    if not base_datos_lista(db.get_bind()):
+        return JSONResponse(
+            status_code=503,
+            content={"status": "not_ready", "service": "recetas"}
+        )
+    return {"status": "ready", "service": "recetas"}
+
+@app.get("/cambios")
+def obtener_cambios(desde: int = 0, limit: int = 100, db: Session = Depends(get_db_lectura)):
+    """Obtener en orden los cambios de recetas y pasos posteriores a `desde`"""
+    cambios = listar_cambios(db, ENTIDADES_CAMBIOS, desde, min(max(limit, 1), 1000))
+    return respuesta_json({
+        "cambios": cambios,
+        "ultimo_seq": cambios[-1]["seq"] if cambios else desde,
+        "seq_actual": seq_actual(db)
+    })
+
+@app.get("/estadisticas")
+def obtener_estadisticas(top: int = 10, db: Session = Depends(get_db_lectura)):
+    """Total de recetas y los `top` ingredientes que más recetas usan, leídos de los contadores"""
+    return respuesta_json({
+        "recetas": total(db, "recetas"),
+        "ingredientes_mas_usados": ingredientes_mas_usados(db, min(max(top, 1), 100))
+    })
+
 @app.post("/recetas", response_model=RecetaResponse, status_code=201)
-def crear_receta(receta: RecetaCreate, db: Session = Depends(get_db)):
+def crear_receta(receta: RecetaCreate, verificar_duplicados: bool = False, umbral: float = 0.7,
+                 db: Session = Depends(get_db_escritura)):
     """Crear una nueva receta con sus pasos e ingredientes"""
-    db_receta = Receta(
-        nombre=receta.nombre,
-        descripcion=receta.descripcion,
-        tiempo_preparacion=receta.tiempo_preparacion,
-        porciones=receta.porciones
-    )
-    db.add(db_receta)
-    db.flush()
+    if not 0 < umbral <= 1:
+        raise HTTPException(status_code=400, detail="El umbral debe estar entre 0 y 1")
+    if verificar_duplicados:
+        duplicados = buscar_duplicados(db, receta, umbral)
+        if duplicados:
+            return respuesta_json({
+                "detail": "La receta parece un duplicado de recetas existentes",
+                "duplicados": duplicados
+            }, status_code=409)
     
-    # Agregar pasos
-    for paso in receta.pasos:
-        db_paso = Paso(
-            receta_id=db_receta.id,
-            numero_paso=paso.numero_paso,
-            descripcion=paso.descripcion
+    def operacion(db: Session):
+        ingrediente_ids = {ingrediente.ingrediente_id for ingrediente in receta.ingredientes}
+        if ingrediente_ids:
+            existentes = set(db.execute(
+                select(Ingrediente.id).where(Ingrediente.id.in_(ingrediente_ids))
+            ).scalars())
+            if ingrediente_ids - existentes:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Ingredientes inexistentes: {sorted(ingrediente_ids - existentes)}"
+                )
+        
+        db_receta = Receta(
+            nombre=receta.nombre,
+            descripcion=receta.descripcion,
+            tiempo_preparacion=receta.tiempo_preparacion,
+            porciones=receta.porciones
         )
-        db.add(db_paso)
+        db.add(db_receta)
+        db.flush()
+        
+        # Agregar pasos
+        for paso in receta.pasos:
+            db_paso = Paso(
+                receta_id=db_receta.id,
+                numero_paso=paso.numero_paso,
+                descripcion=paso.descripcion
+            )
+            db.add(db_paso)
+        
+        # Agregar ingredientes
+        for ingrediente in receta.ingredientes:
+            db_receta_ingrediente = RecetaIngrediente(
+                receta_id=db_receta.id,
+                ingrediente_id=ingrediente.ingrediente_id,
+                cantidad=ingrediente.cantidad
+            )
+            db.add(db_receta_ingrediente)
+        
+        db.flush()
+        recalcular_resumenes(db, [db_receta.id])
+        contar_recetas(db, [db_receta.id], 1)
+        resultado = obtener_receta_dict(db, db_receta.id)
+        registrar_cambio(db, "receta", db_receta.id, "crear", resultado)
+        return resultado
     
-    # Agregar ingredientes
-    for ingrediente in receta.ingredientes:
-        db_receta_ingrediente = RecetaIngrediente(
-            receta_id=db_receta.id,
-            ingrediente_id=ingrediente.ingrediente_id,
-            cantidad=ingrediente.cantidad
-        )
-        db.add(db_receta_ingrediente)
+    return escribir(db, operacion)
+
+@app.post("/recetas/duplicados")
+def detectar_duplicados(receta: RecetaCreate, umbral: float = 0.7, limit: int = 10, db: Session = Depends(get_db)):
+    """Buscar recetas casi duplicadas de la enviada (nombre, descripción y pasos) sin crearla"""
+    if not 0 < umbral <= 1:
+        raise HTTPException(status_code=400, detail="El umbral debe estar entre 0 y 1")
+    return respuesta_json(buscar_duplicados(db, receta, umbral, min(max(limit, 1), 100)))
+
+@app.get("/recetas", response_model=Union[List[RecetaResponse], RecetasConFacetasResponse])
+def listar_recetas(
+    skip: int = 0,
+    limit: int = 100,
+    tiempo_min: Optional[int] = None,
+    tiempo_max: Optional[int] = None,
+    porciones_min: Optional[int] = None,
+    porciones_max: Optional[int] = None,
+    max_pasos: Optional[int] = None,
+    categoria: List[str] = Query(default=[]),
+    orden: str = "id",
+    facetas: bool = False,
+    fields: Optional[str] = None,
+    incluir: Optional[str] = None,
+    db: Session = Depends(get_db_lectura),
+    primaria: Session = Depends(get_db)
+):
+    """
+    Obtener lista de recetas, opcionalmente filtradas y ordenadas.
     
-    db.commit()
-    db.refresh(db_receta)
-    return db_receta
+    `categoria` puede repetirse (la receta debe tener ingredientes de todas).
+    Con facetas=true la respuesta es {"recetas": [...], "facetas": {...}}.
+    `fields` (columnas) e `incluir` (pasos, ingredientes) recortan la
+    respuesta y las consultas; por defecto van todas las columnas y los pasos.
+    """
+    if orden not in ORDENES:
+        raise HTTPException(status_code=400, detail=f"Orden no soportado. Use uno de: {', '.join(ORDENES)}")
+    campos = parsear_lista(fields, CAMPOS_RECETA, "fields", ())
+    relaciones = parsear_lista(incluir, RELACIONES_RECETA, "incluir", ("pasos",))
+    
+    # Las categorías y las facetas se resuelven siempre en SQL
+    if SNAPSHOT_ACTIVO and not categoria and not facetas:
+        # El snapshot es de todo el proceso: se pone al día con la primaria, no con una réplica atrasada
+        snapshot_recetas.refrescar(primaria)
+        return respuesta_json(snapshot_recetas.listar(
+            skip, limit, orden, tiempo_min, tiempo_max, porciones_min, porciones_max, max_pasos,
+            relaciones, campos
+        ))
+    
+    condiciones = condiciones_recetas(
+        db, tiempo_min, tiempo_max, porciones_min, porciones_max, max_pasos, categoria
+    )
+    # Con caché sólo se consultan los ids de la página; el resto sale de la caché
+    query = select(Receta.id) if cache is not None and not facetas else select(*columnas_recetas(campos))
+    if max_pasos is not None or categoria:
+        query = query.join(RecetaResumen, RecetaResumen.receta_id == Receta.id)
+    filas = db.execute(
+        query.where(*condiciones).order_by(*ORDENES[orden]).offset(skip).limit(limit)
+    ).all()
+    if cache is not None and not facetas:
+        cuerpos = recetas_cacheadas(primaria, [fila.id for fila in filas], relaciones, campos)
+        return Response(content=b"[" + b",".join(cuerpos) + b"]", media_type="application/json")
+    recetas = construir_recetas(db, filas, relaciones, campos)
+    if facetas:
+        return respuesta_json({"recetas": recetas, "facetas": calcular_facetas(db, condiciones)})
+    return respuesta_json(recetas)
 
-@app.get("/recetas", response_model=List[RecetaResponse])
-def listar_recetas(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Obtener lista de todas las recetas"""
-    recetas = db.query(Receta).offset(skip).limit(limit).all()
-    return recetas
+@app.get("/recetas/export")
+def exportar_recetas(db: Session = Depends(get_db_lectura)):
+    """Exportar todas las recetas con sus pasos e ingredientes como NDJSON"""
+    return StreamingResponse(
+        generar_export_recetas(db.get_bind()),
+        media_type="application/x-ndjson"
+    )
 
 @app.get("/recetas/{receta_id}", response_model=RecetaResponse)
-def obtener_receta(receta_id: int, db: Session = Depends(get_db)):
-    """Obtener una receta específica por ID"""
-    receta = db.query(Receta).filter(Receta.id == receta_id).first()
+def obtener_receta(receta_id: int, fields: Optional[str] = None, incluir: Optional[str] = None,
+                   db: Session = Depends(get_db_lectura), primaria: Session = Depends(get_db)):
+    """Obtener una receta específica por ID (admite ?fields= e ?incluir= como el listado)"""
+    campos = parsear_lista(fields, CAMPOS_RECETA, "fields", ())
+    relaciones = parsear_lista(incluir, RELACIONES_RECETA, "incluir", ("pasos",))
+    if SNAPSHOT_ACTIVO:
+        snapshot_recetas.refrescar(primaria)
+        receta = snapshot_recetas.obtener(receta_id, relaciones, campos)
+    elif cache is not None:
+        cuerpos = recetas_cacheadas(primaria, [receta_id], relaciones, campos)
+        if not cuerpos:
+            raise HTTPException(status_code=404, detail="Receta no encontrada")
+        return Response(content=cuerpos[0], media_type="application/json")
+    else:
+        receta = obtener_receta_dict(db, receta_id, relaciones, campos)
     if not receta:
         raise HTTPException(status_code=404, detail="Receta no encontrada")
-    return receta
+    return respuesta_json(receta)
+
+@app.get("/recetas/{receta_id}/similares")
+def recetas_similares(receta_id: int, k: int = 10, metrica: str = "jaccard", db: Session = Depends(get_db_lectura)):
+    """Obtener las k recetas que más ingredientes comparten con la receta indicada"""
+    if metrica not in METRICAS:
+        raise HTTPException(status_code=400, detail=f"Métrica no soportada. Use una de: {', '.join(METRICAS)}")
+    if not db.execute(select(Receta.id).where(Receta.id == receta_id)).first():
+        raise HTTPException(status_code=404, detail="Receta no encontrada")
+    
+    indice_similitud.sincronizar(db)
+    vecinos = indice_similitud.vecinos(receta_id, k=min(max(k, 1), 100), metrica=metrica)
+    nombres = dict(db.execute(
+        select(Receta.id, Receta.nombre).where(Receta.id.in_([vecino_id for vecino_id, _ in vecinos]))
+    ).all())
+    return respuesta_json([
+        {"receta_id": vecino_id, "nombre": nombres.get(vecino_id), "similitud": puntaje}
+        for vecino_id, puntaje in vecinos
+    ])
 
 @app.put("/recetas/{receta_id}", response_model=RecetaResponse)
-def actualizar_receta(receta_id: int, receta_update: RecetaUpdate, db: Session = Depends(get_db)):
+def actualizar_receta(receta_id: int, receta_update: RecetaUpdate, db: Session = Depends(get_db_escritura)):
     """Actualizar una receta existente"""
-    receta = db.query(Receta).filter(Receta.id == receta_id).first()
-    if not receta:
-        raise HTTPException(status_code=404, detail="Receta no encontrada")
+    def operacion(db: Session):
+        receta = db.query(Receta).filter(Receta.id == receta_id).first()
+        if not receta:
+            raise HTTPException(status_code=404, detail="Receta no encontrada")
+        
+        update_data = receta_update.model_dump(exclude_unset=True)
+        for key, value in update_data.items():
+            setattr(receta, key, value)
+        
+        db.flush()
+        resultado = obtener_receta_dict(db, receta_id)
+        registrar_cambio(db, "receta", receta_id, "actualizar", resultado)
+        return resultado
     
-    update_data = receta_update.model_dump(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(receta, key, value)
+    return escribir(db, operacion)
+
+@app.delete("/recetas")
+def eliminar_recetas(
+    ids: Optional[str] = None,
+    tiempo_min: Optional[int] = None,
+    tiempo_max: Optional[int] = None,
+    porciones_min: Optional[int] = None,
+    porciones_max: Optional[int] = None,
+    max_pasos: Optional[int] = None,
+    categoria: List[str] = Query(default=[]),
+    db: Session = Depends(get_db_escritura)
+):
+    """
+    Eliminar varias recetas: las de `ids` (separados por comas) y/o las que
+    cumplen los filtros del listado. Se exige al menos uno de los dos.
+    Pasos, ingredientes y resúmenes se borran en la base de datos por cascada.
+    """
+    try:
+        receta_ids = {int(valor) for valor in ids.split(",") if valor.strip()} if ids else set()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids debe ser una lista de enteros separados por comas")
+    condiciones = condiciones_recetas(
+        db, tiempo_min, tiempo_max, porciones_min, porciones_max, max_pasos, categoria
+    )
+    if not receta_ids and not condiciones:
+        raise HTTPException(status_code=400, detail="Indique ids o algún filtro para eliminar recetas")
     
-    db.commit()
-    db.refresh(receta)
-    return receta
+    def operacion(db: Session):
+        query = select(Receta.id)
+        if max_pasos is not None or categoria:
+            query = query.join(RecetaResumen, RecetaResumen.receta_id == Receta.id)
+        if receta_ids:
+            query = query.where(Receta.id.in_(receta_ids))
+        query = query.where(*condiciones)
+        eliminadas = db.execute(query.order_by(Receta.id)).scalars().all()
+        if eliminadas:
+            contar_recetas(db, eliminadas, -1)
+            # Una sola sentencia con la misma consulta como subconsulta, sin listar los ids
+            db.execute(
+                delete(Receta).where(Receta.id.in_(query.scalar_subquery())),
+                execution_options={"synchronize_session": False}
+            )
+            registrar_cambios(db, "receta", eliminadas, "eliminar")
+        return {"eliminadas": len(eliminadas), "ids": eliminadas}
+    
+    return escribir(db, operacion)
 
 @app.delete("/recetas/{receta_id}")
-def eliminar_receta(receta_id: int, db: Session = Depends(get_db)):
-    """Eliminar una receta"""
-    receta = db.query(Receta).filter(Receta.id == receta_id).first()
-    if not receta:
-        raise HTTPException(status_code=404, detail="Receta no encontrada")
+def eliminar_receta(receta_id: int, db: Session = Depends(get_db_escritura)):
+    """Eliminar una receta (sus pasos, ingredientes y resumen se borran por cascada)"""
+    def operacion(db: Session):
+        # Antes de borrar, mientras sus ingredientes siguen en receta_ingrediente
+        contar_recetas(db, [receta_id], -1)
+        if not db.execute(delete(Receta).where(Receta.id == receta_id)).rowcount:
+            raise HTTPException(status_code=404, detail="Receta no encontrada")
+        
+        registrar_cambio(db, "receta", receta_id, "eliminar")
+        db.flush()
+        return {"message": "Receta eliminada exitosamente"}
     
-    db.delete(receta)
-    db.commit()
-    return {"message": "Receta eliminada exitosamente"}
+    return escribir(db, operacion)
 
 @app.post("/recetas/{receta_id}/pasos", response_model=PasoResponse, status_code=201)
-def agregar_paso(receta_id: int, paso: PasoCreate, db: Session = Depends(get_db)):
+def agregar_paso(receta_id: int, paso: PasoCreate, db: Session = Depends(get_db_escritura)):
     """Agregar un paso a una receta"""
-    receta = db.query(Receta).filter(Receta.id == receta_id).first()
-    if not receta:
-        raise HTTPException(status_code=404, detail="Receta no encontrada")
+    def operacion(db: Session):
+        receta = db.query(Receta).filter(Receta.id == receta_id).first()
+        if not receta:
+            raise HTTPException(status_code=404, detail="Receta no encontrada")
+        
+        db_paso = Paso(
+            receta_id=receta_id,
+            numero_paso=paso.numero_paso,
+            descripcion=paso.descripcion
+        )
+        db.add(db_paso)
+        db.flush()
+        ajustar_num_pasos(db, receta_id, 1)
+        resultado = PasoResponse.model_validate(db_paso)
+        registrar_cambio(db, "paso", db_paso.id, "crear", {**resultado.model_dump(), "receta_id": receta_id})
+        return resultado
     
-    db_paso = Paso(
-        receta_id=receta_id,
-        numero_paso=paso.numero_paso,
-        descripcion=paso.descripcion
-    )
-    db.add(db_paso)
-    db.commit()
-    db.refresh(db_paso)
-    return db_paso
+    return escribir(db, operacion)
 
 @app.delete("/recetas/{receta_id}/pasos/{paso_id}")
-def eliminar_paso(receta_id: int, paso_id: int, db: Session = Depends(get_db)):
+def eliminar_paso(receta_id: int, paso_id: int, db: Session = Depends(get_db_escritura)):
     """Eliminar un paso de una receta"""
-    paso = db.query(Paso).filter(Paso.id == paso_id, Paso.receta_id == receta_id).first()
-    if not paso:
-        raise HTTPException(status_code=404, detail="Paso no encontrado")
+    def operacion(db: Session):
+        paso = db.query(Paso).filter(Paso.id == paso_id, Paso.receta_id == receta_id).first()
+        if not paso:
+            raise HTTPException(status_code=404, detail="Paso no encontrado")
+        
+        db.delete(paso)
+        ajustar_num_pasos(db, receta_id, -1)
+        registrar_cambio(db, "paso", paso_id, "eliminar", {"receta_id": receta_id})
+        db.flush()
+        return {"message": "Paso eliminado exitosamente"}
     
-    db.delete(paso)
-    db.commit()
-    return {"message": "Paso eliminado exitosamente"}
+    return escribir(db, operacion)
+
+@app.put("/recetas/{receta_id}/pasos")
+def reemplazar_pasos(receta_id: int, pasos: List[PasoReemplazo], db: Session = Depends(get_db_escritura)):
+    """
+    Reemplazar la lista completa de pasos de una receta.
+    
+    Se calcula la diferencia mínima con los pasos guardados (por id y, para
+    los que no traen id, por descripción) y se aplica en una transacción con
+    un INSERT, un UPDATE y un DELETE masivos como máximo.
+    """
+    def operacion(db: Session):
+        if not db.execute(select(Receta.id).where(Receta.id == receta_id)).first():
+            raise HTTPException(status_code=404, detail="Receta no encontrada")
+        
+        actuales = {
+            fila.id: fila for fila in db.execute(
+                select(Paso.id, Paso.numero_paso, Paso.descripcion).where(Paso.receta_id == receta_id)
+            )
+        }
+        ids_pedidos = [paso.id for paso in pasos if paso.id is not None]
+        ajenos = [paso_id for paso_id in ids_pedidos if paso_id not in actuales]
+        if ajenos:
+            raise HTTPException(status_code=400, detail=f"Pasos que no pertenecen a la receta: {ajenos}")
+        if len(set(ids_pedidos)) != len(ids_pedidos):
+            raise HTTPException(status_code=400, detail="Un paso no puede aparecer dos veces")
+        
+        # Pasos sin id: reutilizar uno no reclamado con la misma descripción
+        libres = {}
+        for paso_id, fila in actuales.items():
+            if paso_id not in ids_pedidos:
+                libres.setdefault(fila.descripcion, []).append(paso_id)
+        inserciones, actualizaciones, conservados = [], [], set()
+        for paso in pasos:
+            paso_id = paso.id
+            if paso_id is None and libres.get(paso.descripcion):
+                paso_id = libres[paso.descripcion].pop(0)
+            if paso_id is None:
+                inserciones.append({"receta_id": receta_id, "numero_paso": paso.numero_paso, "descripcion": paso.descripcion})
+                continue
+            conservados.add(paso_id)
+            actual = actuales[paso_id]
+            if (actual.numero_paso, actual.descripcion) != (paso.numero_paso, paso.descripcion):
+                actualizaciones.append({"id": paso_id, "numero_paso": paso.numero_paso, "descripcion": paso.descripcion})
+        eliminados = [paso_id for paso_id in actuales if paso_id not in conservados]
+        
+        if eliminados:
+            db.execute(delete(Paso).where(Paso.id.in_(eliminados)))
+        if actualizaciones:
+            db.execute(update(Paso), actualizaciones)
+        if inserciones:
+            db.execute(insert(Paso), inserciones)
+        ajustar_num_pasos(db, receta_id, len(inserciones) - len(eliminados))
+        
+        receta = obtener_receta_dict(db, receta_id)
+        if inserciones or actualizaciones or eliminados:
+            registrar_cambio(db, "receta", receta_id, "actualizar", receta)
+        return {
+            "pasos": receta["pasos"],
+            "insertados": len(inserciones),
+            "actualizados": len(actualizaciones),
+            "eliminados": len(eliminados),
+        }
+    
+    return escribir(db, operacion)
+
+@app.patch("/recetas/{receta_id}/pasos/{paso_id}")
+def mover_paso(receta_id: int, paso_id: int, movimiento: PasoMovimiento, db: Session = Depends(get_db_escritura)):
+    """
+    Mover un paso a otra posición. Los pasos intermedios se corren una
+    posición y todo se renumera con un único UPDATE.
+    """
+    def operacion(db: Session):
+        origen = db.execute(
+            select(Paso.numero_paso).where(Paso.id == paso_id, Paso.receta_id == receta_id)
+        ).scalar()
+        if origen is None:
+            raise HTTPException(status_code=404, detail="Paso no encontrado")
+        destino = movimiento.numero_paso
+        maximo = db.execute(select(func.max(Paso.numero_paso)).where(Paso.receta_id == receta_id)).scalar()
+        if not 1 <= destino <= maximo:
+            raise HTTPException(status_code=400, detail=f"La posición debe estar entre 1 y {maximo}")
+        
+        if destino != origen:
+            desde, hasta = min(origen, destino), max(origen, destino)
+            desplazamiento = -1 if destino > origen else 1
+            db.execute(
+                update(Paso)
+                .where(Paso.receta_id == receta_id, Paso.numero_paso.between(desde, hasta))
+                .values(numero_paso=case(
+                    (Paso.id == paso_id, destino),
+                    else_=Paso.numero_paso + desplazamiento
+                ))
+                .execution_options(synchronize_session=False)
+            )
+            receta = obtener_receta_dict(db, receta_id)
+            registrar_cambio(db, "receta", receta_id, "actualizar", receta)
+        else:
+            receta = obtener_receta_dict(db, receta_id)
+        return receta["pasos"]
+    
+    return escribir(db, operacion)
+
+@app.post("/jobs", status_code=202)
+def crear_trabajo(trabajo: TrabajoCreate, db: Session = Depends(get_db_escritura)):
+    """Encolar un trabajo (exportar_recetas, reconstruir_indices) y devolver su id sin esperarlo"""
+    if trabajo.tipo in TRABAJOS_CON_ENTRADA:
+        raise HTTPException(status_code=400, detail=f"Los trabajos {trabajo.tipo} se crean con POST /jobs/importar")
+    if trabajo.tipo not in ejecutor_trabajos.tipos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tipo de trabajo no soportado: {trabajo.tipo}. Tipos: {sorted(ejecutor_trabajos.tipos)}"
+        )
+    verificar_cupo_trabajos(db)
+    return respuesta_json(encolar_trabajo(db, trabajo.tipo, trabajo.parametros), status_code=202)
+
+@app.post("/jobs/importar", status_code=202)
+async def crear_importacion(request: Request, db: Session = Depends(get_db_escritura)):
+    """Encolar la importación del NDJSON del cuerpo (una receta por línea, como RecetaCreate)"""
+    await run_in_threadpool(verificar_cupo_trabajos, db)
+    os.makedirs(ejecutor_trabajos.directorio, exist_ok=True)
+    # El cuerpo se guarda en el directorio compartido por los trabajadores, sin cargarlo en memoria
+    entrada = os.path.join(ejecutor_trabajos.directorio, f"entrada-{uuid.uuid4().hex}.ndjson")
+    with open(entrada, "wb") as archivo:
+        async for fragmento in request.stream():
+            archivo.write(fragmento)
+    if not os.path.getsize(entrada):
+        os.remove(entrada)
+        raise HTTPException(status_code=400, detail="El cuerpo de la importación está vacío")
+    creado = await run_in_threadpool(encolar_trabajo, db, "importar_recetas", {"entrada": entrada})
+    return respuesta_json(creado, status_code=202)
+
+@app.get("/jobs/{trabajo_id}")
+def obtener_trabajo(trabajo_id: int, db: Session = Depends(get_db)):
+    """Estado y avance de un trabajo (la cola se lee siempre de la primaria)"""
+    trabajo = db.get(Trabajo, trabajo_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return respuesta_json(trabajo_dict(trabajo))
+
+@app.get("/jobs/{trabajo_id}/resultado")
+def descargar_resultado_trabajo(trabajo_id: int, db: Session = Depends(get_db)):
+    """Descargar el archivo generado por un trabajo completado"""
+    trabajo = db.get(Trabajo, trabajo_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if trabajo.estado != "completado":
+        raise HTTPException(status_code=409, detail=f"El trabajo está {trabajo.estado}")
+    if trabajo.archivo is None or not os.path.exists(trabajo.archivo):
+        raise HTTPException(status_code=404, detail="El trabajo no tiene un archivo de resultado disponible")
+    media_type = "application/x-ndjson" if trabajo.archivo.endswith(".ndjson") else "application/json"
+    return FileResponse(trabajo.archivo, media_type=media_type, filename=os.path.basename(trabajo.archivo))
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        # Con varios workers uvicorn necesita la app como cadena importable
+        uvicorn.run("servicio_recetas.app:app", host="0.0.0.0", port=8001, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -0,0 +1,248 @@
+"""
+Detección de recetas casi duplicadas con MinHash + LSH
+
+El texto de cada receta (nombre, descripción y pasos) se normaliza y se
+parte en shingles de caracteres. Su firma MinHash (NUM_PERMUTACIONES
+mínimos de funciones hash universales, calculados con NumPy) estima la
+similitud de Jaccard entre dos recetas como la fracción de posiciones
+iguales. Las firmas se dividen en BANDAS; dos recetas son candidatas si
+coinciden en alguna banda completa, así una consulta sólo compara contra
+los cubos que comparte en lugar de contra todas las recetas.
+
+Las firmas se guardan en la tabla receta_minhash junto con el último evento
+del registro de cambios aplicado (indices_estado), de modo que al arrancar
+sólo se recalculan las recetas modificadas desde entonces. Se escriben con
+una sesión propia: la sincronización ocurre dentro de peticiones de lectura
+y no debe confirmar la transacción del handler.
+"""
+import re
+import threading
+import unicodedata
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from database import Receta, Paso, RecetaFirma, IndiceEstado, SeguidorCambios
+
+NUM_PERMUTACIONES = 128
+BANDAS = 32
+FILAS_POR_BANDA = NUM_PERMUTACIONES // BANDAS
+LONGITUD_SHINGLE = 5
+NOMBRE_INDICE = "minhash_recetas"
+# Recetas por consulta al recalcular muchas firmas, con un aviso de avance por lote
+LOTE_FIRMAS = 1000
+
+_PRIMO = np.uint64((1 << 61) - 1)
+_MASCARA = np.uint64(0xFFFFFFFF)
+_rng = np.random.RandomState(20240501)
+_A = _rng.randint(1, 1 << 32, size=NUM_PERMUTACIONES, dtype=np.uint64)
+_B = _rng.randint(0, 1 << 32, size=NUM_PERMUTACIONES, dtype=np.uint64)
+
+def normalizar(texto: str) -> str:
+    """Minúsculas, sin tildes y sin puntuación, con espacios simples"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(re.findall(r"[a-z0-9ñ]+", texto))
+
+def shingles(texto: str) -> np.ndarray:
+    """Hashes de 32 bits de los shingles de caracteres del texto normalizado"""
+    texto = normalizar(texto)
+    if len(texto) <= LONGITUD_SHINGLE:
+        piezas = {texto} if texto else set()
+    else:
+        piezas = {texto[i:i + LONGITUD_SHINGLE] for i in range(len(texto) - LONGITUD_SHINGLE + 1)}
+    return np.fromiter((zlib.crc32(p.encode()) for p in piezas), dtype=np.uint64, count=len(piezas))
+
+def firma_minhash(texto: str) -> np.ndarray:
+    """Firma MinHash del texto (uint32 de longitud NUM_PERMUTACIONES)"""
+    hashes = shingles(texto)
+    if len(hashes) == 0:
+        return np.full(NUM_PERMUTACIONES, 0xFFFFFFFF, dtype=np.uint32)
+    # (a·x + b) mod p por permutación y shingle; el desborde de uint64 es aceptable
+    with np.errstate(over="ignore"):
+        valores = (np.outer(_A, hashes) + _B[:, None]) % _PRIMO
+    return (valores.min(axis=1) & _MASCARA).astype(np.uint32)
+
+def texto_receta(nombre: str, descripcion: Optional[str], pasos: Iterable[str]) -> str:
+    return " ".join([nombre or "", descripcion or "", *pasos])
+
+def similitud_estimada(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.mean(a == b))
+
+class IndiceDuplicados:
+    """Firmas MinHash de todas las recetas y cubos LSH por banda"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seguidor = SeguidorCambios(entidades=("receta", "paso"))
+        self._construido = False
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self._firmas: Dict[int, np.ndarray] = {}
+        self._nombres: Dict[int, str] = {}
+        self._cubos: List[Dict[bytes, set]] = [{} for _ in range(BANDAS)]
+
+    @property
+    def total_recetas(self) -> int:
+        return len(self._firmas)
+
+    @staticmethod
+    def _claves(firma: np.ndarray) -> List[bytes]:
+        return [firma[b * FILAS_POR_BANDA:(b + 1) * FILAS_POR_BANDA].tobytes() for b in range(BANDAS)]
+
+    def _quitar(self, receta_id: int):
+        firma = self._firmas.pop(receta_id, None)
+        self._nombres.pop(receta_id, None)
+        if firma is None:
+            return
+        for banda, clave in enumerate(self._claves(firma)):
+            cubo = self._cubos[banda].get(clave)
+            if cubo is not None:
+                cubo.discard(receta_id)
+                if not cubo:
+                    del self._cubos[banda][clave]
+
+    def _poner(self, receta_id: int, nombre: str, firma: np.ndarray):
+        self._quitar(receta_id)
+        self._firmas[receta_id] = firma
+        self._nombres[receta_id] = nombre
+        for banda, clave in enumerate(self._claves(firma)):
+            self._cubos[banda].setdefault(clave, set()).add(receta_id)
+
+    # Mantenimiento
+
+    @staticmethod
+    def _calcular(db: Session, receta_ids: Iterable[int] = None) -> Dict[int, Tuple[str, np.ndarray]]:
+        """Leer el texto de las recetas indicadas (o de todas) y calcular sus firmas"""
+        consulta_recetas = select(Receta.id, Receta.nombre, Receta.descripcion)
+        consulta_pasos = select(Paso.receta_id, Paso.descripcion).order_by(Paso.receta_id, Paso.numero_paso)
+        if receta_ids is not None:
+            receta_ids = list(receta_ids)
+            consulta_recetas = consulta_recetas.where(Receta.id.in_(receta_ids))
+            consulta_pasos = consulta_pasos.where(Paso.receta_id.in_(receta_ids))
+
+        pasos: Dict[int, List[str]] = {}
+        for receta_id, descripcion in db.execute(consulta_pasos):
+            pasos.setdefault(receta_id, []).append(descripcion)
+        return {
+            receta_id: (nombre, firma_minhash(texto_receta(nombre, descripcion, pasos.get(receta_id, ()))))
+            for receta_id, nombre, descripcion in db.execute(consulta_recetas)
+        }
+
+    def _calcular_por_lotes(self, db: Session, receta_ids: List[int],
+                            avance: Optional[Callable[[float], None]] = None) -> Dict[int, Tuple[str, np.ndarray]]:
+        """_calcular en lotes de LOTE_FIRMAS, informando la fracción hecha tras cada uno"""
+        calculadas = {}
+        for inicio in range(0, len(receta_ids), LOTE_FIRMAS):
+            calculadas.update(self._calcular(db, receta_ids[inicio:inicio + LOTE_FIRMAS]))
+            if avance is not None:
+                avance(min(inicio + LOTE_FIRMAS, len(receta_ids)) / len(receta_ids))
+        return calculadas
+
+    @staticmethod
+    def _persistir(db: Session, calculadas: Dict[int, Tuple[str, np.ndarray]], eliminadas: Iterable[int], seq: int,
+                   reemplazar: bool = False):
+        """Guardar las firmas (todas si `reemplazar`) y la posición en una sesión breve, aparte de la de `db`"""
+        eliminadas = list(eliminadas)
+        ids = list(calculadas) + eliminadas
+        with Session(db.get_bind()) as propia:
+            if reemplazar:
+                propia.execute(delete(RecetaFirma))
+            elif ids:
+                propia.execute(delete(RecetaFirma).where(RecetaFirma.receta_id.in_(ids)))
+            if calculadas:
+                propia.execute(RecetaFirma.__table__.insert(), [
+                    {"receta_id": receta_id, "firma": firma.tobytes()}
+                    for receta_id, (_, firma) in calculadas.items()
+                ])
+            estado = propia.get(IndiceEstado, NOMBRE_INDICE)
+            if estado is None:
+                propia.add(IndiceEstado(nombre=NOMBRE_INDICE, ultimo_seq=seq))
+            else:
+                estado.ultimo_seq = seq
+            propia.commit()
+
+    def reconstruir(self, db: Session, avance: Optional[Callable[[float], None]] = None):
+        """
+        Cargar las firmas guardadas y recalcular las de recetas modificadas o nuevas.
+        `avance(fraccion)` se llama tras cada lote de firmas recalculadas.
+        """
+        with self._lock:
+            self._reiniciar()
+            # Si se interrumpe a medias, la próxima sincronización vuelve a reconstruir
+            self._construido = False
+            estado = db.get(IndiceEstado, NOMBRE_INDICE)
+            if estado is not None and self._seguidor.restaurar(db, estado.ultimo_seq):
+                nombres = dict(db.execute(select(Receta.id, Receta.nombre)).all())
+                for receta_id, firma in db.execute(select(RecetaFirma.receta_id, RecetaFirma.firma)):
+                    if receta_id in nombres:
+                        self._poner(receta_id, nombres[receta_id], np.frombuffer(firma, dtype=np.uint32))
+                faltantes = set(nombres) - set(self._firmas)
+                if faltantes:
+                    calculadas = self._calcular_por_lotes(db, sorted(faltantes), avance)
+                    for receta_id, (nombre, firma) in calculadas.items():
+                        self._poner(receta_id, nombre, firma)
+                    self._persistir(db, calculadas, (), self._seguidor.ultimo_seq)
+            else:
+                self._seguidor.posicionar(db)
+                receta_ids = db.execute(select(Receta.id).order_by(Receta.id)).scalars().all()
+                calculadas = self._calcular_por_lotes(db, receta_ids, avance)
+                for receta_id, (nombre, firma) in calculadas.items():
+                    self._poner(receta_id, nombre, firma)
+                self._persistir(db, calculadas, (), self._seguidor.ultimo_seq, reemplazar=True)
+            self._construido = True
+        # Eventos posteriores a la posición guardada
+        self.sincronizar(db)
+
+    def sincronizar(self, db: Session):
+        """Aplicar los cambios de recetas y pasos ocurridos desde la última sincronización"""
+        if not self._construido:
+            self.reconstruir(db)
+            return
+        with self._lock:
+            eventos = self._seguidor.nuevos(db)
+        if eventos is None:
+            self._construido = False
+            self.reconstruir(db)
+            return
+        if not eventos:
+            return
+
+        afectadas = set()
+        for _, entidad, entidad_id, _, datos in eventos:
+            if entidad == "receta":
+                afectadas.add(entidad_id)
+            elif datos and datos.get("receta_id") is not None:
+                afectadas.add(datos["receta_id"])
+        with self._lock:
+            calculadas = self._calcular(db, afectadas)
+            eliminadas = afectadas - set(calculadas)
+            for receta_id, (nombre, firma) in calculadas.items():
+                self._poner(receta_id, nombre, firma)
+            for receta_id in eliminadas:
+                self._quitar(receta_id)
+            self._persistir(db, calculadas, eliminadas, self._seguidor.ultimo_seq)
+
+    # Consultas
+
+    def candidatos(self, firma: np.ndarray, umbral: float = 0.7, excluir: int = None,
+                   limite: int = 10) -> List[Tuple[int, str, float]]:
+        """Recetas que comparten alguna banda con la firma y superan el umbral, como (id, nombre, similitud)"""
+        with self._lock:
+            ids = set()
+            for banda, clave in enumerate(self._claves(firma)):
+                ids.update(self._cubos[banda].get(clave, ()))
+            ids.discard(excluir)
+            resultado = []
+            for receta_id in ids:
+                similitud = similitud_estimada(firma, self._firmas[receta_id])
+                if similitud >= umbral:
+                    resultado.append((receta_id, self._nombres[receta_id], round(similitud, 4)))
+        resultado.sort(key=lambda candidato: (-candidato[2], candidato[0]))
+        return resultado[:limite]
+
+indice_duplicados = IndiceDuplicados()
@@ -0,0 +1,206 @@
+"""
+Motor de recetas similares
+
+Mantiene en memoria la matriz dispersa receta×ingrediente como listas
+invertidas (ingrediente -> filas de las recetas que lo usan) con NumPy. Para
+una receta se cuentan los ingredientes compartidos con todas las demás en una
+sola pasada vectorizada (np.bincount sobre las listas de sus ingredientes) y
+se eligen los k vecinos con mayor similitud de Jaccard o coseno.
+
+El índice se construye al primer uso y luego se actualiza de forma
+incremental leyendo el registro de cambios, así refleja también las
+escrituras hechas por otros workers.
+"""
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from database import Receta, RecetaIngrediente, SeguidorCambios
+
+METRICAS = ("jaccard", "coseno")
+
+# Máximo de celdas (consultas × recetas) del bloque denso usado en lote
+CELDAS_POR_BLOQUE = 8_000_000
+
+class IndiceSimilitud:
+    """Matriz receta×ingrediente en memoria para consultas de vecinos más cercanos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seguidor = SeguidorCambios(entidades=("receta",))
+        self._construido = False
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self._fila_de: Dict[int, int] = {}
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._tamanos = np.zeros(0, dtype=np.int32)
+        self._ingredientes_de: List[np.ndarray] = []
+        self._filas_de: Dict[int, set] = {}
+        self._postings: Dict[int, np.ndarray] = {}
+        self._filas_libres: List[int] = []
+
+    @property
+    def total_recetas(self) -> int:
+        return len(self._fila_de)
+
+    # Mantenimiento
+
+    def _cargar(self, db: Session, receta_ids: Iterable[int] = None) -> Dict[int, List[int]]:
+        """Leer los ingredientes de las recetas indicadas (o de todas)"""
+        consulta_recetas = select(Receta.id)
+        consulta_links = select(RecetaIngrediente.receta_id, RecetaIngrediente.ingrediente_id)
+        if receta_ids is not None:
+            receta_ids = list(receta_ids)
+            consulta_recetas = consulta_recetas.where(Receta.id.in_(receta_ids))
+            consulta_links = consulta_links.where(RecetaIngrediente.receta_id.in_(receta_ids))
+
+        ingredientes = {receta_id: [] for receta_id in db.execute(consulta_recetas).scalars()}
+        for receta_id, ingrediente_id in db.execute(consulta_links):
+            if receta_id in ingredientes:
+                ingredientes[receta_id].append(ingrediente_id)
+        return ingredientes
+
+    def _quitar(self, receta_id: int):
+        fila = self._fila_de.pop(receta_id, None)
+        if fila is None:
+            return
+        for ingrediente_id in self._ingredientes_de[fila].tolist():
+            self._filas_de[ingrediente_id].discard(fila)
+            self._postings.pop(ingrediente_id, None)
+        self._ingredientes_de[fila] = np.zeros(0, dtype=np.int64)
+        self._tamanos[fila] = 0
+        self._ids[fila] = -1
+        self._filas_libres.append(fila)
+
+    def _poner(self, receta_id: int, ingredientes: List[int]):
+        self._quitar(receta_id)
+        if self._filas_libres:
+            fila = self._filas_libres.pop()
+        else:
+            fila = len(self._ingredientes_de)
+            self._ingredientes_de.append(None)
+            if fila >= len(self._ids):
+                capacidad = max(16, len(self._ids) * 2)
+                self._ids = np.resize(self._ids, capacidad)
+                self._tamanos = np.resize(self._tamanos, capacidad)
+        unicos = np.unique(np.asarray(ingredientes, dtype=np.int64))
+        self._fila_de[receta_id] = fila
+        self._ids[fila] = receta_id
+        self._tamanos[fila] = len(unicos)
+        self._ingredientes_de[fila] = unicos
+        for ingrediente_id in unicos.tolist():
+            self._filas_de.setdefault(ingrediente_id, set()).add(fila)
+            self._postings.pop(ingrediente_id, None)
+
+    def _posting(self, ingrediente_id: int) -> np.ndarray:
+        """Filas que usan el ingrediente, como arreglo (se cachea hasta el próximo cambio)"""
+        arreglo = self._postings.get(ingrediente_id)
+        if arreglo is None:
+            arreglo = np.fromiter(self._filas_de.get(ingrediente_id, ()), dtype=np.int64)
+            self._postings[ingrediente_id] = arreglo
+        return arreglo
+
+    def reconstruir(self, db: Session):
+        """Construir el índice completo desde la base de datos"""
+        with self._lock:
+            self._seguidor.posicionar(db)
+            self._reiniciar()
+            for receta_id, ingredientes in self._cargar(db).items():
+                self._poner(receta_id, ingredientes)
+            self._construido = True
+
+    def sincronizar(self, db: Session):
+        """Aplicar los cambios de recetas ocurridos desde la última sincronización"""
+        if not self._construido:
+            self.reconstruir(db)
+            return
+        with self._lock:
+            eventos = self._seguidor.nuevos(db)
+        if eventos is None:
+            self.reconstruir(db)
+            return
+        if not eventos:
+            return
+
+        afectadas = {entidad_id for _, _, entidad_id, _, _ in eventos}
+        with self._lock:
+            actuales = self._cargar(db, afectadas)
+            for receta_id in afectadas:
+                if receta_id in actuales:
+                    self._poner(receta_id, actuales[receta_id])
+                else:
+                    self._quitar(receta_id)
+
+    # Consultas
+
+    def _puntajes(self, interseccion: np.ndarray, tamano_consulta: int, tamanos: np.ndarray, metrica: str) -> np.ndarray:
+        if metrica == "coseno":
+            denominador = np.sqrt(tamanos.astype(np.float64) * tamano_consulta)
+        else:
+            denominador = (tamanos + tamano_consulta - interseccion).astype(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            puntajes = np.where(denominador > 0, interseccion / denominador, 0.0)
+        return puntajes
+
+    @staticmethod
+    def _mejores(puntajes: np.ndarray, k: int) -> np.ndarray:
+        candidatos = np.flatnonzero(puntajes > 0)
+        if len(candidatos) > k:
+            candidatos = candidatos[np.argpartition(-puntajes[candidatos], k - 1)[:k]]
+        # Orden por puntaje descendente y, a igual puntaje, por id
+        return candidatos[np.lexsort((candidatos, -puntajes[candidatos]))]
+
+    def vecinos(self, receta_id: int, k: int = 10, metrica: str = "jaccard") -> List[Tuple[int, float]]:
+        """Los k recetas más parecidas a `receta_id` como (id, puntaje)"""
+        return self.vecinos_lote([receta_id], k, metrica)[receta_id]
+
+    def vecinos_lote(self, receta_ids: List[int], k: int = 10, metrica: str = "jaccard") -> Dict[int, List[Tuple[int, float]]]:
+        """
+        Vecinos de varias recetas a la vez. Las intersecciones de todo un
+        bloque de consultas se cuentan con un único bincount sobre índices
+        (consulta, fila), de modo que el trabajo por consulta es vectorizado.
+        """
+        with self._lock:
+            total_filas = len(self._ingredientes_de)
+            resultado = {}
+            consultas = [receta_id for receta_id in receta_ids if receta_id in self._fila_de]
+            for receta_id in receta_ids:
+                if receta_id not in self._fila_de:
+                    resultado[receta_id] = []
+            if not consultas or total_filas == 0:
+                return resultado
+
+            por_bloque = max(1, CELDAS_POR_BLOQUE // total_filas)
+            tamanos = self._tamanos[:total_filas]
+            for inicio in range(0, len(consultas), por_bloque):
+                bloque = consultas[inicio:inicio + por_bloque]
+                partes, desplazamientos = [], []
+                for posicion, receta_id in enumerate(bloque):
+                    fila = self._fila_de[receta_id]
+                    for ingrediente_id in self._ingredientes_de[fila].tolist():
+                        posting = self._posting(ingrediente_id)
+                        partes.append(posting)
+                        desplazamientos.append(np.full(len(posting), posicion * total_filas, dtype=np.int64))
+                if partes:
+                    indices = np.concatenate(partes) + np.concatenate(desplazamientos)
+                    intersecciones = np.bincount(indices, minlength=len(bloque) * total_filas)
+                else:
+                    intersecciones = np.zeros(len(bloque) * total_filas, dtype=np.int64)
+                intersecciones = intersecciones.reshape(len(bloque), total_filas)
+
+                for posicion, receta_id in enumerate(bloque):
+                    fila = self._fila_de[receta_id]
+                    interseccion = intersecciones[posicion]
+                    interseccion[fila] = 0
+                    puntajes = self._puntajes(interseccion, int(self._tamanos[fila]), tamanos, metrica)
+                    mejores = self._mejores(puntajes, k)
+                    resultado[receta_id] = [
+                        (int(self._ids[vecino]), round(float(puntajes[vecino]), 4)) for vecino in mejores
+                    ]
+            return resultado
+
+indice_similitud = IndiceSimilitud()
@@ -0,0 +1,301 @@
+"""
+Snapshot de lectura en memoria (RECETAS_SNAPSHOT=1)
+
+Copia compacta de recetas, pasos e ingredientes para atender obtener y
+listar sin abrir consultas ni crear objetos del ORM:
+
+- Almacenamiento por columnas: una fila por receta, con los enteros en
+  `array("q")` (8 bytes por valor, sin un objeto int por celda) y los textos
+  internados, así los nombres y pasos repetidos («Servir», «Mezclar») se
+  guardan una sola vez.
+- Pasos e ingredientes de cada fila como tuplas planas, que ocupan menos que
+  listas de diccionarios u objetos.
+- Los órdenes del listado se calculan una vez y se reutilizan hasta el
+  siguiente cambio.
+
+Se mantiene al día con el registro de cambios: tras cada escritura del
+propio proceso se aplican los eventos nuevos, y en las lecturas se comprueba
+como mucho cada `intervalo` segundos si otro worker escribió algo. Se
+sincroniza siempre con la primaria: una base con un `seq` anterior al ya
+aplicado se ignora en lugar de reconstruir el snapshot hacia atrás.
+"""
+import os
+import sys
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from database import Ingrediente, Paso, Receta, RecetaIngrediente, SeguidorCambios
+from database.cambios import horizonte
+
+# Valor que representa NULL en las columnas enteras
+NULO = -(2 ** 63)
+
+CAMPOS = ("id", "nombre", "descripcion", "tiempo_preparacion", "porciones")
+
+def _texto(valor: Optional[str]) -> Optional[str]:
+    return sys.intern(valor) if valor is not None else None
+
+def _entero(valor: Optional[int]) -> int:
+    return NULO if valor is None else valor
+
+class SnapshotRecetas:
+    """Recetas por columnas, actualizadas a partir del registro de cambios"""
+
+    def __init__(self, intervalo: float = 1.0):
+        self.intervalo = intervalo
+        self._lock = threading.RLock()
+        self._seguidor = SeguidorCambios(entidades=("receta", "paso", "ingrediente"))
+        self.cargado = False
+        self._ultima_comprobacion = 0.0
+        self._ultimo_visto = 0
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self._fila_de: Dict[int, int] = {}
+        self._ids = array("q")
+        self._nombres: List[Optional[str]] = []
+        self._descripciones: List[Optional[str]] = []
+        self._tiempos = array("q")
+        self._porciones = array("q")
+        # Por fila: ((id, numero_paso, descripcion), ...) y ((ingrediente_id, cantidad), ...)
+        self._pasos: List[tuple] = []
+        self._ingredientes: List[tuple] = []
+        self._filas_libres: List[int] = []
+        self._nombres_ingrediente: Dict[int, str] = {}
+        self._ordenes: Dict[str, List[int]] = {}
+
+    @property
+    def total_recetas(self) -> int:
+        return len(self._fila_de)
+
+    # Mantenimiento
+
+    def _cargar(self, db: Session, receta_ids: Iterable[int] = None) -> Dict[int, list]:
+        """Leer columnas, pasos e ingredientes de las recetas indicadas (o de todas)"""
+        consulta_recetas = select(Receta.id, Receta.nombre, Receta.descripcion, Receta.tiempo_preparacion, Receta.porciones)
+        consulta_pasos = select(Paso.receta_id, Paso.id, Paso.numero_paso, Paso.descripcion)
+        consulta_links = select(RecetaIngrediente.receta_id, RecetaIngrediente.ingrediente_id, RecetaIngrediente.cantidad)
+        if receta_ids is not None:
+            receta_ids = list(receta_ids)
+            consulta_recetas = consulta_recetas.where(Receta.id.in_(receta_ids))
+            consulta_pasos = consulta_pasos.where(Paso.receta_id.in_(receta_ids))
+            consulta_links = consulta_links.where(RecetaIngrediente.receta_id.in_(receta_ids))
+
+        recetas = {fila[0]: [tuple(fila), [], []] for fila in db.execute(consulta_recetas)}
+        for receta_id, paso_id, numero_paso, descripcion in db.execute(
+            consulta_pasos.order_by(Paso.receta_id, Paso.numero_paso, Paso.id)
+        ):
+            if receta_id in recetas:
+                recetas[receta_id][1].append((paso_id, numero_paso, _texto(descripcion)))
+        for receta_id, ingrediente_id, cantidad in db.execute(
+            consulta_links.order_by(RecetaIngrediente.receta_id, RecetaIngrediente.id)
+        ):
+            if receta_id in recetas:
+                recetas[receta_id][2].append((ingrediente_id, cantidad))
+        return recetas
+
+    def _cargar_ingredientes(self, db: Session, ingrediente_ids: Iterable[int] = None):
+        consulta = select(Ingrediente.id, Ingrediente.nombre)
+        if ingrediente_ids is not None:
+            ingrediente_ids = list(ingrediente_ids)
+            consulta = consulta.where(Ingrediente.id.in_(ingrediente_ids))
+            for ingrediente_id in ingrediente_ids:
+                self._nombres_ingrediente.pop(ingrediente_id, None)
+        for ingrediente_id, nombre in db.execute(consulta):
+            self._nombres_ingrediente[ingrediente_id] = _texto(nombre)
+
+    def _quitar(self, receta_id: int):
+        fila = self._fila_de.pop(receta_id, None)
+        if fila is None:
+            return
+        self._ids[fila] = NULO
+        self._nombres[fila] = self._descripciones[fila] = None
+        self._pasos[fila] = self._ingredientes[fila] = ()
+        self._filas_libres.append(fila)
+
+    def _poner(self, columnas: tuple, pasos: list, ingredientes: list):
+        receta_id, nombre, descripcion, tiempo, porciones = columnas
+        fila = self._fila_de.get(receta_id)
+        if fila is None:
+            if self._filas_libres:
+                fila = self._filas_libres.pop()
+            else:
+                fila = len(self._ids)
+                for columna in (self._ids, self._tiempos, self._porciones):
+                    columna.append(NULO)
+                for columna in (self._nombres, self._descripciones, self._pasos, self._ingredientes):
+                    columna.append(None)
+            self._fila_de[receta_id] = fila
+        self._ids[fila] = receta_id
+        self._nombres[fila] = _texto(nombre)
+        self._descripciones[fila] = _texto(descripcion)
+        self._tiempos[fila] = _entero(tiempo)
+        self._porciones[fila] = _entero(porciones)
+        self._pasos[fila] = tuple(pasos)
+        self._ingredientes[fila] = tuple(ingredientes)
+
+    def reconstruir(self, db: Session):
+        """Cargar el snapshot completo desde la base de datos"""
+        with self._lock:
+            self._seguidor.posicionar(db)
+            self._reiniciar()
+            self._cargar_ingredientes(db)
+            for columnas, pasos, ingredientes in self._cargar(db).values():
+                self._poner(columnas, pasos, ingredientes)
+            self.cargado = True
+            self._ultima_comprobacion = time.monotonic()
+
+    def sincronizar(self, db: Session):
+        """Aplicar los eventos de recetas, pasos e ingredientes posteriores al último aplicado"""
+        with self._lock:
+            self._ultima_comprobacion = time.monotonic()
+            if not self.cargado:
+                self.reconstruir(db)
+                return
+            eventos = self._seguidor.nuevos(db)
+            if eventos is None:
+                # Una base atrasada no tiene el último evento aplicado: no volver a un estado anterior
+                if self._ultimo_seq(db) < self._seguidor.ultimo_seq:
+                    return
+                self.reconstruir(db)
+                return
+            if not eventos:
+                return
+
+            recetas, ingredientes = set(), set()
+            for _, entidad, entidad_id, _, datos in eventos:
+                if entidad == "receta":
+                    recetas.add(entidad_id)
+                elif entidad == "ingrediente":
+                    ingredientes.add(entidad_id)
+                elif datos and datos.get("receta_id") is not None:
+                    recetas.add(datos["receta_id"])
+            if ingredientes:
+                self._cargar_ingredientes(db, ingredientes)
+            if recetas:
+                actuales = self._cargar(db, recetas)
+                for receta_id in recetas:
+                    if receta_id in actuales:
+                        self._poner(*actuales[receta_id])
+                    else:
+                        self._quitar(receta_id)
+                self._ordenes.clear()
+
+    def refrescar(self, db: Session):
+        """Antes de leer: sincronizar si pasó el intervalo y el registro avanzó (una consulta mínima)"""
+        if not self.cargado:
+            self.sincronizar(db)
+            return
+        if time.monotonic() - self._ultima_comprobacion < self.intervalo:
+            return
+        self._ultima_comprobacion = time.monotonic()
+        ultimo = self._ultimo_seq(db)
+        if ultimo != self._ultimo_visto and ultimo >= self._seguidor.ultimo_seq:
+            self.sincronizar(db)
+            self._ultimo_visto = ultimo
+
+    @staticmethod
+    def _ultimo_seq(db: Session) -> int:
+        # Horizonte del registro (con SQLite, max(seq) por la clave primaria); incluye otras entidades
+        return horizonte(db)
+
+    # Consultas
+
+    def _receta(self, fila: int, incluir: Iterable[str], campos: Optional[Iterable[str]]) -> dict:
+        tiempo, porciones = self._tiempos[fila], self._porciones[fila]
+        receta = {
+            "id": self._ids[fila],
+            "nombre": self._nombres[fila],
+            "descripcion": self._descripciones[fila],
+            "tiempo_preparacion": None if tiempo == NULO else tiempo,
+            "porciones": None if porciones == NULO else porciones,
+        }
+        if campos:
+            # Mismo orden de claves que construir_recetas: el id primero si se pidió
+            nombres = (["id"] if "id" in campos else []) + [campo for campo in campos if campo != "id"]
+            receta = {nombre: receta[nombre] for nombre in nombres}
+        if "pasos" in incluir:
+            receta["pasos"] = [
+                {"id": paso_id, "numero_paso": numero_paso, "descripcion": descripcion}
+                for paso_id, numero_paso, descripcion in self._pasos[fila]
+            ]
+        if "ingredientes" in incluir:
+            receta["ingredientes"] = [
+                {
+                    "ingrediente_id": ingrediente_id,
+                    "cantidad": cantidad,
+                    "nombre_ingrediente": self._nombres_ingrediente.get(ingrediente_id),
+                }
+                for ingrediente_id, cantidad in self._ingredientes[fila]
+            ]
+        return receta
+
+    def obtener(self, receta_id: int, incluir: Iterable[str] = ("pasos",),
+                campos: Optional[Iterable[str]] = None) -> Optional[dict]:
+        with self._lock:
+            fila = self._fila_de.get(receta_id)
+            return None if fila is None else self._receta(fila, incluir, campos)
+
+    def _filas_ordenadas(self, orden: str) -> List[int]:
+        filas = self._ordenes.get(orden)
+        if filas is not None:
+            return filas
+        filas = list(self._fila_de.values())
+        ids, tiempos, nombres = self._ids, self._tiempos, self._nombres
+        if orden == "id":
+            filas.sort(key=lambda fila: ids[fila])
+        elif orden in ("tiempo", "-tiempo"):
+            # NULL al final en los dos sentidos, y a igual tiempo por id
+            signo = -1 if orden == "-tiempo" else 1
+            filas.sort(key=lambda fila: (tiempos[fila] == NULO, signo * tiempos[fila], ids[fila]))
+        elif orden == "nombre":
+            filas.sort(key=lambda fila: (nombres[fila], ids[fila]))
+        elif orden == "-nombre":
+            filas.sort(key=lambda fila: ids[fila])
+            filas.sort(key=lambda fila: nombres[fila], reverse=True)
+        else:
+            raise ValueError(f"Orden no soportado: {orden}")
+        self._ordenes[orden] = filas
+        return filas
+
+    def listar(self, skip: int = 0, limit: int = 100, orden: str = "id", tiempo_min=None, tiempo_max=None,
+               porciones_min=None, porciones_max=None, max_pasos=None, incluir: Iterable[str] = ("pasos",),
+               campos: Optional[Iterable[str]] = None) -> List[dict]:
+        """Listado con los mismos filtros numéricos, órdenes y paginación que la consulta SQL"""
+        def cumple(fila: int) -> bool:
+            tiempo, porciones = self._tiempos[fila], self._porciones[fila]
+            if tiempo_min is not None and (tiempo == NULO or tiempo < tiempo_min):
+                return False
+            if tiempo_max is not None and (tiempo == NULO or tiempo > tiempo_max):
+                return False
+            if porciones_min is not None and (porciones == NULO or porciones < porciones_min):
+                return False
+            if porciones_max is not None and (porciones == NULO or porciones > porciones_max):
+                return False
+            return max_pasos is None or len(self._pasos[fila]) <= max_pasos
+
+        if limit <= 0:
+            return []
+        with self._lock:
+            filas = self._filas_ordenadas(orden)
+            filtrar = any(valor is not None for valor in (tiempo_min, tiempo_max, porciones_min, porciones_max, max_pasos))
+            if filtrar:
+                seleccion = []
+                for fila in filas:
+                    if cumple(fila):
+                        if skip > 0:
+                            skip -= 1
+                            continue
+                        seleccion.append(fila)
+                        if len(seleccion) >= limit:
+                            break
+            else:
+                seleccion = filas[max(skip, 0):max(skip, 0) + limit]
+            return [self._receta(fila, incluir, campos) for fila in seleccion]
+
+snapshot_recetas = SnapshotRecetas(intervalo=float(os.getenv("RECETAS_SNAPSHOT_INTERVALO", "1")))
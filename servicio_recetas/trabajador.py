@@ -0,0 +1,28 @@
+"""
+Proceso trabajador de la cola de trabajos del servicio de recetas
+
+Ejecuta los trabajos fuera de los workers web, para que una importación o
+una reconstrucción de índices no compita por CPU con las peticiones. Se usa
+con TRABAJOS_EN_PROCESO=0 en el servicio y la misma DATABASE_URL y
+TRABAJOS_DIR que él:
+
+    python -m servicio_recetas.trabajador
+"""
+import signal
+import threading
+
+from database import init_db
+from servicio_recetas.app import ejecutor_trabajos
+
+def main():
+    init_db()
+    terminar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: terminar.set())
+    signal.signal(signal.SIGINT, lambda *_: terminar.set())
+    ejecutor_trabajos.iniciar()
+    terminar.wait()
+    # Espera a que terminen los trabajos en curso; si se corta antes, otro trabajador los retoma
+    ejecutor_trabajos.detener()
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,14 @@
 
 # Script de inicio para Render
 # Inicia los tres servicios en background y el gateway en foreground
+# Cada uno usa WEB_CONCURRENCY workers (por defecto, uno por CPU)
+
+# En modo monolito el gateway carga los servicios en su propio proceso
+if [ "${GATEWAY_MODO:-proxy}" = "monolito" ]; then
+    mkdir -p /opt/render/project/data
+    echo "Iniciando API Gateway en modo monolito..."
+    exec gunicorn api_gateway.app:app -c gunicorn.conf.py --bind 0.0.0.0:${PORT:-8000}
+fi
 
 echo "Iniciando microservicios..."
 
@@ -10,15 +18,30 @@ mkdir -p /opt/render/project/data
 
 # Iniciar microservicio de ingredientes en background
 echo "Iniciando servicio de ingredientes..."
-uvicorn servicio_ingredientes.app:app --host 0.0.0.0 --port 8002 &
+gunicorn servicio_ingredientes.app:app -c gunicorn.conf.py --bind 0.0.0.0:8002 &
 
 # Iniciar microservicio de recetas en background
 echo "Iniciando servicio de recetas..."
-uvicorn servicio_recetas.app:app --host 0.0.0.0 --port 8001 &
+gunicorn servicio_recetas.app:app -c gunicorn.conf.py --bind 0.0.0.0:8001 &
+
+# Esperar a que cada servicio responda en /ready (en lugar de un sleep fijo)
+esperar_listo() {
+    local nombre=$1
+    local url=$2
+    for _ in $(seq 1 120); do
+        if python -c "import sys, urllib.request; urllib.request.urlopen(sys.argv[1], timeout=1)" "$url" 2>/dev/null; then
+            echo "Servicio de $nombre listo"
+            return 0
+        fi
+        sleep 0.25
+    done
+    echo "El servicio de $nombre no respondió en $url"
+    return 1
+}
 
-# Esperar un poco para que los servicios inicien
-sleep 5
+esperar_listo "ingredientes" "http://127.0.0.1:8002/ready" || exit 1
+esperar_listo "recetas" "http://127.0.0.1:8001/ready" || exit 1
 
 # Iniciar API Gateway en foreground (este es el proceso principal)
 echo "Iniciando API Gateway..."
-uvicorn api_gateway.app:app --host 0.0.0.0 --port ${PORT:-8000}
+exec gunicorn api_gateway.app:app -c gunicorn.conf.py --bind 0.0.0.0:${PORT:-8000}
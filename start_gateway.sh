@@ -7,5 +7,5 @@ echo "Puerto: ${PORT:-8000}"
 # Crear directorio para base de datos
 mkdir -p /opt/render/project/src/data
 
-# Iniciar el servicio
-exec uvicorn api_gateway.app:app --host 0.0.0.0 --port ${PORT:-8000} --log-level info
+# Iniciar el servicio (un worker por CPU, ajustable con WEB_CONCURRENCY)
+exec gunicorn api_gateway.app:app -c gunicorn.conf.py --bind 0.0.0.0:${PORT:-8000}
@@ -7,5 +7,5 @@ echo "Puerto: ${PORT:-8001}"
 # Crear directorio para base de datos
 mkdir -p /opt/render/project/src/data
 
-# Iniciar el servicio
-exec uvicorn servicio_recetas.app:app --host 0.0.0.0 --port ${PORT:-8001} --log-level info
+# Iniciar el servicio (un worker por CPU, ajustable con WEB_CONCURRENCY)
+exec gunicorn servicio_recetas.app:app -c gunicorn.conf.py --bind 0.0.0.0:${PORT:-8001}
@@ -4,14 +4,23 @@ Pruebas unitarias para el API Gateway
 import pytest
 import sys
 import os
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.testclient import TestClient
 from unittest.mock import patch, AsyncMock
 import httpx
+import asyncio
+import gzip
+import json
 
 # Agregar el directorio padre al path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from api_gateway.app import app
+from api_gateway import app as gateway_module
+from api_gateway.app import app, RECETAS_SERVICE_URL, INGREDIENTES_SERVICE_URL
+from api_gateway.admision import LimitadorPorCliente, ControlAdmision, Rechazado
+from api_gateway.compresion import CompresionMiddleware, negociar
+from api_gateway.balanceo import GrupoUpstream, POLITICAS
 
 @pytest.fixture
 def client():
@@ -53,6 +62,17 @@ class TestAPIGateway:
         assert "status" in data
         assert "services" in data
     
+    @patch("api_gateway.app.httpx.AsyncClient.get")
+    def test_readiness_servicios_no_disponibles(self, mock_get, client):
+        """Probar que /ready devuelve 503 si algún servicio no está listo"""
+        mock_get.side_effect = httpx.ConnectError("Connection failed")
+        
+        response = client.get("/ready")
+        assert response.status_code == 503
+        data = response.json()
+        assert data["status"] == "not_ready"
+        assert data["services"]["recetas"] == "not_ready"
+    
     @pytest.mark.asyncio
     @patch("api_gateway.app.httpx.AsyncClient.request")
     async def test_proxy_recetas_get(self, mock_request, client):
@@ -142,6 +162,83 @@ class TestAPIGateway:
         assert "recetas" in data["endpoints"]
         assert "ingredientes" in data["endpoints"]
 
+class TestModoMonolito:
+    """Pruebas del despacho ASGI en proceso (sin sockets)"""
+    
+    def test_despacho_asgi_en_proceso(self, client, monkeypatch):
+        """Probar que el gateway reenvía a una app local sin pasar por la red"""
+        servicio = FastAPI()
+        
+        @servicio.get("/recetas/{receta_id}")
+        def obtener(receta_id: int):
+            return {"id": receta_id, "nombre": "Receta local"}
+        
+        monkeypatch.setattr(
+            gateway_module, "_transportes_locales",
+            {RECETAS_SERVICE_URL: httpx.ASGITransport(app=servicio)}
+        )
+        
+        response = client.get("/api/recetas/7")
+        assert response.status_code == 200
+        assert response.json() == {"id": 7, "nombre": "Receta local"}
+        
+        # El servicio de ingredientes sigue yendo por HTTP (y no está levantado)
+        response = client.get("/api/ingredientes/")
+        assert response.status_code in [503, 504]
+    
+    def test_cookies_del_servicio_llegan_al_cliente(self, client, monkeypatch):
+        """Probar que el gateway reenvía las cookies del servicio (lectura propia) y las devuelve en la siguiente petición"""
+        servicio = FastAPI()
+        
+        @servicio.post("/recetas")
+        def crear():
+            respuesta = JSONResponse(status_code=201, content={"id": 1})
+            respuesta.set_cookie("lectura_propia", "123.000", max_age=5)
+            respuesta.set_cookie("otra", "x")
+            return respuesta
+        
+        @servicio.get("/recetas/{receta_id}")
+        def obtener(receta_id: int, request: Request):
+            return {"id": receta_id, "cookie": request.cookies.get("lectura_propia")}
+        
+        monkeypatch.setattr(
+            gateway_module, "_transportes_locales",
+            {RECETAS_SERVICE_URL: httpx.ASGITransport(app=servicio)}
+        )
+        response = client.post("/api/recetas", json={"nombre": "Pan"})
+        assert response.status_code == 201
+        assert len(response.headers.get_list("set-cookie")) == 2
+        assert client.get("/api/recetas/1").json()["cookie"] == "123.000"
+    
+    def test_monolito_arranca_los_servicios(self, tmp_path):
+        """Probar que en modo monolito corren los eventos de startup de los servicios (ejecutor de trabajos)"""
+        import subprocess
+        import textwrap
+        guion = textwrap.dedent("""
+            import time
+            from fastapi.testclient import TestClient
+            from api_gateway.app import app
+            with TestClient(app) as client:
+                trabajo = client.post("/api/jobs", json={"tipo": "exportar_recetas"}).json()
+                limite = time.monotonic() + 10
+                while time.monotonic() < limite:
+                    estado = client.get(f"/api/jobs/{trabajo['id']}").json()["estado"]
+                    if estado in ("completado", "fallido"):
+                        break
+                    time.sleep(0.1)
+                print(estado)
+        """)
+        entorno = {
+            **os.environ,
+            "GATEWAY_MODO": "monolito",
+            "DATABASE_URL": f"sqlite:///{tmp_path / 'monolito.db'}",
+            "TRABAJOS_DIR": str(tmp_path / "trabajos"),
+        }
+        raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        salida = subprocess.run([sys.executable, "-c", guion], cwd=raiz, env=entorno,
+                                capture_output=True, text=True, timeout=60)
+        assert salida.stdout.strip().splitlines()[-1] == "completado", salida.stderr
+
 class TestGatewayIntegration:
     """Pruebas de integración del gateway"""
     
@@ -154,6 +251,813 @@ class TestGatewayIntegration:
         # Verificar que los endpoints esperados están en la configuración
         assert data["endpoints"]["recetas"] == "/api/recetas"
         assert data["endpoints"]["ingredientes"] == "/api/ingredientes"
+    
+    def test_exportacion_reenviada_en_streaming(self, client, monkeypatch):
+        """Probar que el gateway reenvía la exportación NDJSON fragmento a fragmento"""
+        servicio = FastAPI()
+        
+        @servicio.get("/recetas/export")
+        def exportar():
+            def generar():
+                for i in range(3):
+                    yield f'{{"id": {i}}}\n'.encode()
+            return StreamingResponse(generar(), media_type="application/x-ndjson")
+        
+        monkeypatch.setattr(
+            gateway_module, "_transportes_locales",
+            {RECETAS_SERVICE_URL: httpx.ASGITransport(app=servicio)}
+        )
+        
+        with client.stream("GET", "/api/recetas/export") as response:
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("application/x-ndjson")
+            lineas = list(response.iter_lines())
+        assert lineas == ['{"id": 0}', '{"id": 1}', '{"id": 2}']
+    
+    def test_exportacion_servicio_no_disponible(self, client):
+        """Probar que la exportación devuelve 503 si el servicio no está levantado"""
+        response = client.get("/api/ingredientes/export")
+        assert response.status_code == 503
+
+class TestControlAdmision:
+    """Pruebas del límite de tasa por cliente y del descarte de carga"""
+    
+    def test_token_bucket_por_cliente(self):
+        """Probar que cada cliente tiene su propia ráfaga y se recarga con el tiempo"""
+        limitador = LimitadorPorCliente(tasa=1, rafaga=2)
+        assert limitador.consumir("a", ahora=0.0) == 0
+        assert limitador.consumir("a", ahora=0.0) == 0
+        assert limitador.consumir("a", ahora=0.0) == pytest.approx(1.0)
+        # Otro cliente no se ve afectado
+        assert limitador.consumir("b", ahora=0.0) == 0
+        # Tras un segundo se recarga un token
+        assert limitador.consumir("a", ahora=1.0) == 0
+    
+    def test_token_bucket_memoria_acotada(self):
+        """Probar que solo se recuerdan los clientes más recientes"""
+        limitador = LimitadorPorCliente(tasa=1, rafaga=1, max_clientes=2)
+        for clave in ["a", "b", "c"]:
+            limitador.consumir(clave, ahora=0.0)
+        assert list(limitador._cubetas) == ["b", "c"]
+    
+    def test_cola_llena_se_descarta(self):
+        """Probar que con la concurrencia y la cola llenas se rechaza con 503"""
+        async def escenario():
+            control = ControlAdmision(max_concurrencia=1, max_cola=1, objetivo_espera=1.0)
+            await control.adquirir()
+            en_espera = asyncio.ensure_future(control.adquirir())
+            await asyncio.sleep(0)
+            with pytest.raises(Rechazado) as rechazo:
+                await control.adquirir()
+            assert rechazo.value.status_code == 503
+            assert rechazo.value.retry_after >= 1
+            # Al liberar, la ranura pasa a la petición en espera
+            control.liberar()
+            await en_espera
+            assert control.en_curso == 1
+            control.liberar()
+            assert control.en_curso == 0
+        
+        asyncio.run(escenario())
+    
+    def test_espera_excesiva_activa_descarte(self):
+        """Probar que si la espera media supera el objetivo se descarta sin encolar"""
+        async def escenario():
+            control = ControlAdmision(max_concurrencia=1, max_cola=10, objetivo_espera=0.01)
+            await control.adquirir()
+            # Dos peticiones que agotan la espera máxima en cola elevan la media
+            for _ in range(2):
+                with pytest.raises(Rechazado):
+                    await control.adquirir()
+            assert control.espera_media > control.objetivo_espera
+            with pytest.raises(Rechazado) as rechazo:
+                await control.adquirir()
+            assert "reintente" in rechazo.value.detalle
+        
+        asyncio.run(escenario())
+    
+    def test_gateway_responde_429_con_retry_after(self, client, monkeypatch):
+        """Probar que el gateway corta a un cliente que supera su límite"""
+        monkeypatch.setattr(gateway_module, "limitador", LimitadorPorCliente(tasa=0.5, rafaga=1))
+        monkeypatch.setattr(gateway_module, "API_KEYS_VALIDAS", frozenset({"cliente-1", "cliente-2"}))
+        
+        primera = client.get("/api/recetas/", headers={"X-API-Key": "cliente-1"})
+        assert primera.status_code in [503, 504]
+        segunda = client.get("/api/recetas/", headers={"X-API-Key": "cliente-1"})
+        assert segunda.status_code == 429
+        assert int(segunda.headers["Retry-After"]) >= 1
+        # Otro cliente sigue siendo atendido
+        otro = client.get("/api/recetas/", headers={"X-API-Key": "cliente-2"})
+        assert otro.status_code != 429
+    
+    def test_keys_no_reconocidas_cuentan_por_ip(self, client, monkeypatch):
+        """Probar que rotar una API key desconocida no evita el límite de la IP"""
+        monkeypatch.setattr(gateway_module, "limitador", LimitadorPorCliente(tasa=0.5, rafaga=1))
+        monkeypatch.setattr(gateway_module, "API_KEYS_VALIDAS", frozenset({"cliente-1"}))
+        
+        assert client.get("/api/recetas/", headers={"X-API-Key": "rotada-1"}).status_code != 429
+        assert client.get("/api/recetas/", headers={"X-API-Key": "rotada-2"}).status_code == 429
+        assert list(gateway_module.limitador._cubetas) == ["ip:testclient"]
+        # La key reconocida tiene su propia cubeta
+        assert client.get("/api/recetas/", headers={"X-API-Key": "cliente-1"}).status_code != 429
+    
+    def test_limites_repartidos_entre_workers(self, monkeypatch):
+        """Probar que cada worker aplica su parte de los límites del gateway"""
+        monkeypatch.setattr(gateway_module, "GATEWAY_WORKERS", 4)
+        assert gateway_module.por_worker(100) == 25
+        assert gateway_module.por_worker(2) == 1
+        assert gateway_module.por_worker(0) == 0
+        assert gateway_module.por_worker(1, minimo=0.001) == 0.25
+
+class TestFeedCambios:
+    """Pruebas del feed de cambios combinado del gateway"""
+    
+    def test_mezcla_ordenada_por_seq(self, client, monkeypatch):
+        """Probar que el gateway mezcla los feeds de ambos servicios por seq"""
+        def servicio_con(eventos):
+            servicio = FastAPI()
+            
+            @servicio.get("/cambios")
+            def cambios(desde: int = 0, limit: int = 100):
+                seleccion = [e for e in eventos if e["seq"] > desde][:limit]
+                return {"cambios": seleccion, "ultimo_seq": seleccion[-1]["seq"] if seleccion else desde}
+            return servicio
+        
+        recetas = [{"seq": s, "entidad": "receta"} for s in (1, 2, 5, 6)]
+        ingredientes = [{"seq": s, "entidad": "ingrediente"} for s in (3, 4, 7)]
+        monkeypatch.setattr(gateway_module, "_transportes_locales", {
+            RECETAS_SERVICE_URL: httpx.ASGITransport(app=servicio_con(recetas)),
+            INGREDIENTES_SERVICE_URL: httpx.ASGITransport(app=servicio_con(ingredientes)),
+        })
+        
+        response = client.get("/api/cambios?desde=1&limit=4")
+        assert response.status_code == 200
+        data = response.json()
+        assert [c["seq"] for c in data["cambios"]] == [2, 3, 4, 5]
+        assert data["ultimo_seq"] == 5
+    
+    def test_servicio_caido(self, client):
+        """Probar que el feed falla entero si algún servicio no responde"""
+        response = client.get("/api/cambios")
+        assert response.status_code == 503
+
+class TestCompresion:
+    """Pruebas de la compresión negociada del gateway"""
+    
+    def _servicio(self, monkeypatch, cuerpo: bytes, headers: dict = None):
+        servicio = FastAPI()
+        recibidos = {}
+        
+        @servicio.get("/recetas")
+        def listar(request: Request):
+            recibidos["accept-encoding"] = request.headers.get("accept-encoding")
+            return Response(content=cuerpo, media_type="application/json", headers=headers or {})
+        
+        monkeypatch.setattr(
+            gateway_module, "_transportes_locales",
+            {RECETAS_SERVICE_URL: httpx.ASGITransport(app=servicio)}
+        )
+        return recibidos
+    
+    def test_negociacion_con_valores_q(self):
+        """Probar la elección de codificación según Accept-Encoding"""
+        disponibles = ["zstd", "br", "gzip"]
+        assert negociar("gzip, br", disponibles) == "br"
+        assert negociar("gzip;q=1.0, br;q=0.5", disponibles) == "gzip"
+        assert negociar("*;q=0.3, zstd;q=0", disponibles) == "br"
+        assert negociar("identity", disponibles) is None
+        assert negociar("gzip;q=0", ["gzip"]) is None
+        assert negociar("", disponibles) is None
+    
+    def test_comprime_solo_sobre_el_umbral(self, client, monkeypatch):
+        """Probar que las respuestas grandes se comprimen con gzip y las pequeñas no"""
+        grande = json.dumps([{"id": i, "descripcion": "Mezclar y hornear " * 10} for i in range(50)]).encode()
+        recibidos = self._servicio(monkeypatch, grande)
+        
+        response = client.get("/api/recetas/", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["vary"]
+        assert int(response.headers["content-length"]) < len(grande)
+        assert response.content == grande
+        
+        response = client.get("/api/recetas/", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+        assert recibidos["accept-encoding"] == "identity"
+        
+        self._servicio(monkeypatch, b'{"id": 1}')
+        response = client.get("/api/recetas/", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+        assert response.json() == {"id": 1}
+    
+    def test_cuerpo_ya_comprimido_no_se_recomprime(self, client, monkeypatch):
+        """Probar que un cuerpo comprimido por el microservicio se reenvía tal cual"""
+        original = json.dumps([{"id": i} for i in range(500)]).encode()
+        comprimido = gzip.compress(original)
+        recibidos = self._servicio(monkeypatch, comprimido, {"Content-Encoding": "gzip"})
+        
+        with client.stream("GET", "/api/recetas/", headers={"Accept-Encoding": "gzip"}) as response:
+            crudo = b"".join(response.iter_raw())
+        assert recibidos["accept-encoding"] == "gzip"
+        assert response.headers["content-encoding"] == "gzip"
+        assert crudo == comprimido
+    
+    def test_streaming_comprimido_por_fragmentos(self, client, monkeypatch):
+        """Probar la compresión incremental de la exportación NDJSON"""
+        servicio = FastAPI()
+        
+        @servicio.get("/recetas/export")
+        def exportar():
+            def generar():
+                for i in range(200):
+                    yield (json.dumps({"id": i, "nombre": f"Receta {i}"}) + "\n").encode()
+            return StreamingResponse(generar(), media_type="application/x-ndjson")
+        
+        monkeypatch.setattr(
+            gateway_module, "_transportes_locales",
+            {RECETAS_SERVICE_URL: httpx.ASGITransport(app=servicio)}
+        )
+        with client.stream("GET", "/api/recetas/export", headers={"Accept-Encoding": "gzip"}) as response:
+            assert response.headers["content-encoding"] == "gzip"
+            lineas = list(response.iter_lines())
+        assert len(lineas) == 200
+        assert json.loads(lineas[-1]) == {"id": 199, "nombre": "Receta 199"}
+    
+    def test_eventos_sse_y_cache_de_variantes(self):
+        """Probar que SSE no se comprime y que la caché reutiliza variantes comprimidas"""
+        interna = FastAPI()
+        cuerpo = b"x" * 5000
+        
+        @interna.get("/datos")
+        def datos():
+            return Response(content=cuerpo, media_type="text/plain")
+        
+        @interna.get("/eventos")
+        def eventos():
+            return StreamingResponse(iter([b"data: 1\n\n"] * 400), media_type="text/event-stream")
+        
+        middleware_app = CompresionMiddleware(interna, umbral=100, cache_bytes=1024 * 1024)
+        cliente = TestClient(middleware_app)
+        for _ in range(3):
+            response = cliente.get("/datos", headers={"Accept-Encoding": "gzip"})
+            assert response.headers["content-encoding"] == "gzip"
+            assert response.content == cuerpo
+        assert middleware_app.cache.aciertos == 2
+        
+        response = cliente.get("/eventos", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+
+class TestPeticionesMultiplexadas:
+    """Pruebas de POST /api/batch"""
+    
+    def _servicio(self, monkeypatch):
+        servicio = FastAPI()
+        estado = {"en_curso": 0, "maximo": 0, "recetas": {}}
+        
+        @servicio.get("/recetas/{receta_id}")
+        async def obtener(receta_id: int):
+            estado["en_curso"] += 1
+            estado["maximo"] = max(estado["maximo"], estado["en_curso"])
+            await asyncio.sleep(0.01)
+            estado["en_curso"] -= 1
+            if receta_id not in estado["recetas"]:
+                return JSONResponse(status_code=404, content={"detail": "Receta no encontrada"})
+            return estado["recetas"][receta_id]
+        
+        @servicio.post("/recetas", status_code=201)
+        async def crear(request: Request):
+            receta = {**await request.json(), "id": len(estado["recetas"]) + 1}
+            estado["recetas"][receta["id"]] = receta
+            return receta
+        
+        monkeypatch.setattr(
+            gateway_module, "_transportes_locales",
+            {RECETAS_SERVICE_URL: httpx.ASGITransport(app=servicio)}
+        )
+        return estado
+    
+    def test_lote_con_dependencias_y_estado_por_peticion(self, client, monkeypatch):
+        """Probar que cada subpetición devuelve su status y que las dependencias se respetan"""
+        self._servicio(monkeypatch)
+        response = client.post("/api/batch", json={"peticiones": [
+            {"id": "leer", "ruta": "/api/recetas/1", "depende_de": ["crear"]},
+            {"id": "crear", "metodo": "POST", "ruta": "/api/recetas/", "cuerpo": {"nombre": "Sopa"}},
+            {"id": "faltante", "ruta": "/api/recetas/99"},
+            {"id": "omitida", "ruta": "/api/recetas/1", "depende_de": ["faltante"]},
+        ]})
+        assert response.status_code == 200
+        resultados = response.json()["resultados"]
+        assert [r["id"] for r in resultados] == ["leer", "crear", "faltante", "omitida"]
+        assert resultados[0] == {"id": "leer", "status": 200, "cuerpo": {"nombre": "Sopa", "id": 1}}
+        assert resultados[1]["status"] == 201
+        assert resultados[2]["status"] == 404
+        assert resultados[3]["status"] == 424
+    
+    def test_limite_de_concurrencia(self, client, monkeypatch):
+        """Probar que no se superan BATCH_MAX_CONCURRENCIA subpeticiones en curso"""
+        estado = self._servicio(monkeypatch)
+        estado["recetas"][1] = {"id": 1}
+        monkeypatch.setattr(gateway_module, "BATCH_MAX_CONCURRENCIA", 3)
+        response = client.post("/api/batch", json={"peticiones": [
+            {"id": str(i), "ruta": "/api/recetas/1"} for i in range(12)
+        ]})
+        assert all(r["status"] == 200 for r in response.json()["resultados"])
+        assert 1 < estado["maximo"] <= 3
+    
+    def test_lotes_invalidos(self, client):
+        """Probar ciclos, dependencias desconocidas, rutas no permitidas (también las de streaming) y tamaño máximo"""
+        invalidos = [
+            [{"id": "a", "ruta": "/api/recetas/1", "depende_de": ["b"]},
+             {"id": "b", "ruta": "/api/recetas/2", "depende_de": ["a"]}],
+            [{"id": "a", "ruta": "/api/recetas/1", "depende_de": ["x"]}],
+            [{"id": "a", "ruta": "/api/batch", "metodo": "POST"}],
+            [{"id": "a", "ruta": "/health"}],
+            [{"id": "a", "ruta": "/api/eventos?desde=0"}],
+            [{"id": "a", "ruta": "/api/recetas/export"}],
+            [{"id": "a", "ruta": "/api/ingredientes/export/"}],
+            [{"id": "a", "ruta": "/api/jobs/1/resultado"}],
+            [{"id": "a", "ruta": "/api/recetas/../%65ventos"}],
+            [{"id": "a", "ruta": "/api/recetas/1"}, {"id": "a", "ruta": "/api/recetas/2"}],
+            [{"id": str(i), "ruta": "/api/recetas/1"} for i in range(gateway_module.BATCH_MAX_PETICIONES + 1)],
+        ]
+        for peticiones in invalidos:
+            response = client.post("/api/batch", json={"peticiones": peticiones})
+            assert response.status_code == 400, peticiones
+
+class TestBalanceo:
+    """Pruebas del reparto entre instancias, expulsión pasiva, verificación activa y lento inicio"""
+    
+    def test_reparto_por_menos_pendientes_y_p2c(self):
+        """Probar que se elige la instancia con menos peticiones en curso"""
+        grupo = GrupoUpstream(["http://a", "http://b", "http://c"], politica="menos_pendientes", semilla=1)
+        a, b, c = grupo.instancias
+        a.en_curso, b.en_curso, c.en_curso = 3, 1, 2
+        assert grupo.elegir() is b
+        
+        # p2c: de cada par elegido al azar gana la menos cargada, nunca la más cargada
+        grupo = GrupoUpstream(["http://a", "http://b", "http://c"], politica="p2c", semilla=1)
+        grupo.instancias[0].en_curso = 10
+        elegidas = {grupo.elegir().url for _ in range(50)}
+        assert elegidas == {"http://b", "http://c"}
+        
+        assert grupo.reescribir("http://a/recetas/1", grupo.instancias[2]) == "http://c/recetas/1"
+        with pytest.raises(ValueError):
+            GrupoUpstream(["http://a"], politica="aleatoria")
+    
+    def test_expulsion_pasiva_y_lento_inicio(self):
+        """Probar la expulsión tras errores seguidos, su fin y la carga gradual al volver"""
+        grupo = GrupoUpstream(["http://a", "http://b"], politica="menos_pendientes", max_fallos=3,
+                              expulsion=10, lento_inicio=20, semilla=1)
+        a, b = grupo.instancias
+        for _ in range(3):
+            grupo.registrar(a, 0.01, fallo=True, ahora=100)
+        assert not a.disponible(105)
+        assert all(grupo.elegir(ahora=105) is b for _ in range(10))
+        
+        # La última instancia disponible no se expulsa
+        for _ in range(3):
+            grupo.registrar(b, 0.01, fallo=True, ahora=105)
+        assert b.disponible(105)
+        
+        # Al volver recibe una fracción de la carga: a (peso 0.25) con 1 en curso pesa como 4 frente a los 2 de b
+        assert a.disponible(110) and a.expulsada_hasta == 110
+        a.en_curso, b.en_curso = 1, 2
+        assert grupo.elegir(ahora=115) is b
+        assert a.recuperada_en == 110 and a.peso(115, grupo.lento_inicio) == 0.25
+        assert grupo.elegir(ahora=140) is a
+        assert a.recuperada_en is None
+        a.en_curso = b.en_curso = 0
+        
+        # La segunda expulsión dura el doble
+        for _ in range(3):
+            grupo.registrar(a, 0.01, fallo=True, ahora=200)
+        assert a.expulsada_hasta == 220
+    
+    def test_lento_inicio_sin_peticiones_en_curso(self):
+        """Probar que sin carga la instancia que vuelve recibe una parte proporcional a su peso"""
+        for politica in POLITICAS:
+            grupo = GrupoUpstream(["http://a", "http://b", "http://c"], politica=politica, lento_inicio=20, semilla=3)
+            a, b, c = grupo.instancias
+            a.recuperada_en = 95  # peso 0.25 a los 100 s
+            elegidas = [grupo.elegir(ahora=100) for _ in range(4000)]
+            # 0.25 / (0.25 + 1 + 1) = 0.11
+            assert 0.08 < elegidas.count(a) / len(elegidas) < 0.14
+            assert abs(elegidas.count(b) - elegidas.count(c)) < 300
+            assert a.recuperada_en == 95
+    
+    def test_expulsion_por_latencia(self):
+        """Probar que una instancia cuya latencia media supera el máximo sale del reparto"""
+        grupo = GrupoUpstream(["http://a", "http://b"], latencia_max=0.5, semilla=1)
+        a, _ = grupo.instancias
+        grupo.registrar(a, 0.1, fallo=False, ahora=0)
+        assert a.disponible(0)
+        grupo.registrar(a, 3.0, fallo=False, ahora=0)
+        assert not a.disponible(1)
+    
+    def test_verificacion_activa(self):
+        """Probar que una instancia que falla las verificaciones se retira y vuelve con lento inicio"""
+        grupo = GrupoUpstream(["http://a", "http://b"], semilla=1)
+        a, b = grupo.instancias
+        caidas = {"http://a"}
+        
+        async def consultar(url):
+            return url not in caidas
+        
+        asyncio.run(grupo.verificar(consultar, ahora=0))
+        assert a.sana
+        asyncio.run(grupo.verificar(consultar, ahora=1))
+        assert not a.sana
+        assert all(grupo.elegir(ahora=2) is b for _ in range(10))
+        
+        caidas.clear()
+        asyncio.run(grupo.verificar(consultar, ahora=3))
+        assert a.sana and a.recuperada_en == 3
+        
+        # Sin instancias sanas se reparte entre todas (modo pánico)
+        a.sana = b.sana = False
+        assert grupo.elegir(ahora=4) in (a, b)
+    
+    def test_gateway_reparte_entre_instancias(self, client, monkeypatch):
+        """Probar que el gateway reparte entre instancias y deja de usar la que falla"""
+        def servicio(nombre, status=200):
+            app_servicio = FastAPI()
+            
+            @app_servicio.get("/recetas")
+            def listar():
+                return JSONResponse({"instancia": nombre}, status_code=status)
+            return app_servicio
+        
+        otra = "http://recetas-2:8001"
+        grupo = GrupoUpstream([RECETAS_SERVICE_URL, otra], max_fallos=2, semilla=3)
+        monkeypatch.setattr(gateway_module, "grupos_upstream", {
+            RECETAS_SERVICE_URL: grupo,
+            INGREDIENTES_SERVICE_URL: GrupoUpstream([INGREDIENTES_SERVICE_URL]),
+        })
+        monkeypatch.setattr(gateway_module, "_transportes_locales", {
+            RECETAS_SERVICE_URL: httpx.ASGITransport(app=servicio("primera")),
+            otra: httpx.ASGITransport(app=servicio("segunda", status=500)),
+        })
+        
+        respuestas = [client.get("/api/recetas/") for _ in range(20)]
+        # La segunda falla dos veces seguidas y queda expulsada: el resto va a la primera
+        assert sum(r.status_code == 500 for r in respuestas) == 2
+        assert {r.json()["instancia"] for r in respuestas if r.status_code == 200} == {"primera"}
+        assert [i["disponible"] for i in client.get("/health").json()["instancias"]["recetas"]] == [True, False]
+
+class TestDiagnostico:
+    """Pruebas de /debug/profile y /debug/memoria"""
+    
+    def test_desactivado_sin_token(self, client, monkeypatch):
+        """Probar que sin DEBUG_TOKEN los endpoints no existen y con él exigen el header"""
+        monkeypatch.delenv("DEBUG_TOKEN", raising=False)
+        assert client.get("/debug/memoria").status_code == 404
+        assert client.get("/debug/profile", headers={"X-Debug-Token": "x"}).status_code == 404
+        
+        monkeypatch.setenv("DEBUG_TOKEN", "secreto")
+        assert client.get("/debug/memoria").status_code == 403
+        assert client.get("/debug/memoria", headers={"X-Debug-Token": "otro"}).status_code == 403
+        assert client.get("/debug/profile?segundos=0", headers={"X-Debug-Token": "secreto"}).status_code == 400
+    
+    def test_perfil_en_formato_collapsed(self, client, monkeypatch):
+        """Probar que el perfil captura la pila de un hilo ocupado"""
+        import threading
+        monkeypatch.setenv("DEBUG_TOKEN", "secreto")
+        detener = threading.Event()
+        
+        def calculo_costoso():
+            while not detener.is_set():
+                sum(range(1000))
+        
+        hilo = threading.Thread(target=calculo_costoso, name="ocupado")
+        hilo.start()
+        try:
+            response = client.get("/debug/profile?segundos=0.3&intervalo_ms=2", headers={"X-Debug-Token": "secreto"})
+        finally:
+            detener.set()
+            hilo.join()
+        assert response.status_code == 200
+        assert int(response.headers["X-Muestras"]) > 0
+        lineas = response.text.splitlines()
+        pila, cantidad = next(linea for linea in lineas if linea.startswith("ocupado;")).rsplit(" ", 1)
+        assert "calculo_costoso (test_gateway.py:" in pila
+        assert int(cantidad) > 0
+    
+    def test_memoria(self, client, monkeypatch):
+        """Probar que tracemalloc se activa en la primera llamada y luego informa los mayores puntos"""
+        import tracemalloc
+        monkeypatch.setenv("DEBUG_TOKEN", "secreto")
+        headers = {"X-Debug-Token": "secreto"}
+        try:
+            primera = client.get("/debug/memoria", headers=headers).json()
+            assert primera["tracemalloc"]["activo"]
+            datos = client.get("/debug/memoria?top=5", headers=headers).json()
+            assert not datos["tracemalloc"]["recien_iniciado"]
+            assert len(datos["tracemalloc"]["top"]) <= 5
+            assert {"sesiones", "objetos", "por_modelo"} <= set(datos["identity_map"])
+            assert client.get("/debug/memoria?detener=true", headers=headers).json()["tracemalloc"] == {"activo": False}
+        finally:
+            tracemalloc.stop()
+
+class TestTrabajos:
+    """Pruebas del proxy de la cola de trabajos"""
+    
+    def test_proxy_de_trabajos(self, client, monkeypatch):
+        """Probar que /api/jobs llega al servicio de recetas con la URL del gateway y que subida y descarga van en streaming"""
+        servicio = FastAPI()
+        recibidos = []
+        
+        @servicio.post("/jobs")
+        async def crear(request: Request):
+            recibidos.append(await request.json())
+            return JSONResponse(status_code=202, content={"id": 1, "estado": "pendiente", "url": "/jobs/1"})
+        
+        @servicio.post("/jobs/importar")
+        async def importar(request: Request):
+            recibidos.append(b"".join([fragmento async for fragmento in request.stream()]))
+            return JSONResponse(status_code=202, content={"id": 2, "estado": "pendiente", "url": "/jobs/2"})
+        
+        @servicio.get("/jobs/{trabajo_id}")
+        def obtener(trabajo_id: int):
+            return {"id": trabajo_id, "estado": "completado", "progreso": 1.0}
+        
+        @servicio.get("/jobs/{trabajo_id}/resultado")
+        def resultado(trabajo_id: int):
+            return StreamingResponse((b'{"id": %d}\n' % i for i in range(3)), media_type="application/x-ndjson")
+        
+        monkeypatch.setattr(gateway_module, "_transportes_locales", {
+            RECETAS_SERVICE_URL: httpx.ASGITransport(app=servicio),
+        })
+        response = client.post("/api/jobs", json={"tipo": "exportar_recetas"}, headers={"Accept-Encoding": "gzip"})
+        assert (response.status_code, response.json()["id"]) == (202, 1)
+        # La URL anunciada es la del gateway, no la del servicio
+        assert response.json()["url"] == "/api/jobs/1"
+        # La subida se reenvía en streaming, fragmento a fragmento
+        subida = client.post("/api/jobs/importar", content=(linea for linea in [b'{"nombre": "Pan"}\n', b'{"nombre": "Sopa"}\n']))
+        assert subida.json() == {"id": 2, "estado": "pendiente", "url": "/api/jobs/2"}
+        assert recibidos == [{"tipo": "exportar_recetas"}, b'{"nombre": "Pan"}\n{"nombre": "Sopa"}\n']
+        assert client.get("/api/jobs/1").json()["estado"] == "completado"
+        descarga = client.get("/api/jobs/1/resultado")
+        assert descarga.headers["content-type"] == "application/x-ndjson"
+        assert len(descarga.text.splitlines()) == 3
+
+class TestEventos:
+    """Pruebas del stream SSE de cambios"""
+    
+    @staticmethod
+    def registro_falso(eventos):
+        """consultar(desde, limite) sobre una lista de eventos, como /api/cambios"""
+        async def consultar(desde, limite):
+            seleccion = [e for e in eventos if e["seq"] > desde][:limite]
+            return {
+                "cambios": seleccion,
+                "ultimo_seq": seleccion[-1]["seq"] if seleccion else desde,
+                "seq_actual": eventos[-1]["seq"] if eventos else 0
+            }
+        return consultar
+    
+    @staticmethod
+    def evento(seq, entidad="receta"):
+        return {"seq": seq, "entidad": entidad, "entidad_id": seq, "operacion": "crear"}
+    
+    def test_difusion_reanudacion_y_desborde(self):
+        """Probar el reparto a varios clientes, Last-Event-ID, clientes lentos y latidos"""
+        from api_gateway.eventos import DifusorEventos
+        
+        async def escenario():
+            registro = [self.evento(1), self.evento(2)]
+            difusor = DifusorEventos(self.registro_falso(registro), intervalo=0.01, tamano_cola=2,
+                                     historial=3, latido=0.2)
+            
+            async def ids(flujo, cantidad):
+                async def leer():
+                    recibidos = []
+                    while len(recibidos) < cantidad:
+                        bloque = await flujo.__anext__()
+                        if bloque.startswith(b"id: "):
+                            recibidos.append(int(bloque.split(b"\n")[0][4:]))
+                    return recibidos
+                return await asyncio.wait_for(leer(), 2)
+            
+            a = difusor.flujo()
+            assert (await a.__anext__()).startswith(b"retry: ")
+            # El primer cliente arranca el sondeo, que se posiciona al final del registro
+            await asyncio.sleep(0.05)
+            assert difusor.ultimo_seq == 2
+            registro.extend([self.evento(3), self.evento(4, "ingrediente")])
+            assert await ids(a, 2) == [3, 4]
+            
+            # Reconexión con Last-Event-ID anterior al inicio del historial: el hueco se pide al origen
+            b = difusor.flujo(ultimo_id=1, entidades=["receta"])
+            assert await ids(b, 2) == [2, 3]
+            assert difusor.clientes == 2
+            
+            # `a` no lee mientras llegan 5 eventos: su cola se desborda y se pone al día en orden
+            registro.extend(self.evento(seq) for seq in range(5, 10))
+            await asyncio.sleep(0.1)
+            assert difusor.suscripciones and any(s.desbordada for s in difusor.suscripciones)
+            assert await ids(a, 5) == [5, 6, 7, 8, 9]
+            assert await asyncio.wait_for(a.__anext__(), 2) == b": latido\n\n"
+            
+            await a.aclose()
+            await b.aclose()
+            assert difusor.clientes == 0 and difusor._tarea is None
+        
+        asyncio.run(escenario())
+    
+    def test_sin_clientes_se_olvida_la_posicion(self):
+        """Probar que quien llega tras irse todos espera al nuevo sondeo en vez de partir de la posición vieja"""
+        from api_gateway.eventos import DifusorEventos
+        
+        async def escenario():
+            registro = [self.evento(seq) for seq in range(1, 10)]
+            sobre_registro = self.registro_falso(registro)
+            
+            async def consultar(desde, limite):
+                # El origen tarda: el nuevo sondeo no se posiciona antes de que el cliente empiece a leer
+                await asyncio.sleep(0.02)
+                return await sobre_registro(desde, limite)
+            
+            difusor = DifusorEventos(consultar, intervalo=0.01)
+            a = difusor.flujo()
+            await a.__anext__()
+            await asyncio.sleep(0.1)
+            assert difusor.ultimo_seq == 9
+            await a.aclose()
+            assert difusor.ultimo_seq is None and not difusor._posicionado.is_set()
+            
+            # El registro se recrea mientras no hay clientes: el nuevo cliente parte de su final actual
+            registro[:] = [self.evento(1)]
+            b = difusor.flujo()
+            await b.__anext__()
+            siguiente = asyncio.ensure_future(b.__anext__())
+            await asyncio.sleep(0.1)
+            registro.append(self.evento(2))
+            assert (await asyncio.wait_for(siguiente, 2)).startswith(b"id: 2\n")
+            await b.aclose()
+        
+        asyncio.run(escenario())
+    
+    def test_endpoint_sse(self, client, monkeypatch):
+        """Probar el endpoint: cabeceras, reanudación por header y cierre tras la duración máxima"""
+        from api_gateway.eventos import DifusorEventos
+        registro = [self.evento(1), self.evento(2), self.evento(3, "paso")]
+        monkeypatch.setattr(gateway_module, "difusor_eventos", DifusorEventos(
+            self.registro_falso(registro), intervalo=0.01, duracion_max=0.3
+        ))
+        response = client.get("/api/eventos", headers={"Last-Event-ID": "1", "Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert "content-encoding" not in response.headers
+        bloques = [bloque for bloque in response.text.split("\n\n") if bloque.startswith("id: ")]
+        assert [json.loads(bloque.split("data: ", 1)[1])["seq"] for bloque in bloques] == [2, 3]
+        
+        assert client.get("/api/eventos?entidades=receta,usuario").status_code == 400
+        assert client.get("/api/eventos", headers={"Last-Event-ID": "x"}).status_code == 400
+
+class TestCacheCompartida:
+    """Pruebas de la caché compartida de respuestas"""
+    
+    def test_refresco_temprano_y_fallos(self):
+        """Probar XFetch (vence antes lo caro de calcular) y que una caché caída no hace fallar la lectura"""
+        import socket
+        from comun.cache import CacheCompartida, CacheMemoria, CacheRedis
+        cache = CacheCompartida(CacheMemoria(), ttl=10, semilla=7)
+        version = cache.version("recetas")
+        cache.guardar("recetas", version, {"barata": b"1"}, delta=0.01)
+        cache.guardar("recetas", version, {"cara": b"2"}, delta=100)
+        lecturas = [cache.leer("recetas", ["barata", "cara"])[0] for _ in range(200)]
+        assert all(encontrados.get("barata") == b"1" for encontrados in lecturas)
+        assert sum("cara" in encontrados for encontrados in lecturas) < 50
+        
+        cache.invalidar("recetas")
+        assert cache.leer("recetas", ["barata"]) == ({}, version + 1)
+        calculos = []
+        assert cache.obtener("recetas", "x", lambda: calculos.append(1) or b"x") == b"x"
+        assert cache.obtener("recetas", "x", lambda: calculos.append(1) or b"x") == b"x"
+        assert calculos == [1]
+        
+        with socket.socket() as libre:
+            libre.bind(("127.0.0.1", 0))
+            puerto = libre.getsockname()[1]
+        caida = CacheCompartida(CacheRedis("127.0.0.1", puerto, timeout=0.1))
+        try:
+            assert caida.obtener_varios("recetas", ["a", "b"], lambda faltantes: {c: c.encode() for c in faltantes}) == {"a": b"a", "b": b"b"}
+            caida.invalidar("recetas")
+            assert caida.errores == 2
+        finally:
+            caida.almacenamiento.cerrar()
+    
+    def test_suscripcion_en_el_primer_uso_y_tras_fork(self):
+        """Probar que la suscripción a invalidaciones se abre al usarse y que un hijo de fork abre la suya sin heredar el pool"""
+        import os
+        import time
+        from comun.cache import CacheCompartida, CacheRedis, ServidorRESP
+        servidor = ServidorRESP().iniciar()
+        cache, otra = (CacheCompartida(CacheRedis.desde_url(servidor.url), ttl_version=3600) for _ in range(2))
+        try:
+            # Creada al importar (como en el master de gunicorn) todavía no escucha
+            assert cache.almacenamiento._suscripciones == []
+            cache.version("recetas")
+            assert cache.almacenamiento._libres
+            
+            lectura, escritura = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                resultado = b"0"
+                try:
+                    heredadas = len(cache.almacenamiento._libres)
+                    cache.version("recetas")
+                    limite = time.monotonic() + 5
+                    while not cache.almacenamiento._suscripciones and time.monotonic() < limite:
+                        time.sleep(0.01)
+                    os.write(escritura, b"listo")
+                    while cache.version("recetas") != 1 and time.monotonic() < limite:
+                        time.sleep(0.01)
+                    resultado = b"1" if heredadas == 0 and cache.version("recetas") == 1 else b"0"
+                finally:
+                    os.write(escritura, resultado)
+                    os._exit(0)
+            os.close(escritura)
+            assert os.read(lectura, 5) == b"listo"
+            otra.invalidar("recetas")
+            # El hijo solo ve la nueva versión si recibió el mensaje: la relectura tarda una hora
+            assert os.read(lectura, 1) == b"1"
+            os.close(lectura)
+            os.waitpid(pid, 0)
+        finally:
+            cache.almacenamiento.cerrar()
+            otra.almacenamiento.cerrar()
+            servidor.detener()
+    
+    def test_gateway_cachea_get_e_invalida_con_escrituras(self, client, monkeypatch):
+        """Probar HIT/MISS en el gateway y que una escritura del servicio invalida la respuesta cacheada"""
+        from comun.cache import CacheCompartida, CacheMemoria
+        cache = CacheCompartida(CacheMemoria())
+        servicio = FastAPI()
+        recetas = ["Pan"]
+        llamadas = []
+        
+        @servicio.get("/recetas")
+        def listar(request: Request):
+            llamadas.append(str(request.query_params))
+            return [{"nombre": nombre} for nombre in recetas]
+        
+        @servicio.get("/recetas/{receta_id}")
+        def obtener(receta_id: int):
+            return JSONResponse(status_code=404, content={"detail": "Receta no encontrada"})
+        
+        @servicio.post("/recetas")
+        async def crear(request: Request):
+            recetas.append((await request.json())["nombre"])
+            # Como el servicio real con la misma CACHE_URL
+            cache.invalidar("recetas", "ingredientes")
+            return JSONResponse(status_code=201, content={"id": len(recetas)})
+        
+        monkeypatch.setattr(gateway_module, "cache_gateway", cache)
+        monkeypatch.setattr(gateway_module, "_transportes_locales", {
+            RECETAS_SERVICE_URL: httpx.ASGITransport(app=servicio),
+        })
+        primera = client.get("/api/recetas?limit=5&orden=nombre")
+        assert (primera.headers["x-cache"], primera.json()) == ("MISS", [{"nombre": "Pan"}])
+        segunda = client.get("/api/recetas?orden=nombre&limit=5", headers={"Accept-Encoding": "gzip"})
+        assert (segunda.headers["x-cache"], segunda.json()) == ("HIT", [{"nombre": "Pan"}])
+        assert client.get("/api/recetas/9").status_code == client.get("/api/recetas/9").status_code == 404
+        
+        assert client.post("/api/recetas", json={"nombre": "Pizza"}).status_code == 201
+        tercera = client.get("/api/recetas?limit=5&orden=nombre")
+        assert (tercera.headers["x-cache"], tercera.json()) == ("MISS", [{"nombre": "Pan"}, {"nombre": "Pizza"}])
+        assert len(llamadas) == 2
+
+class TestEstadisticas:
+    """Pruebas del endpoint de estadísticas del gateway"""
+    
+    def test_combina_ambos_servicios(self, client, monkeypatch):
+        """Probar que /api/estadisticas une las estadísticas de recetas e ingredientes"""
+        recetas, ingredientes = FastAPI(), FastAPI()
+        
+        @recetas.get("/estadisticas")
+        def de_recetas(top: int = 10):
+            return {"recetas": 3, "ingredientes_mas_usados": [{"ingrediente_id": 1, "nombre": "Harina", "num_recetas": 3}][:top]}
+        
+        @ingredientes.get("/estadisticas")
+        def de_ingredientes(ids: str = ""):
+            respuesta = {"ingredientes": 2, "ingredientes_por_categoria": {"harinas": 1}}
+            if ids:
+                respuesta["recetas_por_ingrediente"] = {valor: 3 for valor in ids.split(",")}
+            return respuesta
+        
+        monkeypatch.setattr(gateway_module, "_transportes_locales", {
+            RECETAS_SERVICE_URL: httpx.ASGITransport(app=recetas),
+            INGREDIENTES_SERVICE_URL: httpx.ASGITransport(app=ingredientes),
+        })
+        assert client.get("/api/estadisticas?top=1&ids=1").json() == {
+            "recetas": 3,
+            "ingredientes_mas_usados": [{"ingrediente_id": 1, "nombre": "Harina", "num_recetas": 3}],
+            "ingredientes": 2,
+            "ingredientes_por_categoria": {"harinas": 1},
+            "recetas_por_ingrediente": {"1": 3}
+        }
+        assert "recetas_por_ingrediente" not in client.get("/api/estadisticas").json()
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -4,6 +4,8 @@ Pruebas unitarias para el microservicio de Ingredientes
 import pytest
 import sys
 import os
+import json
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -12,7 +14,10 @@ from sqlalchemy.orm import sessionmaker
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from servicio_ingredientes.app import app
-from database import Base, get_db
+from database import Base, get_db, init_db, Ingrediente, EscritorPorLotes, Receta, RecetaIngrediente, RecetaResumen
+from database import recalcular_resumenes
+from database.resumen import bits_categorias
+from database import lotes
 
 # Configurar base de datos de prueba en memoria
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test_ingredientes.db"
@@ -50,6 +55,20 @@ class TestIngredientesEndpoints:
         assert response.json()["status"] == "healthy"
         assert response.json()["service"] == "ingredientes"
     
+    def test_readiness_requiere_esquema(self, client):
+        """Probar que /ready solo responde 200 cuando el esquema está inicializado"""
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["status"] == "not_ready"
+        
+        assert init_db(engine) is True
+        response = client.get("/ready")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
+        
+        # Con el marcador de versión al día no se vuelve a crear el esquema
+        assert init_db(engine) is False
+    
     def test_crear_ingrediente(self, client):
         """Probar creación de un ingrediente"""
         ingrediente_data = {
@@ -266,6 +285,192 @@ class TestIngredientesEndpoints:
         response = client.get("/ingredientes/buscar/CHOCOLATE")
         assert response.status_code == 200
         assert len(response.json()) == 1
+    
+    def test_exportar_ingredientes_ndjson(self, client):
+        """Probar la exportación completa de ingredientes en NDJSON"""
+        for nombre in ["Sal", "Pimienta", "Aceite"]:
+            client.post("/ingredientes", json={"nombre": nombre, "categoria": "condimentos"})
+        
+        response = client.get("/ingredientes/export")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lineas = [json.loads(linea) for linea in response.text.splitlines()]
+        assert [ingrediente["nombre"] for ingrediente in lineas] == ["Sal", "Pimienta", "Aceite"]
+        assert lineas[0]["categoria"] == "condimentos"
+    
+    def test_cambios_de_ingredientes(self, client):
+        """Probar el feed de cambios del servicio de ingredientes"""
+        ingrediente_id = client.post("/ingredientes", json={"nombre": "Miel"}).json()["id"]
+        client.put(f"/ingredientes/{ingrediente_id}", json={"categoria": "endulzantes"})
+        client.delete(f"/ingredientes/{ingrediente_id}")
+        
+        data = client.get("/cambios").json()
+        assert [c["operacion"] for c in data["cambios"]] == ["crear", "actualizar", "eliminar"]
+        assert all(c["entidad"] == "ingrediente" for c in data["cambios"])
+        assert data["cambios"][1]["datos"]["categoria"] == "endulzantes"
+        assert data["cambios"][2]["datos"] is None
+
+    
+    def test_cambio_de_categoria_actualiza_resumen_de_recetas(self, client):
+        """Probar que cambiar la categoría de un ingrediente recalcula la máscara de sus recetas"""
+        ingrediente_id = client.post("/ingredientes", json={"nombre": "Queso", "categoria": "lácteos"}).json()["id"]
+        db = TestingSessionLocal()
+        db.add(Receta(id=1, nombre="Pizza"))
+        db.add(RecetaIngrediente(receta_id=1, ingrediente_id=ingrediente_id, cantidad=1))
+        db.flush()
+        recalcular_resumenes(db, [1])
+        db.commit()
+        
+        client.put(f"/ingredientes/{ingrediente_id}", json={"categoria": "quesos"})
+        db.expire_all()
+        bits = bits_categorias(db, ["lácteos", "quesos"], asignar=False)
+        resumen = db.get(RecetaResumen, 1)
+        assert resumen.num_ingredientes == 1
+        assert resumen.mascara_categorias == 1 << bits["quesos"]
+        db.close()
+    
+    def test_campos_e_incluir_en_ingredientes(self, client):
+        """Probar ?fields= e ?incluir=recetas en el listado y el detalle de ingredientes"""
+        ingrediente_id = client.post("/ingredientes", json={"nombre": "Leche", "unidad_medida": "ml", "categoria": "lácteos"}).json()["id"]
+        db = TestingSessionLocal()
+        db.add(Receta(id=1, nombre="Flan"))
+        db.add(RecetaIngrediente(receta_id=1, ingrediente_id=ingrediente_id, cantidad=500))
+        db.commit()
+        db.close()
+        
+        assert client.get("/ingredientes?fields=nombre").json() == [{"nombre": "Leche"}]
+        assert set(client.get("/ingredientes").json()[0]) == {"id", "nombre", "unidad_medida", "categoria"}
+        
+        detalle = client.get(f"/ingredientes/{ingrediente_id}?fields=id,nombre&incluir=recetas").json()
+        assert detalle == {
+            "id": ingrediente_id,
+            "nombre": "Leche",
+            "recetas": [{"receta_id": 1, "cantidad": 500.0, "nombre_receta": "Flan"}]
+        }
+        assert client.get("/ingredientes?fields=precio").status_code == 400
+        assert client.get("/ingredientes/999?fields=nombre").status_code == 404
+    
+    def test_campos_e_incluir_con_cache(self, client, monkeypatch):
+        """Probar que con la caché compartida las respuestas no cambian y las escrituras la invalidan"""
+        from servicio_ingredientes import app as app_module
+        from comun.cache import CacheCompartida, CacheMemoria
+        cache = CacheCompartida(CacheMemoria())
+        monkeypatch.setattr(app_module, "cache", cache)
+        self.test_campos_e_incluir_en_ingredientes(client)
+        ingrediente_id = client.get("/ingredientes").json()[0]["id"]
+        assert client.get("/ingredientes?fields=nombre").json() == [{"nombre": "Leche"}]
+        assert cache.aciertos > 0
+        
+        client.put(f"/ingredientes/{ingrediente_id}", json={"nombre": "Leche entera"})
+        assert client.get("/ingredientes?fields=nombre").json() == [{"nombre": "Leche entera"}]
+        assert client.get(f"/ingredientes/{ingrediente_id}?fields=nombre").json() == {"nombre": "Leche entera"}
+    
+    def test_estadisticas_de_ingredientes(self, client):
+        """Probar los contadores por categoría y de recetas por ingrediente frente a una reconstrucción"""
+        from database.estadisticas import reconstruir_estadisticas
+        ids = {
+            nombre: client.post("/ingredientes", json={"nombre": nombre, "categoria": categoria}).json()["id"]
+            for nombre, categoria in [("Leche", "lácteos"), ("Queso", "lácteos"), ("Sal", None), ("Tofu", "proteínas")]
+        }
+        client.put(f"/ingredientes/{ids['Queso']}", json={"categoria": "quesos"})
+        client.put(f"/ingredientes/{ids['Sal']}", json={"categoria": "condimentos"})
+        client.delete("/ingredientes?categoria=proteínas")
+        client.delete(f"/ingredientes/{ids['Leche']}")
+        
+        estadisticas = client.get(f"/estadisticas?ids={ids['Queso']},{ids['Sal']}").json()
+        assert estadisticas == {
+            "ingredientes": 2,
+            "ingredientes_por_categoria": {"condimentos": 1, "quesos": 1},
+            "recetas_por_ingrediente": {str(ids["Queso"]): 0, str(ids["Sal"]): 0}
+        }
+        # Las recetas las cuenta el servicio de recetas: aquí se insertan a mano y se reconstruye
+        db = TestingSessionLocal()
+        db.add(Receta(id=1, nombre="Fondue"))
+        db.add(RecetaIngrediente(receta_id=1, ingrediente_id=ids["Queso"], cantidad=200))
+        db.flush()
+        reconstruir_estadisticas(db)
+        db.commit()
+        db.close()
+        estadisticas["recetas_por_ingrediente"][str(ids["Queso"])] = 1
+        assert client.get(f"/estadisticas?ids={ids['Queso']},{ids['Sal']}").json() == estadisticas
+        assert client.get("/estadisticas?ids=a").status_code == 400
+    
+    def test_eliminar_ingrediente_en_uso(self, client):
+        """Probar que un ingrediente usado por una receta no se puede borrar (ni uno a uno ni en bloque)"""
+        usado = client.post("/ingredientes", json={"nombre": "Huevo", "categoria": "proteínas"}).json()["id"]
+        libre = client.post("/ingredientes", json={"nombre": "Tofu", "categoria": "proteínas"}).json()["id"]
+        otro = client.post("/ingredientes", json={"nombre": "Sal", "categoria": "condimentos"}).json()["id"]
+        db = TestingSessionLocal()
+        db.add(Receta(id=1, nombre="Tortilla"))
+        db.add(RecetaIngrediente(receta_id=1, ingrediente_id=usado, cantidad=3))
+        db.commit()
+        
+        response = client.delete(f"/ingredientes/{usado}")
+        assert response.status_code == 409
+        assert client.get(f"/ingredientes/{usado}").status_code == 200
+        
+        assert client.delete("/ingredientes").status_code == 400
+        response = client.delete("/ingredientes?categoria=proteínas")
+        assert response.json() == {"eliminados": 1, "ids": [libre], "en_uso": [usado]}
+        response = client.delete(f"/ingredientes?ids={otro},999")
+        assert response.json() == {"eliminados": 1, "ids": [otro], "en_uso": []}
+        assert [i["id"] for i in client.get("/ingredientes").json()] == [usado]
+        assert db.query(RecetaIngrediente).count() == 1
+        db.close()
+
+class TestEscrituraPorLotes:
+    """Pruebas del group commit de escrituras"""
+    
+    def test_operaciones_concurrentes_se_confirman_en_lotes(self, test_db):
+        """Probar que cada operación recibe su resultado aunque se confirmen juntas"""
+        escritor = EscritorPorLotes(TestingSessionLocal, max_operaciones=50, espera_maxima=0.05)
+        
+        def crear(nombre):
+            def operacion(db):
+                if db.query(Ingrediente).filter(Ingrediente.nombre == nombre).first():
+                    raise ValueError(f"{nombre} ya existe")
+                db.add(Ingrediente(nombre=nombre))
+                db.flush()
+                return nombre
+            return operacion
+        
+        nombres = [f"Ingrediente {i}" for i in range(20)] + ["Ingrediente 0"]
+        with ThreadPoolExecutor(max_workers=len(nombres)) as pool:
+            futuros = [pool.submit(escritor.ejecutar, crear(nombre)) for nombre in nombres]
+            resultados = []
+            for futuro in futuros:
+                try:
+                    resultados.append(futuro.result())
+                except ValueError as error:
+                    resultados.append(str(error))
+        
+        # El duplicado recibe su propio error y el resto se confirma
+        assert sorted(resultados).count("Ingrediente 0") == 1
+        assert "Ingrediente 0 ya existe" in resultados
+        db = TestingSessionLocal()
+        assert db.query(Ingrediente).count() == 20
+        db.close()
+        assert escritor.lotes_confirmados < 20
+    
+    def test_endpoint_con_escritura_por_lotes(self, client, monkeypatch):
+        """Probar los endpoints de escritura pasando por el escritor por lotes"""
+        monkeypatch.setenv("ESCRITURA_POR_LOTES", "1")
+        monkeypatch.setattr(lotes, "_escritor", EscritorPorLotes(TestingSessionLocal))
+        
+        response = client.post("/ingredientes", json={"nombre": "Harina", "unidad_medida": "gramos"})
+        assert response.status_code == 201
+        ingrediente_id = response.json()["id"]
+        
+        response = client.post("/ingredientes", json={"nombre": "Harina"})
+        assert response.status_code == 400
+        
+        response = client.put(f"/ingredientes/{ingrediente_id}", json={"categoria": "harinas"})
+        assert response.status_code == 200
+        assert response.json()["categoria"] == "harinas"
+        
+        response = client.delete(f"/ingredientes/{ingrediente_id}")
+        assert response.status_code == 200
+        assert client.get(f"/ingredientes/{ingrediente_id}").status_code == 404
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -4,6 +4,7 @@ Pruebas unitarias para el microservicio de Recetas
 import pytest
 import sys
 import os
+import json
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -12,7 +13,11 @@ from sqlalchemy.orm import sessionmaker
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from servicio_recetas.app import app
-from database import Base, get_db
+from database import Base, get_db, init_db, Ingrediente, Receta, RecetaFirma, configurar_replicas, registrar_cambio
+from database.replicas import EnrutadorLecturas
+from servicio_recetas.similares import IndiceSimilitud
+from servicio_recetas.duplicados import IndiceDuplicados, firma_minhash, texto_receta
+from servicio_recetas.snapshot import SnapshotRecetas
 
 # Configurar base de datos de prueba en memoria
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test_recetas.db"
@@ -50,6 +55,20 @@ class TestRecetasEndpoints:
         assert response.json()["status"] == "healthy"
         assert response.json()["service"] == "recetas"
     
+    def test_readiness_requiere_esquema(self, client):
+        """Probar que /ready solo responde 200 cuando el esquema está inicializado"""
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["status"] == "not_ready"
+        
+        assert init_db(engine) is True
+        response = client.get("/ready")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
+        
+        # Con el marcador de versión al día no se vuelve a crear el esquema
+        assert init_db(engine) is False
+    
     def test_crear_receta_simple(self, client):
         """Probar creación de una receta simple sin pasos ni ingredientes"""
         receta_data = {
@@ -108,6 +127,46 @@ class TestRecetasEndpoints:
         data = response.json()
         assert len(data) == 2
     
+    def test_listar_recetas_coincide_con_detalle(self, client):
+        """Probar que el listado rápido devuelve la misma forma que el detalle"""
+        receta_data = {
+            "nombre": "Arroz con leche",
+            "descripcion": "Postre",
+            "tiempo_preparacion": 40,
+            "porciones": 6,
+            "pasos": [
+                {"numero_paso": 1, "descripcion": "Hervir la leche"},
+                {"numero_paso": 2, "descripcion": "Agregar el arroz"}
+            ],
+            "ingredientes": []
+        }
+        receta_id = client.post("/recetas", json=receta_data).json()["id"]
+        client.post("/recetas", json={"nombre": "Sin pasos", "pasos": [], "ingredientes": []})
+        
+        response = client.get("/recetas")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        data = response.json()
+        assert data[0] == client.get(f"/recetas/{receta_id}").json()
+        assert data[1]["pasos"] == []
+    
+    def test_exportar_recetas_ndjson(self, client):
+        """Probar la exportación completa en NDJSON con pasos e ingredientes"""
+        for i in range(3):
+            client.post("/recetas", json={
+                "nombre": f"Receta {i}",
+                "pasos": [{"numero_paso": 1, "descripcion": f"Paso de {i}"}],
+                "ingredientes": []
+            })
+        
+        response = client.get("/recetas/export")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lineas = [json.loads(linea) for linea in response.text.splitlines()]
+        assert [receta["nombre"] for receta in lineas] == ["Receta 0", "Receta 1", "Receta 2"]
+        assert lineas[2]["pasos"][0]["descripcion"] == "Paso de 2"
+        assert lineas[0]["ingredientes"] == []
+    
     def test_obtener_receta_por_id(self, client):
         """Probar obtención de una receta específica"""
         # Crear receta
@@ -227,18 +286,24 @@ class TestRecetasEndpoints:
     
     def test_crear_receta_con_ingredientes(self, client):
         """Probar creación de receta con ingredientes"""
+        # Los ingredientes deben existir en la base de datos
+        harina, azucar = self._crear_ingredientes(["harinas", "dulces"])
         receta_data = {
             "nombre": "Receta con ingredientes",
             "descripcion": "Test ingredientes",
             "pasos": [],
             "ingredientes": [
-                {"ingrediente_id": 1, "cantidad": 200.0},
-                {"ingrediente_id": 2, "cantidad": 100.0}
+                {"ingrediente_id": harina, "cantidad": 200.0},
+                {"ingrediente_id": azucar, "cantidad": 100.0}
             ]
         }
         response = client.post("/recetas", json=receta_data)
         assert response.status_code == 201
-        # Nota: Los ingredientes deben existir en la base de datos
+        
+        receta_data["ingredientes"].append({"ingrediente_id": 999, "cantidad": 1.0})
+        response = client.post("/recetas", json=receta_data)
+        assert response.status_code == 400
+        assert "999" in response.json()["detail"]
     
     def test_paginacion_recetas(self, client):
         """Probar paginación en el listado de recetas"""
@@ -261,6 +326,856 @@ class TestRecetasEndpoints:
         response = client.get("/recetas?skip=2&limit=2")
         assert response.status_code == 200
         assert len(response.json()) == 2
+    
+    def test_cambios_registrados_en_orden(self, client):
+        """Probar que cada escritura agrega un evento al feed de cambios"""
+        receta_id = client.post("/recetas", json={"nombre": "Flan", "pasos": [], "ingredientes": []}).json()["id"]
+        client.put(f"/recetas/{receta_id}", json={"porciones": 6})
+        paso_id = client.post(f"/recetas/{receta_id}/pasos", json={"numero_paso": 1, "descripcion": "Batir"}).json()["id"]
+        client.delete(f"/recetas/{receta_id}/pasos/{paso_id}")
+        client.delete(f"/recetas/{receta_id}")
+        
+        response = client.get("/cambios")
+        assert response.status_code == 200
+        data = response.json()
+        eventos = [(c["entidad"], c["operacion"]) for c in data["cambios"]]
+        assert eventos == [
+            ("receta", "crear"), ("receta", "actualizar"),
+            ("paso", "crear"), ("paso", "eliminar"), ("receta", "eliminar")
+        ]
+        assert data["cambios"][1]["datos"]["porciones"] == 6
+        assert data["cambios"][2]["datos"]["receta_id"] == receta_id
+        assert data["ultimo_seq"] == data["cambios"][-1]["seq"]
+        
+        # Lectura incremental a partir del último seq procesado
+        segundo_seq = data["cambios"][1]["seq"]
+        response = client.get(f"/cambios?desde={segundo_seq}&limit=2")
+        assert [c["operacion"] for c in response.json()["cambios"]] == ["crear", "eliminar"]
+        
+        response = client.get(f"/cambios?desde={data['ultimo_seq']}")
+        assert response.json() == {"cambios": [], "ultimo_seq": data["ultimo_seq"], "seq_actual": data["ultimo_seq"]}
+    
+    def test_cambios_por_entidad_sin_ordenar_en_memoria(self, client):
+        """Probar que cada consulta del feed sale en orden del índice (entidad, seq), sin ordenar aparte"""
+        from sqlalchemy import select
+        from database import Cambio
+        consulta = (
+            select(Cambio.seq).where(Cambio.entidad == "receta", Cambio.seq > 0, Cambio.seq <= 10)
+            .order_by(Cambio.seq).limit(10)
+        )
+        with engine.connect() as conn:
+            plan = " ".join(str(fila[-1]) for fila in conn.exec_driver_sql(
+                "EXPLAIN QUERY PLAN " + str(consulta.compile(engine, compile_kwargs={"literal_binds": True}))
+            ))
+        assert "ix_cambios_entidad_seq" in plan and "TEMP B-TREE" not in plan
+    
+    def test_cambios_recientes_esperan_el_margen(self, client, monkeypatch):
+        """Probar que con escrituras concurrentes no se entregan eventos más nuevos que el margen"""
+        from datetime import timedelta
+        from database import Cambio, SeguidorCambios, cambios
+        monkeypatch.setattr(cambios, "_escrituras_serializadas", lambda db: False)
+        monkeypatch.setattr(cambios, "MARGEN_SEGUNDOS", 60)
+        primera = client.post("/recetas", json={"nombre": "Flan"}).json()["id"]
+        seguidor = SeguidorCambios(entidades=("receta",))
+        db = TestingSessionLocal()
+        seguidor.posicionar(db)
+        
+        # Un seq menor podría estar aún sin confirmar: ni el feed ni el seguidor lo pasan
+        assert client.get("/cambios").json() == {"cambios": [], "ultimo_seq": 0, "seq_actual": 0}
+        assert seguidor.nuevos(db) == []
+        
+        for cambio in db.query(Cambio).all():
+            cambio.creado_en = cambio.creado_en - timedelta(seconds=120)
+        db.commit()
+        segunda = client.post("/recetas", json={"nombre": "Sopa"}).json()["id"]
+        data = client.get("/cambios").json()
+        assert [c["entidad_id"] for c in data["cambios"]] == [primera]
+        assert data["seq_actual"] == data["ultimo_seq"]
+        assert [evento[2] for evento in seguidor.nuevos(db)] == [primera]
+        assert segunda not in [evento[2] for evento in seguidor.nuevos(db)]
+        db.close()
+    
+    def test_cambio_no_se_registra_si_la_escritura_falla(self, client):
+        """Probar que el evento va en la misma transacción que la escritura"""
+        response = client.put("/recetas/999", json={"nombre": "No existe"})
+        assert response.status_code == 404
+        assert client.get("/cambios").json()["cambios"] == []
+    
+    def _crear_con_ingredientes(self, client, nombre, ingrediente_ids):
+        db = TestingSessionLocal()
+        # Los ingredientes son del otro servicio: se insertan los que falten
+        existentes = {fila.id for fila in db.query(Ingrediente.id)}
+        db.add_all(Ingrediente(id=i, nombre=f"ing-{i}") for i in ingrediente_ids if i not in existentes)
+        db.commit()
+        db.close()
+        response = client.post("/recetas", json={
+            "nombre": nombre,
+            "pasos": [],
+            "ingredientes": [{"ingrediente_id": i, "cantidad": 1.0} for i in ingrediente_ids]
+        })
+        return response.json()["id"]
+    
+    def test_recetas_similares(self, client):
+        """Probar los vecinos por ingredientes compartidos y su actualización incremental"""
+        a = self._crear_con_ingredientes(client, "A", [1, 2, 3])
+        b = self._crear_con_ingredientes(client, "B", [1, 2, 3, 4])
+        c = self._crear_con_ingredientes(client, "C", [1, 5])
+        self._crear_con_ingredientes(client, "D", [6])
+        
+        response = client.get(f"/recetas/{a}/similares?k=5")
+        assert response.status_code == 200
+        assert response.json() == [
+            {"receta_id": b, "nombre": "B", "similitud": 0.75},
+            {"receta_id": c, "nombre": "C", "similitud": 0.25},
+        ]
+        
+        # Las escrituras posteriores se reflejan sin reconstruir el índice
+        e = self._crear_con_ingredientes(client, "E", [1, 2, 3])
+        client.delete(f"/recetas/{b}")
+        vecinos = client.get(f"/recetas/{a}/similares?k=1").json()
+        assert vecinos == [{"receta_id": e, "nombre": "E", "similitud": 1.0}]
+        
+        coseno = client.get(f"/recetas/{a}/similares?metrica=coseno").json()
+        assert coseno[1]["receta_id"] == c
+        assert coseno[1]["similitud"] == round(1 / (3 * 2) ** 0.5, 4)
+    
+    def test_recetas_similares_errores(self, client):
+        """Probar receta inexistente y métrica no soportada"""
+        assert client.get("/recetas/999/similares").status_code == 404
+        a = self._crear_con_ingredientes(client, "A", [1])
+        assert client.get(f"/recetas/{a}/similares?metrica=otra").status_code == 400
+        assert client.get(f"/recetas/{a}/similares").json() == []
+    
+    def test_vecinos_en_lote_coinciden_con_individuales(self, client):
+        """Probar que la consulta en lote da lo mismo que las consultas sueltas"""
+        ids = [
+            self._crear_con_ingredientes(client, f"R{i}", [i % 4, i % 5 + 10, i % 3 + 20])
+            for i in range(12)
+        ]
+        db = TestingSessionLocal()
+        indice = IndiceSimilitud()
+        indice.sincronizar(db)
+        db.close()
+        lote = indice.vecinos_lote(ids, k=3)
+        for receta_id in ids:
+            assert lote[receta_id] == indice.vecinos(receta_id, k=3)
+    
+    RECETA_TORTILLA = {
+        "nombre": "Tortilla de patatas de la abuela",
+        "descripcion": "Tortilla española jugosa con cebolla",
+        "pasos": [
+            {"numero_paso": 1, "descripcion": "Pelar y cortar las patatas en láminas finas"},
+            {"numero_paso": 2, "descripcion": "Freír las patatas y la cebolla a fuego lento"},
+            {"numero_paso": 3, "descripcion": "Batir los huevos, mezclar y cuajar por ambos lados"}
+        ]
+    }
+    
+    def test_detectar_duplicados(self, client):
+        """Probar que una variante con pequeños cambios de texto se detecta como duplicada"""
+        original = client.post("/recetas", json=self.RECETA_TORTILLA).json()["id"]
+        client.post("/recetas", json={"nombre": "Gazpacho andaluz", "pasos": [
+            {"numero_paso": 1, "descripcion": "Triturar tomate, pepino y pimiento con aceite"}
+        ]})
+        
+        variante = json.loads(json.dumps(self.RECETA_TORTILLA))
+        variante["nombre"] = "Tortilla de patatas de la Abuela!"
+        variante["pasos"][1]["descripcion"] = "Freir las patatas y la cebolla a fuego lento."
+        response = client.post("/recetas/duplicados", json=variante)
+        assert response.status_code == 200
+        candidatos = response.json()
+        assert [c["receta_id"] for c in candidatos] == [original]
+        assert candidatos[0]["similitud"] >= 0.7
+        
+        distinta = {"nombre": "Bizcocho de limón", "pasos": [
+            {"numero_paso": 1, "descripcion": "Mezclar harina, azúcar y ralladura de limón"}
+        ]}
+        assert client.post("/recetas/duplicados", json=distinta).json() == []
+        assert client.post("/recetas/duplicados?umbral=2", json=distinta).status_code == 400
+    
+    def test_crear_receta_verificando_duplicados(self, client):
+        """Probar que la creación con verificar_duplicados rechaza casi duplicados con 409"""
+        original = client.post("/recetas", json=self.RECETA_TORTILLA).json()["id"]
+        
+        response = client.post("/recetas?verificar_duplicados=true", json=self.RECETA_TORTILLA)
+        assert response.status_code == 409
+        assert response.json()["duplicados"][0]["receta_id"] == original
+        
+        # Los pasos agregados después también cuentan para el texto de la receta
+        otra = client.post("/recetas?verificar_duplicados=true", json={"nombre": "Sopa"}).json()["id"]
+        client.post(f"/recetas/{otra}/pasos", json={"numero_paso": 1, "descripcion": "Hervir caldo con fideos finos"})
+        response = client.post("/recetas?verificar_duplicados=true", json={
+            "nombre": "Sopa", "pasos": [{"numero_paso": 1, "descripcion": "Hervir caldo con fideos finos"}]
+        })
+        assert response.status_code == 409
+        assert response.json()["duplicados"][0]["receta_id"] == otra
+        
+        # Sin la opción se crea igualmente
+        assert client.post("/recetas", json=self.RECETA_TORTILLA).status_code == 201
+        # El umbral se valida como en /recetas/duplicados
+        assert client.post("/recetas?verificar_duplicados=true&umbral=0", json=self.RECETA_TORTILLA).status_code == 400
+        assert client.post("/recetas?umbral=1.5", json={"nombre": "Otra"}).status_code == 400
+    
+    def test_firmas_minhash_persistidas(self, client):
+        """Probar que un índice nuevo parte de las firmas guardadas y aplica los cambios pendientes"""
+        original = client.post("/recetas", json=self.RECETA_TORTILLA).json()["id"]
+        client.post("/recetas/duplicados", json=self.RECETA_TORTILLA)
+        
+        # Cambio hecho después de persistir las firmas
+        client.put(f"/recetas/{original}", json={"nombre": "Tarta de queso", "descripcion": "Horneada"})
+        client.delete(f"/recetas/{original}/pasos/1")
+        
+        db = TestingSessionLocal()
+        indice = IndiceDuplicados()
+        indice.sincronizar(db)
+        db.close()
+        assert indice.total_recetas == 1
+        firma = firma_minhash(texto_receta(
+            self.RECETA_TORTILLA["nombre"], self.RECETA_TORTILLA["descripcion"],
+            [paso["descripcion"] for paso in self.RECETA_TORTILLA["pasos"]]
+        ))
+        assert indice.candidatos(firma) == []
+        assert indice.candidatos(firma_minhash("Tarta de queso Horneada Freír las patatas y la cebolla a fuego lento "
+                                               "Batir los huevos, mezclar y cuajar por ambos lados"))[0][0] == original
+    
+    def test_sincronizar_no_confirma_la_sesion_del_llamador(self, client):
+        """Probar que persistir las firmas no confirma lo pendiente en la sesión de la petición"""
+        client.post("/recetas", json=self.RECETA_TORTILLA)
+        db = TestingSessionLocal()
+        db.add(Ingrediente(nombre="Pendiente"))
+        indice = IndiceDuplicados()
+        indice.sincronizar(db)
+        db.rollback()
+        db.close()
+        assert indice.total_recetas == 1
+        db = TestingSessionLocal()
+        assert db.query(Ingrediente).filter_by(nombre="Pendiente").count() == 0
+        assert db.query(RecetaFirma).count() == 1
+        db.close()
+    
+    def _crear_ingredientes(self, categorias):
+        """Insertar ingredientes directamente (pertenecen a otro servicio) y devolver sus ids"""
+        db = TestingSessionLocal()
+        ingredientes = [Ingrediente(nombre=f"ing-{i}", categoria=categoria) for i, categoria in enumerate(categorias)]
+        db.add_all(ingredientes)
+        db.commit()
+        ids = [ingrediente.id for ingrediente in ingredientes]
+        db.close()
+        return ids
+    
+    def test_estadisticas_incrementales(self, client):
+        """Probar que los contadores siguen a cada alta y baja de recetas y coinciden con una reconstrucción"""
+        from database.estadisticas import reconstruir_estadisticas
+        harina, huevo, leche = self._crear_ingredientes(["harinas", "proteínas", "lácteos"])
+        recetas = {}
+        for nombre, ingredientes in [("Pan", [harina]), ("Flan", [huevo, leche, huevo]),
+                                     ("Crepe", [harina, huevo, leche]), ("Tortilla", [huevo])]:
+            recetas[nombre] = client.post("/recetas", json={
+                "nombre": nombre,
+                "ingredientes": [{"ingrediente_id": i, "cantidad": 1.0} for i in ingredientes]
+            }).json()["id"]
+        
+        estadisticas = client.get("/estadisticas?top=2").json()
+        assert estadisticas["recetas"] == 4
+        assert [(i["nombre"], i["num_recetas"]) for i in estadisticas["ingredientes_mas_usados"]] == [
+            ("ing-1", 3), ("ing-2", 2)
+        ]
+        
+        client.delete(f"/recetas/{recetas['Flan']}")
+        client.delete("/recetas/999")
+        client.delete(f"/recetas?ids={recetas['Pan']},{recetas['Tortilla']}")
+        estadisticas = client.get("/estadisticas").json()
+        assert estadisticas == {
+            "recetas": 1,
+            "ingredientes_mas_usados": [
+                {"ingrediente_id": i, "nombre": f"ing-{n}", "num_recetas": 1}
+                for n, i in reversed(list(enumerate([harina, huevo, leche])))
+            ]
+        }
+        db = TestingSessionLocal()
+        reconstruir_estadisticas(db)
+        db.commit()
+        db.close()
+        assert client.get("/estadisticas").json() == estadisticas
+    
+    def test_listar_recetas_con_filtros_y_orden(self, client):
+        """Probar filtros por tiempo, porciones y número de pasos, y los distintos órdenes"""
+        paso = {"numero_paso": 1, "descripcion": "Paso"}
+        rapida = client.post("/recetas", json={"nombre": "Rápida", "tiempo_preparacion": 10, "porciones": 2, "pasos": [paso]}).json()["id"]
+        media = client.post("/recetas", json={"nombre": "Media", "tiempo_preparacion": 30, "porciones": 4, "pasos": [paso, paso]}).json()["id"]
+        lenta = client.post("/recetas", json={"nombre": "Lenta", "tiempo_preparacion": 90, "porciones": 4}).json()["id"]
+        
+        ids = lambda url: [receta["id"] for receta in client.get(url).json()]
+        assert ids("/recetas?tiempo_max=30") == [rapida, media]
+        assert ids("/recetas?tiempo_min=20&porciones_min=4") == [media, lenta]
+        assert ids("/recetas?max_pasos=1") == [rapida, lenta]
+        assert ids("/recetas?orden=-tiempo") == [lenta, media, rapida]
+        assert ids("/recetas?orden=nombre") == [lenta, media, rapida]
+        
+        # El número de pasos se actualiza con cada paso agregado o eliminado
+        client.post(f"/recetas/{rapida}/pasos", json={"numero_paso": 2, "descripcion": "Otro"})
+        assert ids("/recetas?max_pasos=1") == [lenta]
+        assert client.get("/recetas?orden=otro").status_code == 400
+    
+    def test_listar_recetas_por_categoria_con_facetas(self, client):
+        """Probar el filtro por categoría de ingredientes y los conteos de facetas"""
+        lacteo, vegetal, carne = self._crear_ingredientes(["lácteos", "vegetales", "carnes"])
+        a = client.post("/recetas", json={"nombre": "A", "tiempo_preparacion": 10, "porciones": 2, "ingredientes": [
+            {"ingrediente_id": lacteo, "cantidad": 1}, {"ingrediente_id": vegetal, "cantidad": 1}
+        ]}).json()["id"]
+        b = client.post("/recetas", json={"nombre": "B", "tiempo_preparacion": 45, "ingredientes": [
+            {"ingrediente_id": vegetal, "cantidad": 1}, {"ingrediente_id": carne, "cantidad": 1}
+        ]}).json()["id"]
+        client.post("/recetas", json={"nombre": "C"})
+        
+        ids = lambda url: [receta["id"] for receta in client.get(url).json()]
+        assert ids("/recetas?categoria=vegetales") == [a, b]
+        assert ids("/recetas?categoria=vegetales&categoria=carnes") == [b]
+        assert ids("/recetas?categoria=frutas") == []
+        
+        response = client.get("/recetas?categoria=vegetales&facetas=true")
+        assert response.status_code == 200
+        cuerpo = response.json()
+        assert [receta["id"] for receta in cuerpo["recetas"]] == [a, b]
+        assert cuerpo["facetas"] == {
+            "total": 2,
+            "categorias": {"carnes": 1, "lácteos": 1, "vegetales": 2},
+            "num_pasos": {"0": 2},
+            "tiempo_preparacion": {"0-15": 1, "31-60": 1},
+            "porciones": {"2": 1},
+        }
+        assert client.get("/recetas?facetas=true").json()["facetas"]["total"] == 3
+        
+        # El esquema OpenAPI declara las dos formas de la respuesta
+        esquema = client.get("/openapi.json").json()
+        respuesta = esquema["paths"]["/recetas"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+        formas = [forma.get("$ref", forma.get("type")) for forma in respuesta["anyOf"]]
+        assert formas == ["array", "#/components/schemas/RecetasConFacetasResponse"]
+        assert set(esquema["components"]["schemas"]["FacetasResponse"]["properties"]) == set(cuerpo["facetas"])
+    
+    def test_campos_e_incluir_en_recetas(self, client):
+        """Probar que ?fields= e ?incluir= recortan la respuesta del listado y del detalle"""
+        lacteo, = self._crear_ingredientes(["lácteos"])
+        receta_id = client.post("/recetas", json={
+            "nombre": "Flan", "descripcion": "Postre", "tiempo_preparacion": 40,
+            "pasos": [{"numero_paso": 1, "descripcion": "Caramelizar"}],
+            "ingredientes": [{"ingrediente_id": lacteo, "cantidad": 500}]
+        }).json()["id"]
+        
+        # Por defecto la forma no cambia: todas las columnas y los pasos
+        completa = client.get("/recetas").json()[0]
+        assert set(completa) == {"id", "nombre", "descripcion", "tiempo_preparacion", "porciones", "pasos"}
+        
+        assert client.get("/recetas?fields=id,nombre&incluir=").json() == [{"id": receta_id, "nombre": "Flan"}]
+        assert client.get("/recetas?fields=nombre,tiempo_preparacion&incluir=").json() == [
+            {"nombre": "Flan", "tiempo_preparacion": 40}
+        ]
+        
+        detalle = client.get(f"/recetas/{receta_id}?fields=nombre&incluir=ingredientes").json()
+        assert detalle == {
+            "nombre": "Flan",
+            "ingredientes": [{"ingrediente_id": lacteo, "cantidad": 500.0, "nombre_ingrediente": "ing-0"}]
+        }
+        
+        assert client.get("/recetas?fields=id,calorias").status_code == 400
+        assert client.get(f"/recetas/{receta_id}?incluir=comentarios").status_code == 400
+    
+    def _crear_con_pasos(self, client, descripciones):
+        receta = client.post("/recetas", json={"nombre": "Con pasos", "pasos": [
+            {"numero_paso": i, "descripcion": d} for i, d in enumerate(descripciones, 1)
+        ]}).json()
+        return receta["id"], {paso["descripcion"]: paso["id"] for paso in receta["pasos"]}
+    
+    def test_reemplazar_pasos_con_diferencia_minima(self, client):
+        """Probar que PUT de pasos sólo inserta, actualiza y elimina lo necesario"""
+        receta_id, ids = self._crear_con_pasos(client, ["Picar", "Sofreír", "Hervir", "Servir"])
+        
+        # Reordenar por id y cambiar un texto: sólo actualizaciones
+        response = client.put(f"/recetas/{receta_id}/pasos", json=[
+            {"id": ids["Sofreír"], "numero_paso": 1, "descripcion": "Sofreír"},
+            {"id": ids["Picar"], "numero_paso": 2, "descripcion": "Picar"},
+            {"id": ids["Hervir"], "numero_paso": 3, "descripcion": "Hervir 10 minutos"},
+            {"id": ids["Servir"], "numero_paso": 4, "descripcion": "Servir"},
+        ])
+        assert response.status_code == 200
+        cuerpo = response.json()
+        assert (cuerpo["insertados"], cuerpo["actualizados"], cuerpo["eliminados"]) == (0, 3, 0)
+        assert [p["descripcion"] for p in cuerpo["pasos"]] == ["Sofreír", "Picar", "Hervir 10 minutos", "Servir"]
+        
+        # Sin ids: se reutilizan los pasos con la misma descripción
+        response = client.put(f"/recetas/{receta_id}/pasos", json=[
+            {"numero_paso": 1, "descripcion": "Sofreír"},
+            {"numero_paso": 2, "descripcion": "Emplatar"},
+            {"numero_paso": 3, "descripcion": "Servir"},
+        ])
+        cuerpo = response.json()
+        assert (cuerpo["insertados"], cuerpo["actualizados"], cuerpo["eliminados"]) == (1, 1, 2)
+        assert [p["id"] for p in cuerpo["pasos"]][0] == ids["Sofreír"]
+        assert [p["descripcion"] for p in client.get(f"/recetas/{receta_id}").json()["pasos"]] == ["Sofreír", "Emplatar", "Servir"]
+        assert [r["id"] for r in client.get("/recetas?max_pasos=3").json()] == [receta_id]
+    
+    def test_reemplazar_pasos_errores(self, client):
+        """Probar receta inexistente y pasos de otra receta"""
+        assert client.put("/recetas/999/pasos", json=[]).status_code == 404
+        _, ajenos = self._crear_con_pasos(client, ["Ajeno"])
+        receta_id, _ = self._crear_con_pasos(client, ["Propio"])
+        response = client.put(f"/recetas/{receta_id}/pasos", json=[
+            {"id": ajenos["Ajeno"], "numero_paso": 1, "descripcion": "Ajeno"}
+        ])
+        assert response.status_code == 400
+    
+    def test_mover_paso(self, client):
+        """Probar que PATCH mueve un paso y corre los intermedios"""
+        receta_id, ids = self._crear_con_pasos(client, ["A", "B", "C", "D", "E"])
+        
+        response = client.patch(f"/recetas/{receta_id}/pasos/{ids['B']}", json={"numero_paso": 4})
+        assert response.status_code == 200
+        assert [(p["descripcion"], p["numero_paso"]) for p in response.json()] == [
+            ("A", 1), ("C", 2), ("D", 3), ("B", 4), ("E", 5)
+        ]
+        response = client.patch(f"/recetas/{receta_id}/pasos/{ids['E']}", json={"numero_paso": 1})
+        assert [p["descripcion"] for p in response.json()] == ["E", "A", "C", "D", "B"]
+        
+        assert client.patch(f"/recetas/{receta_id}/pasos/{ids['A']}", json={"numero_paso": 9}).status_code == 400
+        assert client.patch(f"/recetas/{receta_id}/pasos/999", json={"numero_paso": 1}).status_code == 404
+    
+    def test_eliminar_receta_borra_hijos_por_cascada(self, client):
+        """Probar que el DELETE de la receta borra pasos, ingredientes y resumen en la base de datos"""
+        ingrediente_id, = self._crear_ingredientes(["verduras"])
+        receta_id = client.post("/recetas", json={
+            "nombre": "Ensalada",
+            "pasos": [{"numero_paso": 1, "descripcion": "Lavar"}],
+            "ingredientes": [{"ingrediente_id": ingrediente_id, "cantidad": 1.0}]
+        }).json()["id"]
+        
+        assert client.delete(f"/recetas/{receta_id}").status_code == 200
+        assert client.delete(f"/recetas/{receta_id}").status_code == 404
+        with engine.connect() as conn:
+            for tabla in ("pasos", "receta_ingrediente", "receta_resumen"):
+                assert conn.exec_driver_sql(f"SELECT COUNT(*) FROM {tabla}").scalar() == 0
+    
+    def test_eliminar_recetas_en_bloque(self, client):
+        """Probar el borrado masivo por ids y por filtros, y sus eventos de cambio"""
+        paso = {"numero_paso": 1, "descripcion": "Paso"}
+        ids = [
+            client.post("/recetas", json={"nombre": f"R{i}", "tiempo_preparacion": 10 * i, "pasos": [paso]}).json()["id"]
+            for i in range(1, 6)
+        ]
+        
+        assert client.delete("/recetas").status_code == 400
+        assert client.delete("/recetas?ids=1,x").status_code == 400
+        
+        response = client.delete(f"/recetas?ids={ids[0]},{ids[1]},999")
+        assert response.status_code == 200
+        assert response.json() == {"eliminadas": 2, "ids": ids[:2]}
+        
+        # ids y filtros se combinan: solo las de la lista que cumplen el filtro
+        response = client.delete(f"/recetas?ids={ids[2]},{ids[3]}&tiempo_min=40")
+        assert response.json() == {"eliminadas": 1, "ids": [ids[3]]}
+        
+        response = client.delete("/recetas?max_pasos=1")
+        assert response.json() == {"eliminadas": 2, "ids": [ids[2], ids[4]]}
+        assert client.get("/recetas").json() == []
+        
+        eliminados = [c["entidad_id"] for c in client.get("/cambios?limit=100").json()["cambios"] if c["operacion"] == "eliminar"]
+        assert sorted(eliminados) == sorted(ids)
+        with engine.connect() as conn:
+            assert conn.exec_driver_sql("SELECT COUNT(*) FROM pasos").scalar() == 0
+    
+    def test_init_db_migra_claves_foraneas(self, tmp_path, caplog):
+        """Probar que init_db agrega ON DELETE CASCADE a una base creada sin él y borra (e informa) huérfanos"""
+        from sqlalchemy import MetaData, inspect
+        motor = create_engine(f"sqlite:///{tmp_path / 'antigua.db'}")
+        antiguo = MetaData()
+        for tabla in Base.metadata.sorted_tables:
+            tabla.to_metadata(antiguo)
+        for tabla in antiguo.tables.values():
+            for restriccion in tabla.foreign_key_constraints:
+                restriccion.ondelete = None
+        antiguo.create_all(motor)
+        with motor.connect() as conn:
+            conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            conn.exec_driver_sql("INSERT INTO recetas (id, nombre) VALUES (1, 'Sopa')")
+            conn.exec_driver_sql("INSERT INTO pasos (receta_id, numero_paso, descripcion) VALUES (1, 1, 'Hervir'), (7, 1, 'Huérfano')")
+            conn.commit()
+        
+        with caplog.at_level("WARNING", logger="database.db_config"):
+            assert init_db(motor)
+        assert "1 filas huérfanas borradas de pasos" in caplog.text
+        claves = inspect(motor).get_foreign_keys("pasos")
+        assert claves[0]["options"].get("ondelete") == "CASCADE"
+        assert {i["name"] for i in inspect(motor).get_indexes("pasos")} >= {"ix_pasos_receta_id"}
+        with motor.begin() as conn:
+            assert conn.exec_driver_sql("SELECT descripcion FROM pasos").scalars().all() == ["Hervir"]
+            conn.exec_driver_sql("DELETE FROM recetas")
+            assert conn.exec_driver_sql("SELECT COUNT(*) FROM pasos").scalar() == 0
+        motor.dispose()
+    
+    def test_init_db_concurrente_migra_una_vez(self, tmp_path):
+        """Probar que varios procesos que arrancan a la vez migran una sola vez y sin errores"""
+        import subprocess
+        from sqlalchemy import MetaData
+        url = f"sqlite:///{tmp_path / 'antigua.db'}"
+        motor = create_engine(url)
+        antiguo = MetaData()
+        for tabla in Base.metadata.sorted_tables:
+            tabla.to_metadata(antiguo)
+        for tabla in antiguo.tables.values():
+            for restriccion in tabla.foreign_key_constraints:
+                restriccion.ondelete = None
+        antiguo.create_all(motor)
+        motor.dispose()
+        
+        codigo = (
+            "import sys; from sqlalchemy import create_engine; from database import init_db; "
+            f"print(init_db(create_engine({url!r})))"
+        )
+        raiz = os.path.join(os.path.dirname(__file__), '..')
+        procesos = [
+            subprocess.Popen([sys.executable, "-c", codigo], cwd=raiz, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            for _ in range(4)
+        ]
+        salidas = [proceso.communicate(timeout=60) for proceso in procesos]
+        assert all(proceso.returncode == 0 for proceso in procesos), [error for _, error in salidas]
+        assert sorted(salida.strip() for salida, _ in salidas) == ["False", "False", "False", "True"]
+    
+    def test_memoria_muestra_identity_map(self, client, monkeypatch):
+        """Probar que /debug/memoria cuenta los objetos cargados en sesiones abiertas"""
+        monkeypatch.setenv("DEBUG_TOKEN", "secreto")
+        client.post("/recetas", json={"nombre": "Sopa", "pasos": []})
+        db = TestingSessionLocal()
+        # El identity map guarda referencias débiles: mantener los objetos vivos
+        recetas = db.query(Receta).all()
+        try:
+            datos = client.get("/debug/memoria", headers={"X-Debug-Token": "secreto"}).json()
+            assert datos["identity_map"]["por_modelo"].get("Receta", 0) >= len(recetas) == 1
+        finally:
+            db.close()
+            import tracemalloc
+            tracemalloc.stop()
+    
+    def test_snapshot_responde_igual_que_sql(self, client, monkeypatch):
+        """Probar que con el snapshot activo obtener y listar devuelven lo mismo que las consultas SQL"""
+        from servicio_recetas import app as app_module
+        harina, huevo = self._crear_ingredientes(["harinas", "proteínas"])
+        for i, (tiempo, porciones) in enumerate([(30, 4), (None, 2), (10, None), (30, 6), (45, 4)]):
+            client.post("/recetas", json={
+                "nombre": ["Tarta", "Budín", "Arepa", "Tarta", "Sopa"][i],
+                "descripcion": None if i % 2 else "Casera",
+                "tiempo_preparacion": tiempo,
+                "porciones": porciones,
+                "pasos": [{"numero_paso": n, "descripcion": "Mezclar" if n == 1 else "Servir"} for n in range(1, i + 2)],
+                "ingredientes": [{"ingrediente_id": harina, "cantidad": 100.0}] + ([{"ingrediente_id": huevo, "cantidad": 2.0}] if i % 2 else [])
+            })
+        urls = [
+            "/recetas", "/recetas?orden=tiempo", "/recetas?orden=-tiempo", "/recetas?orden=nombre",
+            "/recetas?orden=-nombre&skip=1&limit=3", "/recetas?tiempo_min=20&porciones_max=4",
+            "/recetas?max_pasos=2&incluir=ingredientes", "/recetas?fields=nombre,id&incluir=",
+            "/recetas/1", "/recetas/2?incluir=pasos,ingredientes", "/recetas/3?fields=porciones", "/recetas/99",
+        ]
+        esperado = [(client.get(url).status_code, client.get(url).json()) for url in urls]
+        
+        monkeypatch.setattr(app_module, "SNAPSHOT_ACTIVO", True)
+        monkeypatch.setattr(app_module, "snapshot_recetas", SnapshotRecetas(intervalo=0))
+        assert [(client.get(url).status_code, client.get(url).json()) for url in urls] == esperado
+        assert app_module.snapshot_recetas.total_recetas == 5
+    
+    def test_snapshot_refleja_escrituras(self, client, monkeypatch):
+        """Probar que las escrituras propias se ven al instante y las de otros procesos al comprobar la versión"""
+        from servicio_recetas import app as app_module
+        snapshot = SnapshotRecetas(intervalo=3600)
+        monkeypatch.setattr(app_module, "SNAPSHOT_ACTIVO", True)
+        monkeypatch.setattr(app_module, "snapshot_recetas", snapshot)
+        
+        receta_id = client.post("/recetas", json={"nombre": "Guiso", "pasos": []}).json()["id"]
+        client.put(f"/recetas/{receta_id}", json={"tiempo_preparacion": 90})
+        client.post(f"/recetas/{receta_id}/pasos", json={"numero_paso": 1, "descripcion": "Dorar"})
+        receta = client.get(f"/recetas/{receta_id}").json()
+        assert (receta["tiempo_preparacion"], [p["descripcion"] for p in receta["pasos"]]) == (90, ["Dorar"])
+        
+        # Escritura de otro worker: directa en la base de datos y en el registro de cambios
+        db = TestingSessionLocal()
+        db.add(Receta(id=50, nombre="Externa"))
+        registrar_cambio(db, "receta", 50, "crear")
+        db.commit()
+        db.close()
+        assert client.get("/recetas/50").status_code == 404
+        snapshot.intervalo = 0
+        assert client.get("/recetas/50").json()["nombre"] == "Externa"
+        
+        client.delete(f"/recetas/{receta_id}")
+        assert [r["id"] for r in client.get("/recetas").json()] == [50]
+    
+    @pytest.fixture
+    def trabajos(self, monkeypatch, tmp_path):
+        """Ejecutor de trabajos de la app apuntando a la base de pruebas y a un directorio temporal"""
+        from servicio_recetas import app as app_module
+        ejecutor = app_module.ejecutor_trabajos
+        monkeypatch.setattr(ejecutor, "session_factory", TestingSessionLocal)
+        monkeypatch.setattr(ejecutor, "directorio", str(tmp_path))
+        return ejecutor
+    
+    def test_trabajos_exportar_e_importar(self, client, trabajos):
+        """Probar que export e importación se encolan, informan su avance y dejan un archivo descargable"""
+        harina, = self._crear_ingredientes(["harinas"])
+        for nombre in ("Pan", "Pizza"):
+            client.post("/recetas", json={
+                "nombre": nombre,
+                "pasos": [{"numero_paso": 1, "descripcion": "Amasar"}],
+                "ingredientes": [{"ingrediente_id": harina, "cantidad": 500.0}]
+            })
+        
+        response = client.post("/jobs", json={"tipo": "exportar_recetas"})
+        assert response.status_code == 202
+        trabajo_id = response.json()["id"]
+        assert client.get(f"/jobs/{trabajo_id}").json()["estado"] == "pendiente"
+        assert client.get(f"/jobs/{trabajo_id}/resultado").status_code == 409
+        
+        assert trabajos.procesar_pendiente() == trabajo_id
+        assert trabajos.procesar_pendiente() is None
+        estado = client.get(f"/jobs/{trabajo_id}").json()
+        assert (estado["estado"], estado["progreso"], estado["resultado"]) == ("completado", 1.0, {"recetas": 2})
+        export = client.get(f"/jobs/{trabajo_id}/resultado")
+        assert export.headers["content-type"] == "application/x-ndjson"
+        assert [json.loads(linea)["nombre"] for linea in export.text.splitlines()] == ["Pan", "Pizza"]
+        
+        # Reimportar el export, con una línea inválida y otra con un ingrediente inexistente
+        cuerpo = export.text + '{"nombre": 5}\n\n' + json.dumps({
+            "nombre": "Fantasma", "ingredientes": [{"ingrediente_id": 999, "cantidad": 1.0}]
+        }) + "\n"
+        response = client.post("/jobs/importar", content=cuerpo, headers={"Content-Type": "application/x-ndjson"})
+        assert response.status_code == 202
+        importacion_id = response.json()["id"]
+        trabajos.procesar_pendiente()
+        estado = client.get(f"/jobs/{importacion_id}").json()
+        assert estado["resultado"] == {"importadas": 2, "con_errores": 2}
+        informe = client.get(f"/jobs/{importacion_id}/resultado").json()
+        assert [error["linea"] for error in informe["errores"]] == [3, 5]
+        
+        recetas = client.get("/recetas?incluir=pasos,ingredientes").json()
+        assert [receta["nombre"] for receta in recetas] == ["Pan", "Pizza", "Pan", "Pizza"]
+        assert recetas[2]["pasos"][0]["descripcion"] == "Amasar"
+        assert recetas[3]["ingredientes"][0]["ingrediente_id"] == harina
+        assert client.get("/recetas?max_pasos=1").json()[3]["id"] == recetas[3]["id"]
+    
+    def test_trabajos_errores_y_reclamo_de_abandonados(self, client, trabajos):
+        """Probar validaciones, reconstruir índices y que un trabajo sin latido lo retoma otro trabajador"""
+        from datetime import datetime, timedelta, timezone
+        from database import EjecutorTrabajos, Trabajo
+        from database.trabajos import ContextoTrabajo, TrabajoPerdido
+        assert client.post("/jobs", json={"tipo": "desconocido"}).status_code == 400
+        assert client.post("/jobs", json={"tipo": "importar_recetas", "parametros": {"entrada": "/etc/passwd"}}).status_code == 400
+        assert client.post("/jobs/importar", content=b"").status_code == 400
+        assert client.get("/jobs/99").status_code == 404
+        
+        client.post("/recetas", json={"nombre": "Tarta", "pasos": [{"numero_paso": 1, "descripcion": "Hornear"}]})
+        trabajo_id = client.post("/jobs", json={"tipo": "reconstruir_indices"}).json()["id"]
+        
+        # Un trabajador lo reclama y deja de latir
+        caido = EjecutorTrabajos(session_factory=TestingSessionLocal, directorio=trabajos.directorio)
+        assert caido._reclamar() == trabajo_id
+        db = TestingSessionLocal()
+        db.get(Trabajo, trabajo_id).latido_en = datetime.now(timezone.utc) - timedelta(minutes=10)
+        db.commit()
+        contexto = ContextoTrabajo(caido, db.get(Trabajo, trabajo_id))
+        db.close()
+        
+        assert trabajos.procesar_pendiente() == trabajo_id
+        estado = client.get(f"/jobs/{trabajo_id}").json()
+        assert (estado["estado"], estado["intentos"], estado["resultado"]) == ("completado", 2, {"recetas": 1})
+        assert client.get(f"/jobs/{trabajo_id}/resultado").status_code == 404
+        # El trabajador caído ya no puede escribir sobre un trabajo que no es suyo
+        with pytest.raises(TrabajoPerdido):
+            contexto.avance(0.5, forzar=True)
+    
+    def test_reconstruir_indices_informa_avance_por_lote(self, client, monkeypatch):
+        """Probar que el avance no retrocede y que el recálculo de firmas MinHash también late por lote"""
+        from servicio_recetas import app as app_module
+        from servicio_recetas import duplicados
+        for nombre in ("Pan", "Pizza", "Tarta", "Flan", "Sopa"):
+            client.post("/recetas", json={"nombre": nombre})
+        monkeypatch.setattr(app_module, "TAMANO_LOTE_EXPORT", 2)
+        monkeypatch.setattr(duplicados, "LOTE_FIRMAS", 2)
+        
+        class TrabajoFalso:
+            def __init__(self):
+                self.avances = []
+            
+            def avance(self, progreso, mensaje=None, forzar=False):
+                self.avances.append((round(progreso, 2), mensaje))
+        
+        trabajo = TrabajoFalso()
+        db = TestingSessionLocal()
+        try:
+            assert app_module.trabajo_reconstruir_indices(db, trabajo) == {"recetas": 5}
+        finally:
+            db.close()
+        progresos = [progreso for progreso, _ in trabajo.avances]
+        assert progresos == sorted(progresos) and max(progresos) <= 1
+        assert [p for p, m in trabajo.avances if m == "Recalculando resúmenes"] == [0.24, 0.48, 0.6]
+        assert [p for p, m in trabajo.avances if m == "Recalculando firmas MinHash"] == [0.6, 0.72, 0.84, 0.9]
+    
+    def test_cache_compartida_entre_procesos(self, client, monkeypatch):
+        """Probar que con caché se responde igual que sin ella y que una escritura invalida la de otro proceso"""
+        import time
+        from servicio_recetas import app as app_module
+        from comun.cache import CacheCompartida, CacheRedis, ServidorRESP
+        harina, = self._crear_ingredientes(["harinas"])
+        for nombre in ("Pan", "Pizza", "Tarta"):
+            client.post("/recetas", json={
+                "nombre": nombre,
+                "pasos": [{"numero_paso": 1, "descripcion": "Amasar"}],
+                "ingredientes": [{"ingrediente_id": harina, "cantidad": 500.0}]
+            })
+        urls = ["/recetas", "/recetas?orden=-nombre&limit=2", "/recetas?fields=nombre&incluir=ingredientes",
+                "/recetas/2", "/recetas/3?fields=nombre,id&incluir=", "/recetas/99"]
+        esperado = [(client.get(url).status_code, client.get(url).json()) for url in urls]
+        
+        servidor = ServidorRESP().iniciar()
+        # Dos procesos del servicio con el mismo almacenamiento
+        propia, ajena = (CacheCompartida(CacheRedis.desde_url(servidor.url)) for _ in range(2))
+        try:
+            monkeypatch.setattr(app_module, "cache", ajena)
+            assert [(client.get(url).status_code, client.get(url).json()) for url in urls] == esperado
+            assert ajena.aciertos > 0 and ajena.errores == 0
+            
+            monkeypatch.setattr(app_module, "cache", propia)
+            client.put("/recetas/2", json={"nombre": "Fugazza"})
+            assert client.get("/recetas/2").json()["nombre"] == "Fugazza"
+            # El otro proceso se entera por pub/sub, sin esperar a releer la versión
+            limite = time.monotonic() + 2
+            while ajena.version("recetas") != propia.version("recetas") and time.monotonic() < limite:
+                time.sleep(0.01)
+            monkeypatch.setattr(app_module, "cache", ajena)
+            assert [r["nombre"] for r in client.get("/recetas").json()] == ["Pan", "Fugazza", "Tarta"]
+        finally:
+            propia.almacenamiento.cerrar()
+            ajena.almacenamiento.cerrar()
+            servidor.detener()
+
+
+class TestReplicasLectura:
+    """Pruebas de la separación de lecturas (réplica) y escrituras (primaria)"""
+    
+    @pytest.fixture
+    def replica(self, test_db):
+        """Segunda base SQLite como réplica de lectura"""
+        url = "sqlite:///./test_recetas_replica.db"
+        enrutador = configurar_replicas([url], politica="round_robin", ventana=60)
+        motor = enrutador.replicas[0].engine
+        Base.metadata.create_all(bind=motor)
+        yield enrutador.replicas[0].sesiones
+        configurar_replicas([])
+        Base.metadata.drop_all(bind=motor)
+        motor.dispose()
+        os.remove("./test_recetas_replica.db")
+    
+    def test_lecturas_en_replica_y_lectura_propia(self, client, replica):
+        """Probar que las lecturas van a la réplica salvo justo después de escribir"""
+        db = replica()
+        db.add(Receta(id=50, nombre="Solo en la réplica"))
+        db.commit()
+        db.close()
+        
+        assert [r["nombre"] for r in client.get("/recetas").json()] == ["Solo en la réplica"]
+        
+        # Tras escribir, el mismo cliente lee de la primaria y ve su receta
+        headers = {"X-API-Key": "escritor"}
+        creada = client.post("/recetas", json={"nombre": "Nueva"}, headers=headers).json()
+        assert client.get(f"/recetas/{creada['id']}", headers=headers).status_code == 200
+        assert [r["nombre"] for r in client.get("/recetas", headers=headers).json()] == ["Nueva"]
+        
+        # Otro cliente (sin la cookie del escritor) sigue leyendo de la réplica
+        otro = TestClient(app).get("/recetas", headers={"X-API-Key": "lector"}).json()
+        assert [r["nombre"] for r in otro] == ["Solo en la réplica"]
+    
+    def test_lectura_propia_entre_instancias(self, client, replica):
+        """Probar que la lectura propia se respeta en otra instancia que no vio la escritura"""
+        import database.replicas as replicas
+        db = replica()
+        db.add(Receta(id=50, nombre="Solo en la réplica"))
+        db.commit()
+        db.close()
+        
+        headers = {"X-API-Key": "escritor"}
+        respuesta = client.post("/recetas", json={"nombre": "Nueva"}, headers=headers)
+        assert "lectura_propia=" in respuesta.headers["set-cookie"]
+        
+        # Otra instancia (worker o réplica del servicio) no tiene la marca en memoria
+        replicas.enrutador._escrituras.clear()
+        assert [r["nombre"] for r in client.get("/recetas", headers=headers).json()] == ["Nueva"]
+        # Sin la cookie la misma clave ya no se distingue: va a la réplica
+        sin_cookie = TestClient(app).get("/recetas", headers=headers).json()
+        assert [r["nombre"] for r in sin_cookie] == ["Solo en la réplica"]
+        # Una cookie más allá de la ventana no fuerza la primaria
+        forjada = TestClient(app, cookies={"lectura_propia": "99999999999"})
+        assert [r["nombre"] for r in forjada.get("/recetas").json()] == ["Solo en la réplica"]
+    
+    def test_snapshot_no_retrocede_con_replica_atrasada(self, client, replica, monkeypatch):
+        """Probar que el snapshot se sincroniza con la primaria aunque la lectura vaya a una réplica atrasada"""
+        from servicio_recetas import app as app_module
+        from database import Cambio
+        monkeypatch.setattr(app_module, "SNAPSHOT_ACTIVO", True)
+        monkeypatch.setattr(app_module, "snapshot_recetas", SnapshotRecetas(intervalo=0))
+        escritor = {"X-API-Key": "escritor"}
+        ids = [client.post("/recetas", json={"nombre": nombre}, headers=escritor).json()["id"] for nombre in ("A", "B")]
+        
+        # La réplica recibe hasta aquí y después se atrasa
+        primaria, copia = TestingSessionLocal(), replica()
+        for modelo in (Receta, Cambio):
+            for fila in primaria.query(modelo).all():
+                copia.add(modelo(**{c.key: getattr(fila, c.key) for c in modelo.__table__.columns}))
+        copia.commit()
+        primaria.close()
+        copia.close()
+        nueva = client.post("/recetas", json={"nombre": "C"}, headers=escritor).json()["id"]
+        assert TestClient(app).get("/recetas", headers={"X-API-Key": "lector"}).status_code == 200
+        # Dentro del intervalo el escritor lee lo que dejó esa sincronización
+        app_module.snapshot_recetas.intervalo = 3600
+        assert client.get(f"/recetas/{nueva}", headers=escritor).status_code == 200
+        assert [r["id"] for r in client.get("/recetas", headers=escritor).json()] == ids + [nueva]
+        
+        # Aun sincronizado directamente con la réplica, el snapshot no vuelve atrás
+        atrasada = replica()
+        app_module.snapshot_recetas.sincronizar(atrasada)
+        atrasada.close()
+        assert app_module.snapshot_recetas.total_recetas == 3
+    
+    def test_cache_se_calcula_desde_la_primaria(self, client, replica, monkeypatch):
+        """Probar que una réplica atrasada no deja datos viejos en la caché compartida"""
+        from servicio_recetas import app as app_module
+        from comun.cache import CacheCompartida, CacheMemoria
+        monkeypatch.setattr(app_module, "cache", CacheCompartida(CacheMemoria()))
+        receta_id = client.post("/recetas", json={"nombre": "Fugazza"}, headers={"X-API-Key": "escritor"}).json()["id"]
+        db = replica()
+        db.add(Receta(id=receta_id, nombre="Pizza"))
+        db.commit()
+        db.close()
+        
+        # El listado toma los ids de la réplica, pero lo que se cachea sale de la primaria
+        lector = TestClient(app)
+        assert [r["nombre"] for r in lector.get("/recetas").json()] == ["Fugazza"]
+        assert lector.get(f"/recetas/{receta_id}").json()["nombre"] == "Fugazza"
+        assert app_module.cache.aciertos > 0
+    
+    def test_politicas_y_ventana(self):
+        """Probar turnos, menor carga y la expiración de la lectura propia"""
+        enrutador = EnrutadorLecturas(["sqlite://", "sqlite://"], politica="round_robin", ventana=5)
+        a, b = enrutador.replicas
+        assert [enrutador.elegir() for _ in range(4)] == [a, b, a, b]
+        
+        enrutador = EnrutadorLecturas(["sqlite://", "sqlite://"], politica="menos_cargada", ventana=5)
+        a, b = enrutador.replicas
+        primera = enrutador.elegir()
+        assert enrutador.elegir() is not primera
+        enrutador.liberar(a)
+        assert enrutador.elegir() is a
+        
+        enrutador.marcar_escritura("ip:1.2.3.4", ahora=100)
+        assert enrutador.requiere_primaria("ip:1.2.3.4", ahora=104)
+        assert not enrutador.requiere_primaria("ip:1.2.3.4", ahora=106)
+        assert not enrutador.requiere_primaria("ip:5.6.7.8", ahora=100)
+        with pytest.raises(ValueError):
+            EnrutadorLecturas([], politica="aleatoria")
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])